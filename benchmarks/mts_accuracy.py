@@ -0,0 +1,146 @@
+"""
+Accuracy of RK4 with electronic sub-steps (`mts_substeps`) against plain
+RK4 steps on model Hamiltonians (QC_RUNNER = 'model'). Other step schemes
+(`rk_method`, e.g. 'split') are compared with `--rk-methods`.
+
+Every configuration propagates the same trajectory (ethylene normal modes
+of examples/gamess_ethylene, fixed `input_seed`) with `pysces` in its own
+directory. A run with the small step `--ref-step` (and `--ref-substeps`,
+which removes the first-order error of frozen QC results within the step)
+is the reference. Reported
+per configuration:
+
+    method        rk_method
+    H (a.u.)      nuclear (QC) step
+    QC calls      electronic structure evaluations, one per step
+    pop. error    largest deviation of the state populations from the reference
+    geo. error    largest RMS deviation of the Cartesian geometry (bohr)
+    E drift       largest deviation of the total energy from its initial value (hartree)
+    time (s)      wall time of the run
+
+Models: 'spin_boson' (2 states), 'lvc' (3 states with random couplings) or
+an LVC/QVC file written by `pysces lvc` (`--model-file`).
+
+    python benchmarks/mts_accuracy.py --model lvc --steps 0.5 1 2 4 8 --substeps 1 8
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+import numpy as np
+
+PYSCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pysces')
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'gamess_ethylene')
+MOLECULE_FILES = ['geo_gamess', 'hess_gamess', 'mass_gamess']
+
+
+def lvc_params(seed, gap):
+    '''
+        Three states with vertical gaps `gap` and 0.75*`gap` (hartree), all
+        modes coupled
+    '''
+    rng = np.random.default_rng(seed)
+    n_modes = 12
+    lam = 0.003*np.abs(rng.normal(size=(3, 3, n_modes)))*(1 - np.eye(3))[..., None]
+    return {
+        'energies': [0.0, gap, 1.75*gap],
+        'kappa': (0.004*rng.normal(size=(3, n_modes))).tolist(),
+        'lam': (0.5*(lam + lam.transpose(1, 0, 2))).tolist(),
+    }
+
+
+def model_settings(args):
+    if args.model_file is not None:
+        n_states = len(np.load(args.model_file)['energies'])
+        return n_states, {'model_file': os.path.abspath(args.model_file)}
+    if args.model == 'spin_boson':
+        return 2, {'model_type': 'spin_boson', 'model_params': {'epsilon': 0.0, 'delta': 0.005, 'xi': 0.5}}
+    return 3, {'model_type': 'lvc', 'model_params': lvc_params(args.seed, args.gap)}
+
+
+def run_config(work_dir, n_states, model, method, H, n_sub, args):
+    run_dir = os.path.join(work_dir, f'{method}_H{H:g}_sub{n_sub}')
+    os.makedirs(run_dir)
+    for name in MOLECULE_FILES:
+        shutil.copy(os.path.join(EXAMPLE_DIR, name), run_dir)
+    settings = {
+        'nel': n_states, 'natom': 6,
+        'QC_RUNNER': 'model', 'mol_input_format': 'gamess',
+        'integrator': 'RK4', 'tmax_rk4': args.tmax, 'Hrk4': H,
+        'rk_method': method, 'mts_substeps': n_sub,
+        'init_state': n_states - 1, 'input_seed': args.seed,
+        **model,
+    }
+    with open(os.path.join(run_dir, 'input_simulation_local.py'), 'w') as file:
+        for key, value in settings.items():
+            file.write(f'{key} = {value!r}\n')
+
+    start = time.time()
+    with open(os.path.join(run_dir, 'pysces.out'), 'w') as out:
+        proc = subprocess.run([sys.executable, os.path.join(PYSCES_DIR, 'main.py')], cwd=run_dir, stdout=out, stderr=subprocess.STDOUT)
+    wall = time.time() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f'run failed, see {run_dir}/pysces.out')
+
+    logs = os.path.join(run_dir, 'logs')
+    pops = np.loadtxt(os.path.join(logs, 'corr.txt'), skiprows=1)
+    energy = np.loadtxt(os.path.join(logs, 'energy.txt'), skiprows=1)
+    geoms = read_xyz(os.path.join(logs, 'nuc_geo.xyz'))
+    return {'method': method, 'H': H, 'substeps': n_sub, 'time': pops[:, 0], 'pops': pops[:, 2:], 'geoms': geoms,
+            'E drift': np.max(np.abs(energy[:, 1] - energy[0, 1])), 'QC calls': len(pops), 'wall': wall}
+
+
+def read_xyz(file_loc):
+    frames, lines = [], open(file_loc).read().split('\n')
+    i = 0
+    while i < len(lines) and lines[i].strip():
+        n = int(lines[i])
+        frames.append([[float(x) for x in line.split()[1:4]] for line in lines[i + 2:i + 2 + n]])
+        i += n + 2
+    return np.array(frames)/0.529177210903
+
+
+def compare(res, ref):
+    '''
+        Largest deviations from the reference at the times of `res`
+    '''
+    idx = np.searchsorted(ref['time'], res['time'] - 1e-8)
+    pop_error = np.max(np.abs(res['pops'] - ref['pops'][idx]))
+    n = min(len(res['geoms']), len(idx))
+    geo_error = np.max(np.sqrt(np.mean((res['geoms'][:n] - ref['geoms'][idx[:n]])**2, axis=(1, 2))))
+    return pop_error, geo_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='spin_boson', choices=['spin_boson', 'lvc'])
+    parser.add_argument('--gap', type=float, default=0.02, help="lowest vertical gap of the 'lvc' model (hartree)")
+    parser.add_argument('--model-file', default=None, help='LVC/QVC model written by `pysces lvc`')
+    parser.add_argument('--steps', type=float, nargs='+', default=[0.5, 1.0, 2.0, 4.0, 8.0], help='nuclear steps (a.u.)')
+    parser.add_argument('--substeps', type=int, nargs='+', default=[1, 4, 8], help='electronic sub-steps (1 = plain RK4)')
+    parser.add_argument('--rk-methods', nargs='+', default=['rk4'], help='rk_method of the compared runs')
+    parser.add_argument('--ref-step', type=float, default=0.1)
+    parser.add_argument('--ref-substeps', type=int, default=4)
+    parser.add_argument('--tmax', type=float, default=400.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    n_states, model = model_settings(args)
+    work_dir = tempfile.mkdtemp(prefix='mts_accuracy_')
+    ref = run_config(work_dir, n_states, model, 'rk4', args.ref_step, args.ref_substeps, args)
+    print(f'{n_states} states, {args.tmax:g} a.u., reference: rk4, H = {args.ref_step:g} a.u. with {args.ref_substeps} sub-steps ({ref["wall"]:.1f} s)')
+    print(f"{'method':>7s} {'H (a.u.)':>9s} {'sub-steps':>10s} {'QC calls':>9s} {'pop. error':>11s} {'geo. error':>11s} {'E drift':>10s} {'time (s)':>9s}")
+    for method in args.rk_methods:
+        for H in args.steps:
+            for n_sub in args.substeps:
+                res = run_config(work_dir, n_states, model, method, H, n_sub, args)
+                pop_error, geo_error = compare(res, ref)
+                print(f"{method:>7s} {H:9g} {n_sub:10d} {res['QC calls']:9d} {pop_error:11.2e} {geo_error:11.2e} {res['E drift']:10.2e} {res['wall']:9.1f}", flush=True)
+    print(f'runs left in {work_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Pseudo-random vs. randomized quasi-Monte Carlo initial conditions on a
+two-state spin-boson model.
+
+The Wigner population estimator of the initially occupied state is
+averaged over N trajectories. Each estimate is repeated with independent
+seeds, and the spread of the repeated estimates gives the actual error
+bar of both samplers. The RQMC error estimate from the replicate spread
+(`sampling.rqmc_estimate`) is printed next to it.
+
+    python benchmarks/qmc_sampling.py [--qmc sobol] [--repeats 20]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pysces'))
+from sampling import sample_batch, rqmc_estimate
+
+
+#   spin-boson model in atomic units: bias, coupling, modes
+EPS, DELTA = 0.002, 0.004
+W = np.array([0.001, 0.002, 0.004, 0.008])
+C = 0.5 * W**1.5 * 0.2
+BETA = 1.0 / (300 * 3.166811563e-6)
+N_STATES, INIT_STATE = 2, 1
+
+
+def potential(Q):
+    '''
+        Diabatic potential matrix and its derivative for a batch of geometries
+    '''
+    shift = Q @ C
+    V = np.empty(Q.shape[:-1] + (2, 2))
+    V[..., 0, 0] = EPS + shift
+    V[..., 1, 1] = -EPS - shift
+    V[..., 0, 1] = V[..., 1, 0] = DELTA
+    dV = np.zeros((2, 2, len(W)))
+    dV[0, 0], dV[1, 1] = C, -C
+    return V, dV
+
+
+def derivatives(y):
+    x, p, Q, P = y[:, 0, :2], y[:, 1, :2], y[:, 0, 2:], y[:, 1, 2:]
+    V, dV = potential(Q)
+    rho = x[:, :, None]*x[:, None, :] + p[:, :, None]*p[:, None, :] - np.eye(2)
+    der = np.empty_like(y)
+    der[:, 0, :2] = np.einsum('knm,km->kn', V, p)
+    der[:, 1, :2] = -np.einsum('knm,km->kn', V, x)
+    der[:, 0, 2:] = P
+    der[:, 1, 2:] = -W**2 * Q - 0.5*np.einsum('knm,nmj->kj', rho, dV)
+    return der
+
+
+def propagate(y, t_final, dt):
+    for n in range(int(round(t_final/dt))):
+        k1 = derivatives(y)
+        k2 = derivatives(y + 0.5*dt*k1)
+        k3 = derivatives(y + 0.5*dt*k2)
+        k4 = derivatives(y + dt*k3)
+        y = y + dt*(k1 + 2*k2 + 2*k3 + k4)/6
+    return y
+
+
+def population(y, state=0):
+    x, p = y[:, 0, :N_STATES], y[:, 1, :N_STATES]
+    common = 2**(N_STATES+1) * np.exp(-np.sum(x**2 + p**2, axis=1))
+    return common * (x[:, state]**2 + p[:, state]**2 - 0.5)
+
+
+def estimate(n_traj, seed, qmc, replicate_size, t_final, dt):
+    frq = np.concatenate((np.zeros(6), W))
+    coords = sample_batch(n_traj, np.zeros(len(W)), frq, N_STATES, INIT_STATE, BETA, 'wigner', seed=seed, qmc=qmc, replicate_size=replicate_size)
+    pop = population(propagate(coords, t_final, dt))
+    if qmc is None:
+        return np.mean(pop), np.std(pop, ddof=1)/np.sqrt(n_traj)
+    mean, std_err, n_rep = rqmc_estimate(pop, np.arange(n_traj), replicate_size)
+    return mean, std_err
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--qmc', choices=['sobol', 'halton'], default='sobol')
+    parser.add_argument('--repeats', type=int, default=20, help='independent estimates per trajectory count')
+    parser.add_argument('--replicates', type=int, default=8, help='RQMC replicates per estimate')
+    parser.add_argument('--time', type=float, default=500.0, help='propagation time (a.u.)')
+    parser.add_argument('--dt', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f'Population of the initial state at t = {args.time} a.u., {args.repeats} repeats per N')
+    print(f"{'N':>7s} {'MC err':>10s} {'RQMC err':>10s} {'RQMC est.':>10s} {'ratio':>7s} {'MC N for RQMC err':>18s}")
+    for n_traj in [64, 128, 256, 512, 1024, 2048]:
+        start = time.time()
+        replicate_size = n_traj // args.replicates
+        mc = np.array([estimate(n_traj, s, None, 0, args.time, args.dt) for s in range(args.repeats)])
+        rqmc = np.array([estimate(n_traj, s, args.qmc, replicate_size, args.time, args.dt) for s in range(args.repeats)])
+        mc_err, rqmc_err = np.std(mc[:, 0], ddof=1), np.std(rqmc[:, 0], ddof=1)
+        ratio = mc_err / rqmc_err
+        print(f'{n_traj:7d} {mc_err:10.5f} {rqmc_err:10.5f} {np.mean(rqmc[:, 1]):10.5f} {ratio:7.2f} {int(n_traj*ratio**2):18d}   ({time.time()-start:.1f} s)')
+
+
+if __name__ == '__main__':
+    main()
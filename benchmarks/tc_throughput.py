@@ -0,0 +1,129 @@
+"""
+TeraChem runner frame throughput against mock TCPB servers.
+
+For every client count, a farm of mock servers (qcRunners/TCMockServer.py)
+is started and a `TCRunner` computes a number of frames (all gradients
+and NACs up to `--max-state`) at slightly displaced geometries. Reported
+per configuration:
+
+    frames/s      frame throughput
+    frame (s)     mean wall time of a frame
+    ideal (s)     mean lower bound of a frame from its job times,
+                  max(sum/n_clients, longest job)
+    overhead      1 - ideal/frame
+    p95 (s)       95th percentile of the frame wall time
+
+Job latencies, stalls and errors of the mock servers are set with the
+options below. Stalled and failing servers are only recovered from with
+`--mode pool`.
+
+    python benchmarks/tc_throughput.py --clients 1 2 4 --max-state 2 --mode threads async
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import io
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pysces'))
+from qcRunners.TeraChem import TCRunner
+from qcRunners.TCServerFarm import TCServerFarm
+import qcRunners.TCMockServer as TCMockServer
+
+
+#   water, angstrom
+ATOMS = ['O', 'H', 'H']
+GEOM = np.array([[0.0, 0.0, 0.1173], [0.0, 0.7572, -0.4692], [0.0, -0.7572, -0.4692]])
+TC_OPTIONS = {'method': 'hf', 'basis': 'sto-3g', 'charge': 0, 'spinmult': 1, 'closed_shell': True, 'restricted': True}
+
+
+def run_config(n_clients, mode, args, config):
+    farm = TCServerFarm(n_clients, executable=os.path.abspath(TCMockServer.__file__), host='127.0.0.1',
+                        probe_interval=0.05, env={'TCMOCK_CONFIG': json.dumps(config)})
+    farm.start()
+    try:
+        tc_options = {**TC_OPTIONS, 'cis': 'yes', 'cisnumstates': args.max_state + 1}
+        run_options = {'max_state': args.max_state, 'nacs': 'all'}
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner = TCRunner(None, None, ATOMS, tc_options, tc_spec_job_opts={}, tc_initial_job_options={'n_frames': 0},
+                              run_options=run_options, server_farm=farm,
+                              use_pool=(mode == 'pool'), use_async=(mode == 'async'))
+
+        rng = np.random.default_rng(args.seed)
+        frame_times, ideal_times = [], []
+        for frame in range(args.frames + 1):
+            geom = GEOM + rng.normal(scale=0.01, size=GEOM.shape)
+            start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                results, times = runner.run_TC_new_geom(geom)
+            wall = time.time() - start
+            if frame == 0:
+                #   warm-up: connections and job time history
+                continue
+            job_times = [t for name, t in times.items() if name.startswith(('gradient_', 'nac_', 'energy'))]
+            frame_times.append(wall)
+            ideal_times.append(max(np.sum(job_times)/n_clients, np.max(job_times)))
+        if runner._pool is not None:
+            runner._pool.shutdown()
+        runner._scheduler.shutdown()
+    finally:
+        farm.stop()
+
+    frame_times = np.array(frame_times)
+    return {
+        'clients': n_clients,
+        'mode': mode,
+        'frames/s': 1.0/np.mean(frame_times),
+        'frame': np.mean(frame_times),
+        'ideal': np.mean(ideal_times),
+        'overhead': 1.0 - np.mean(ideal_times)/np.mean(frame_times),
+        'p95': np.percentile(frame_times, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--mode', nargs='+', default=['threads'], choices=['threads', 'async', 'pool'])
+    parser.add_argument('--max-state', type=int, default=2, help='highest state; all gradients and NACs up to it are computed')
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--gradient-time', type=float, default=0.1, help='median gradient job time (s)')
+    parser.add_argument('--coupling-time', type=float, default=0.2, help='median NAC job time (s)')
+    parser.add_argument('--sigma', type=float, default=0.2, help='spread of the log job times')
+    parser.add_argument('--state-scale', type=float, default=0.2, help='job time increase per excited state')
+    parser.add_argument('--stall-prob', type=float, default=0.0)
+    parser.add_argument('--stall-time', type=float, default=60.0)
+    parser.add_argument('--error-prob', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = {
+        'latency': {'gradient': [args.gradient_time, args.sigma], 'coupling': [args.coupling_time, args.sigma]},
+        'state_scale': args.state_scale,
+        'stall_prob': args.stall_prob,
+        'stall_time': args.stall_time,
+        'error_prob': args.error_prob,
+        'seed': args.seed,
+    }
+    n_jobs = (args.max_state + 1) + args.max_state*(args.max_state + 1)//2
+    print(f'{n_jobs} jobs per frame, {args.frames} frames per configuration')
+    print(f"{'clients':>8s} {'mode':>8s} {'frames/s':>9s} {'frame (s)':>10s} {'ideal (s)':>10s} {'overhead':>9s} {'p95 (s)':>8s}")
+
+    work_dir = tempfile.mkdtemp(prefix='tc_throughput_')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for mode in args.mode:
+            for n_clients in args.clients:
+                res = run_config(n_clients, mode, args, config)
+                print(f"{res['clients']:8d} {res['mode']:>8s} {res['frames/s']:9.2f} {res['frame']:10.3f} {res['ideal']:10.3f} {100*res['overhead']:8.1f}% {res['p95']:8.3f}", flush=True)
+    finally:
+        os.chdir(cwd)
+    print(f'mock server directories left in {work_dir}')
+
+
+if __name__ == '__main__':
+    main()
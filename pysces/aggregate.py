@@ -0,0 +1,363 @@
+"""
+Streaming ensemble average of population correlation functions.
+
+Rows of `corr.out` / `logs/corr.txt` (time, total, S0, S1, ...) are
+ingested one at a time, from running or finished trajectories, and
+reduced with Welford's algorithm into a running mean, variance and
+trajectory count for every time bin. The statistics live in a
+memory-mapped .npy file, so the ensemble average with standard errors
+can be queried at any time without re-reading the raw files.
+
+    pysces aggregate -o pops.npy ensemble/traj_*/logs/corr.txt
+    pysces aggregate -o pops.npy --watch 60 ensemble/traj_*/logs/corr.txt
+    pysces aggregate -o pops.npy --query
+    pysces aggregate -o pops.npy --replicate-size 64 --query
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import numpy as np
+
+
+class CorrelationAggregator():
+    def __init__(self, file_loc: str='pops.npy', dt: float=None, n_bins: int=1024) -> None:
+        '''
+            Running ensemble statistics of population correlation functions
+
+            Parameters
+            ----------
+            file_loc: str
+                memory-mapped statistics file. A JSON file `<file_loc>.json`
+                next to it stores the time step and how far each ingested
+                file has been read. If it exists, the aggregation is resumed.
+            dt: float
+                width of the time bins in a.u. If None, it is taken from the
+                spacing of the first rows that are ingested
+            n_bins: int
+                initial number of time bins; the file grows when needed
+
+            The statistics array has the shape (n_bins, 1 + 2*n_cols), where
+            n_cols is the number of states plus one for the total: column 0
+            holds the number of trajectories in the bin, followed by the
+            running means and the running sums of squared deviations (M2).
+        '''
+        self.file_loc = os.path.abspath(file_loc)
+        self._meta_loc = self.file_loc + '.json'
+        self.dt = dt
+        self.n_cols = None
+        self._n_bins = n_bins
+        self._offsets = {}
+        self._stats = None
+
+        if os.path.isfile(self._meta_loc):
+            with open(self._meta_loc) as file:
+                meta = json.load(file)
+            self.dt = meta['dt']
+            self.n_cols = meta['n_cols']
+            self._offsets = meta['offsets']
+        if os.path.isfile(self.file_loc):
+            self._stats = np.lib.format.open_memmap(self.file_loc, mode='r+')
+            self._n_bins = len(self._stats)
+
+    def __del__(self):
+        self.flush()
+
+    @property
+    def n_states(self):
+        return None if self.n_cols is None else self.n_cols - 1
+
+    def _allocate(self, n_bins: int):
+        #   grow by copying into a new file, then replacing the old one
+        tmp_loc = self.file_loc + '.tmp.npy'
+        stats = np.lib.format.open_memmap(tmp_loc, mode='w+', dtype=np.float64, shape=(n_bins, 1 + 2*self.n_cols))
+        if self._stats is not None:
+            stats[:len(self._stats)] = self._stats
+            del self._stats
+        stats.flush()
+        del stats
+        os.replace(tmp_loc, self.file_loc)
+        self._stats = np.lib.format.open_memmap(self.file_loc, mode='r+')
+        self._n_bins = n_bins
+
+    def add(self, times, pops):
+        '''
+            Adds rows of one trajectory to the running statistics
+
+            Parameters
+            ----------
+            times: float or (n,) array
+                time stamps in a.u.
+            pops: (n_states,) or (n, n_states) array
+                population estimators of every state; the total is added here
+        '''
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        pops = np.atleast_2d(np.asarray(pops, dtype=float))
+        rows = np.hstack((np.sum(pops, axis=1)[:, None], pops))
+        if self.n_cols is None:
+            self.n_cols = rows.shape[1]
+        elif rows.shape[1] != self.n_cols:
+            raise ValueError(f'Expected {self.n_cols - 1} states, got {rows.shape[1] - 1}')
+        if self.dt is None:
+            if len(times) < 2:
+                raise ValueError('The bin width dt is unknown; it needs to be given or at least two rows added at once')
+            self.dt = float(np.min(np.diff(times)))
+
+        bins = np.rint(times / self.dt).astype(int)
+        if self._stats is None or bins.max() >= self._n_bins:
+            n_bins = self._n_bins
+            while bins.max() >= n_bins:
+                n_bins *= 2
+            self._allocate(n_bins)
+
+        #   Welford update; each row is one sample of its time bin
+        stats = self._stats
+        nc = self.n_cols
+        for b, x in zip(bins, rows):
+            count = stats[b, 0] + 1
+            mean = stats[b, 1:1+nc]
+            delta = x - mean
+            mean += delta / count
+            stats[b, 1+nc:] += delta * (x - mean)
+            stats[b, 1:1+nc] = mean
+            stats[b, 0] = count
+
+    def ingest_file(self, file_loc: str):
+        '''
+            Reads the rows of a corr.out or corr.txt file that have not been
+            ingested yet. Only complete lines are used, so files of
+            running trajectories can be ingested repeatedly.
+
+            Returns
+            -------
+            number of rows added
+        '''
+        key = os.path.abspath(file_loc)
+        offset = self._offsets.get(key, 0)
+        with open(key) as file:
+            file.seek(offset)
+            data = file.read()
+        complete = data[:data.rfind('\n') + 1]
+        self._offsets[key] = offset + len(complete.encode())
+
+        times, pops = [], []
+        for line in complete.splitlines():
+            sp = line.split()
+            try:
+                row = [float(x) for x in sp]
+            except ValueError:
+                #   header line
+                continue
+            if len(row) < 3:
+                continue
+            times.append(row[0])
+            pops.append(row[2:])
+        if len(times) == 0:
+            return 0
+
+        #   rows of a file are binned together, so dt can be inferred from them
+        if self.dt is None and len(times) < 2:
+            self._offsets[key] = offset
+            return 0
+        self.add(times, pops)
+        return len(times)
+
+    def ingest(self, patterns: list):
+        '''
+            Ingests all files matching the glob patterns; returns the number of rows added
+        '''
+        n_rows = 0
+        for pattern in patterns:
+            for file_loc in sorted(glob.glob(pattern)):
+                n_rows += self.ingest_file(file_loc)
+        self.flush()
+        return n_rows
+
+    def query(self):
+        '''
+            Current ensemble average
+
+            Returns
+            -------
+            times: (n,) array of the time bins that have data
+            mean: (n, n_states+1) array, total population in column 0
+            std_err: (n, n_states+1) array of standard errors of the mean
+            counts: (n,) array with the number of trajectories in each bin
+        '''
+        if self._stats is None:
+            return np.zeros(0), np.zeros((0, 0)), np.zeros((0, 0)), np.zeros(0, dtype=int)
+        stats = np.array(self._stats)
+        nc = self.n_cols
+        bins = np.flatnonzero(stats[:, 0] > 0)
+        counts = stats[bins, 0]
+        mean = stats[bins, 1:1+nc]
+        std_err = np.zeros_like(mean)
+        many = counts > 1
+        var = stats[bins[many], 1+nc:] / (counts[many, None] - 1)
+        std_err[many] = np.sqrt(var / counts[many, None])
+        return bins * self.dt, mean, std_err, counts.astype(int)
+
+    def write(self, file_loc: str):
+        '''
+            Writes the current ensemble average and standard errors to a text file
+        '''
+        _write_average(file_loc, *self.query())
+
+    def flush(self):
+        if self._stats is not None:
+            self._stats.flush()
+        if self.n_cols is None:
+            return
+        meta = {'dt': self.dt, 'n_cols': self.n_cols, 'offsets': self._offsets}
+        with open(self._meta_loc, 'w') as file:
+            json.dump(meta, file, indent=2)
+
+
+class ReplicateAggregator():
+    def __init__(self, file_loc: str='pops.npy', replicate_size: int=None, dt: float=None) -> None:
+        '''
+            Running statistics of randomized quasi-Monte Carlo ensembles.
+            Trajectory k belongs to replicate k // replicate_size, and each
+            replicate has its own `CorrelationAggregator` in
+            `<file_loc>_repXXXX.npy`. The error bars come from the spread of
+            the replicate means. Without a replicate size, all trajectories
+            go into a single aggregator at `file_loc`.
+        '''
+        self.file_loc = os.path.abspath(file_loc)
+        self.replicate_size = replicate_size
+        self.dt = dt
+        self._replicates = {}
+        if replicate_size is None:
+            self._replicates[0] = CorrelationAggregator(self.file_loc, dt=dt)
+        else:
+            #   the index may have more than four digits; temporary files of a growing aggregator are skipped
+            pattern = re.compile(re.escape(os.path.basename(self._replicate_loc('*'))).replace(r'\*', r'(\d+)'))
+            for rep_loc in sorted(glob.glob(self._replicate_loc('*'))):
+                match = pattern.fullmatch(os.path.basename(rep_loc))
+                if match is None:
+                    continue
+                self._replicates[int(match.group(1))] = CorrelationAggregator(rep_loc, dt=dt)
+
+    def _replicate_loc(self, r):
+        base = self.file_loc[:-4] if self.file_loc.endswith('.npy') else self.file_loc
+        if r == '*':
+            return f'{base}_rep*.npy'
+        return f'{base}_rep{r:04d}.npy'
+
+    def _get(self, index: int) -> CorrelationAggregator:
+        if self.replicate_size is None:
+            return self._replicates[0]
+        r = int(index) // self.replicate_size
+        if r not in self._replicates:
+            self._replicates[r] = CorrelationAggregator(self._replicate_loc(r), dt=self.dt)
+        return self._replicates[r]
+
+    @property
+    def n_states(self):
+        for agg in self._replicates.values():
+            if agg.n_states is not None:
+                return agg.n_states
+        return None
+
+    def add(self, index: int, times, pops):
+        '''
+            Adds rows of trajectory `index`, see `CorrelationAggregator.add`
+        '''
+        self._get(index).add(times, pops)
+
+    def ingest_file(self, index: int, file_loc: str):
+        return self._get(index).ingest_file(file_loc)
+
+    def flush(self):
+        for agg in self._replicates.values():
+            agg.flush()
+
+    def query(self):
+        '''
+            Same as `CorrelationAggregator.query`; with replicates, the mean
+            is the average of the replicate means and the standard error is
+            estimated from their spread.
+        '''
+        if self.replicate_size is None:
+            return self._replicates[0].query()
+
+        rep_data = {}
+        for agg in self._replicates.values():
+            times, mean, std_err, counts = agg.query()
+            for t, m, n in zip(times, mean, counts):
+                b = int(np.rint(t / agg.dt))
+                rep_data.setdefault(b, (t, [], []))
+                rep_data[b][1].append(m)
+                rep_data[b][2].append(n)
+
+        bins = sorted(rep_data)
+        if len(bins) == 0:
+            return np.zeros(0), np.zeros((0, 0)), np.zeros((0, 0)), np.zeros(0, dtype=int)
+        times = np.array([rep_data[b][0] for b in bins])
+        mean = np.array([np.mean(rep_data[b][1], axis=0) for b in bins])
+        std_err = np.zeros_like(mean)
+        counts = np.array([np.sum(rep_data[b][2]) for b in bins], dtype=int)
+        for i, b in enumerate(bins):
+            n_rep = len(rep_data[b][1])
+            if n_rep > 1:
+                std_err[i] = np.std(rep_data[b][1], axis=0, ddof=1) / np.sqrt(n_rep)
+        return times, mean, std_err, counts
+
+    def write(self, file_loc: str):
+        _write_average(file_loc, *self.query())
+
+
+def _write_average(file_loc: str, times, mean, std_err, counts):
+    n_cols = mean.shape[1] if mean.ndim == 2 else 0
+    labels = ['Total'] + [f'S{i}' for i in range(n_cols - 1)]
+    with open(file_loc, 'w') as file:
+        file.write('%12s %8s' % ('Time', 'N_traj'))
+        for l in labels:
+            file.write(' %16s %16s' % (l, l + '_err'))
+        file.write('\n')
+        for t, m, e, n in zip(times, mean, std_err, counts):
+            file.write(f'{t:12.4f} {n:8d}')
+            for i in range(len(m)):
+                file.write(f' {m[i]:16.10f} {e[i]:16.10f}')
+            file.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pysces aggregate', description='Streaming ensemble average of population correlation functions')
+    parser.add_argument('files', nargs='*', help='corr.out / corr.txt files or glob patterns to ingest')
+    parser.add_argument('-o', '--output', default='pops.npy', help='memory-mapped statistics file')
+    parser.add_argument('--dt', type=float, default=None, help='width of the time bins in a.u. (default: inferred)')
+    parser.add_argument('--watch', type=float, default=None, metavar='SEC', help='keep ingesting new rows every SEC seconds')
+    parser.add_argument('--query', action='store_true', help='print the current ensemble average')
+    parser.add_argument('--write', default=None, help='write the current ensemble average to this text file')
+    parser.add_argument('--replicate-size', type=int, default=None, help='query the QMC replicates <output>_repXXXX.npy written with this replicate size')
+    args = parser.parse_args(argv)
+
+    if args.replicate_size is not None:
+        #   replicate files are filled by `pysces ensemble` or the lockstep ensemble
+        agg = ReplicateAggregator(args.output, args.replicate_size, dt=args.dt)
+        args.files = []
+    else:
+        agg = CorrelationAggregator(args.output, dt=args.dt)
+    while True:
+        n_rows = agg.ingest(args.files) if args.files else 0
+        if args.files:
+            print(f'Ingested {n_rows} rows into {agg.file_loc}')
+        if args.write:
+            agg.write(args.write)
+        if args.watch is None:
+            break
+        sys.stdout.flush()
+        time.sleep(args.watch)
+
+    if args.query:
+        times, mean, std_err, counts = agg.query()
+        for t, m, e, n in zip(times, mean, std_err, counts):
+            print(f'{t:12.4f} {n:8d} ' + ' '.join([f'{m[i]:12.8f} +/- {e[i]:10.8f}' for i in range(len(m))]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Command line entry point
+
+    pysces              run a single trajectory in the current directory
+    pysces ensemble     run many independent trajectories, see `pysces ensemble -h`
+    pysces aggregate    ensemble average of correlation functions, see `pysces aggregate -h`
+    pysces sample       bank of initial conditions, see `pysces sample -h`
+    pysces lvc          vibronic coupling model fitted to QC data, see `pysces lvc -h`
+"""
+import sys
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'ensemble':
+        #   the ensemble driver must not load the simulation settings itself
+        from pool import main as ensemble_main
+        return ensemble_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'aggregate':
+        from aggregate import main as aggregate_main
+        return aggregate_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'sample':
+        from sampling import main as sample_main
+        return sample_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'lvc':
+        from vibronic import main as lvc_main
+        return lvc_main(sys.argv[2:])
+
+    from main import main as run_trajectory
+    run_trajectory()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""
+Lockstep propagation of an ensemble of LSC-IVR trajectories in a single
+process. The phase space variables of all M trajectories are stored as one
+(M, 2, ndof) array and the equations of motion are evaluated for the whole
+ensemble at once. At every step, the M new geometries are handed to the
+QC runner as one batch. Logging and correlation functions stay per trajectory.
+"""
+import os
+import sys
+import time
+import shutil
+from contextlib import contextmanager
+import numpy as np
+from subroutines import *
+from input_simulation import *
+from aggregate import ReplicateAggregator
+
+
+@contextmanager
+def _working_dir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+class GamessBatchRunner():
+    def __init__(self, n_traj: int, atoms: list, AN_mat: np.ndarray, root: str='ensemble') -> None:
+        '''
+            Runs GAMESS for every member of an ensemble. The GAMESS files of
+            each trajectory (cas.inp, cas.out, vec_gamess, ...) live in
+            their own directory under `root`, so that guess orbitals are
+            not shared between trajectories.
+        '''
+        self._atoms = atoms
+        self._AN_mat = AN_mat
+        self._sub_script = None
+        if sub_script is not None:
+            self._sub_script = os.path.abspath(sub_script)
+
+        self.traj_dirs = []
+        for k in range(n_traj):
+            traj_dir = os.path.abspath(os.path.join(root, f'traj_{k:04d}'))
+            os.makedirs(traj_dir, exist_ok=True)
+            for file in ['vec_gamess', 'rungms-pool', 'runG_common_pool']:
+                if os.path.isfile(file):
+                    shutil.copy(file, traj_dir)
+            self.traj_dirs.append(traj_dir)
+
+    def compute(self, qC: np.ndarray, traj_ids):
+        '''
+            Parameters
+            ----------
+            qC: (n, nnuc) array of Cartesian geometries in bohr
+            traj_ids: indices of the trajectories the geometries belong to
+
+            Returns
+            -------
+            elecE, grad, nac, trans_dips, failed, jobs_data, timings
+        '''
+        n = len(traj_ids)
+        elecE = np.zeros((n, nel))
+        grad = np.zeros((n, nel, nnuc))
+        nac = np.zeros((n, nel, nel, nnuc))
+        failed = np.zeros(n, dtype=bool)
+        timings = []
+        for i, k in enumerate(traj_ids):
+            start = time.time()
+            with _working_dir(self.traj_dirs[k]):
+                update_geo_gamess(self._atoms, self._AN_mat, qC[i])
+                elecE[i], grad[i], nac[i], flag_grad, flag_nac, flag_orb = run_gms_cached('cas', opt, self._atoms, self._AN_mat, qC[i], self._sub_script)
+            failed[i] = any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1
+            timings.append({'gamess': time.time() - start})
+
+        return elecE, grad, nac, None, failed, [None]*n, timings
+
+    def print_summary(self):
+        pass
+
+
+class TCBatchRunner():
+    def __init__(self, atoms: list) -> None:
+        '''
+            Runs TeraChem for every member of an ensemble through a single
+            TCRunner that keeps the guess files of each trajectory apart.
+        '''
+        from qcRunners.TeraChem import TCRunner
+        self._runner = TCRunner(tcr_host, tcr_port, atoms, tcr_job_options, server_roots=tcr_server_root, run_options=tcr_state_options, tc_spec_job_opts=tcr_spec_job_opts, tc_initial_job_options=tcr_initial_frame_opts, start_new=False, use_pool=tcr_use_pool, use_async=tcr_async, hedge_quantile=tcr_hedge_quantile, output_capture=get_tc_output_capture(), janitor=get_tc_janitor(), server_farm=get_tc_server_farm())
+
+    def compute(self, qC: np.ndarray, traj_ids):
+        from qcRunners.TeraChem import format_output_LSCIVR
+        n = len(traj_ids)
+        elecE = np.zeros((n, nel))
+        grad = np.zeros((n, nel, nnuc))
+        nac = np.zeros((n, nel, nel, nnuc))
+        trans_dips = np.zeros((n, nel, nel, 3))
+        has_dips = True
+        failed = np.zeros(n, dtype=bool)
+        jobs_data, timings = [], []
+
+        batch_results = self._runner.run_TC_batch(qC/ang2bohr, traj_ids)
+        for i, (job_results, qc_timings) in enumerate(batch_results):
+            jobs_data.append(job_results)
+            timings.append(qc_timings)
+            if job_results is None:
+                failed[i] = True
+                continue
+            try:
+                elecE[i], grad[i], nac[i], tdm = format_output_LSCIVR(job_results)
+            except RuntimeError as error:
+                #   missing NAC results
+                print(f"TeraChem results of trajectory {traj_ids[i]} are incomplete: {error}")
+                failed[i] = True
+                continue
+            if tdm is None:
+                has_dips = False
+            else:
+                trans_dips[i] = tdm
+
+        if not has_dips:
+            trans_dips = None
+        return elecE, grad, nac, trans_dips, failed, jobs_data, timings
+
+    def print_summary(self):
+        self._runner.print_pool_stats()
+
+
+class ModelBatchRunner():
+    def __init__(self) -> None:
+        '''
+            Evaluates the model Hamiltonian for all members of an ensemble at once
+        '''
+        self._runner = get_model_runner()
+
+    def compute(self, qC: np.ndarray, traj_ids):
+        n = len(traj_ids)
+        start = time.time()
+        elecE, grad, nac, trans_dips = self._runner.compute(qC)
+        timings = [{'model': (time.time() - start)/n} for i in range(n)]
+        return elecE, grad, nac, trans_dips, np.zeros(n, dtype=bool), [None]*n, timings
+
+    def print_summary(self):
+        print(f'Model Hamiltonian "{model_type}": {self._runner.n_calls} evaluations')
+
+
+def get_batch_runner(n_traj: int, atoms: list, AN_mat: np.ndarray):
+    if QC_RUNNER == 'gamess':
+        return GamessBatchRunner(n_traj, atoms, AN_mat)
+    elif QC_RUNNER == 'terachem':
+        return TCBatchRunner(atoms)
+    elif QC_RUNNER == 'model':
+        return ModelBatchRunner()
+    raise ValueError(f'QC_RUNNER "{QC_RUNNER}" does not support ensemble runs')
+
+
+def sample_ensemble(n_traj: int, normal_geo: np.ndarray, frq: np.ndarray):
+    '''
+        Initial conditions of trajectories `traj_index` ... `traj_index + n_traj - 1`,
+        read from `init_cond_bank` or sampled with one random stream per trajectory
+
+        Returns
+        -------
+        initq, initp: (n_traj, ndof-6) arrays in normal coordinates (a.u.)
+    '''
+    indices = np.arange(traj_index, traj_index + n_traj)
+    if init_cond_bank is not None:
+        bank = get_init_cond_bank()
+        coords = np.array([bank[k] for k in indices])
+    else:
+        import input_simulation as opts
+        seed = getattr(opts, 'input_seed', None)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        coords = sample_initial_conditions(normal_geo, frq, indices, seed)
+    return coords[:, 0, :], coords[:, 1, :]
+
+
+def rk4_ensemble(initq, initp, tStop, H, amu_mat, U, com_ang, AN_mat):
+    '''
+        Lockstep version of `rk4` for an ensemble of trajectories
+
+        Parameters
+        ----------
+        initq, initp: (M, ndof-6) arrays
+            initial electronic mapping variables followed by normal mode
+            coordinates and momenta of each trajectory
+
+        Returns
+        -------
+        X: (n_times,) array of time stamps
+        coords: (M, 2, ndof, n_times) array of phase space variables
+        n_valid: (M,) number of time stamps each trajectory propagated
+            successfully (trajectories that fail are frozen afterwards)
+    '''
+    n_traj = len(initq)
+    au_mas = np.diag(amu_mat) * amu2au # masses of atoms in atomic unit (vector)
+    hist_length = 2
+
+    # Phase space variables of the whole ensemble
+    y = np.zeros((n_traj, 2, ndof))
+    y[:, 0, :nel], y[:, 1, :nel] = initq[:, :nel], initp[:, :nel]
+    for k in range(n_traj):
+        y[k, 0, nel:], y[k, 1, nel:] = rotate_norm_to_cart(initq[k, nel:], initp[k, nel:], U, amu_mat)
+
+    atoms = get_atom_label()
+    all_traj = np.arange(n_traj)
+    active = np.ones(n_traj, dtype=bool)
+
+    # One logger per trajectory
+    loggers = []
+    for k in all_traj:
+        traj_log_dir = os.path.join(logging_dir, f'traj_{k:04d}')
+        os.makedirs(traj_log_dir, exist_ok=True)
+        logger = SimulationLogger(nel, dir=traj_log_dir, save_jobs=tcr_log_jobs and QC_RUNNER == 'terachem', verbose=False)
+        logger.atoms = atoms
+        if QC_RUNNER == 'terachem':
+            logger.state_labels = [f'S{x}' for x in tcr_state_options['grads']]
+        loggers.append(logger)
+    replicate_size = qmc_replicate_size if sampling_qmc is not None else None
+    aggregator = ReplicateAggregator(os.path.join(logging_dir, 'pops.npy'), replicate_size, dt=H)
+
+    ### Initial-time property calculation ###
+    print(f"Initial property evaluation of {n_traj} trajectories started.")
+    opt['guess'] = ''
+    qc = get_batch_runner(n_traj, atoms, AN_mat)
+    elecE, grad, nac, trans_dips, failed, jobs_data, qc_timings = qc.compute(y[:, 0, nel:], all_traj)
+    if np.any(failed):
+        sys.exit("Electronic structure calculation failed at initial time. Exitting.")
+    opt['guess'] = 'moread'
+
+    nac_hist = np.repeat(nac[..., None], hist_length, axis=-1)
+    tdm_hist = np.zeros((n_traj, nel, nel, 3, hist_length))
+    if trans_dips is not None:
+        tdm_hist[:] = trans_dips[..., None]
+
+    t = 0.0
+    init_energy = get_energy(au_mas, y[:, 0], y[:, 1], elecE)
+    rk_integrator = get_integrator(rk_method, n_traj*2*ndof, rk_tol)
+    for k in all_traj:
+        record_nuc_geo(0, t, atoms, y[k, 0, nel:], com_ang, loggers[k])
+        qc_timings[k]['Wall_Time'] = 0.0
+        qc_timings[k].update(rk_integrator.get_step_stats())
+        loggers[k].write(t, init_energy[k], elecE[k], grad[k], nac[k], qc_timings[k], elec_p=y[k, 1, :nel], elec_q=y[k, 0, :nel], nuc_p=y[k, 1, nel:], jobs_data=jobs_data[k])
+        aggregator.add(traj_index + k, t, compute_CF_single(y[k, 0, :nel], y[k, 1, :nel]))
+    aggregator.flush()
+
+    X, Y = [t], [y.copy()]
+    n_valid = np.ones(n_traj, dtype=int)
+
+    ### Runge-Kutta routine ###
+    while t < tStop and np.any(active):
+        start_time = time.time()
+        H = min(H, tStop-t)
+
+        def get_deriv(y0, der):
+            y0, der = y0.reshape(n_traj, 2, ndof), der.reshape(n_traj, 2, ndof)
+            get_derivatives(au_mas, y0[:, 0], y0[:, 1], nac, grad, elecE, out=der)
+            # failed trajectories are frozen
+            der[~active] = 0.0
+        if rk_method == 'split':
+            #   failed trajectories are frozen
+            split = get_split_step(au_mas, elecE[active], grad[active], nac[active])
+            y[active] = rk_integrator.step(split, y[active].reshape(-1), H).reshape(-1, 2, ndof)
+        else:
+            y = rk_integrator.step(get_deriv, y.reshape(-1), H).reshape(n_traj, 2, ndof)
+        t += H
+
+        idx = np.flatnonzero(active)
+        print(f"##### Performing MD Step Time: {t:8.2f} a.u. ({len(idx)} of {n_traj} trajectories) ##### ")
+
+        # ES calculation of all active trajectories as one batch
+        E_b, grad_b, nac_b, tdm_b, failed, jobs_b, timings_b = qc.compute(y[idx, 0, nel:], idx)
+        elecE[idx], grad[idx], nac[idx] = E_b, grad_b, nac_b
+        for i, k in enumerate(idx):
+            if failed[i]:
+                print(f"Electronic structure calculation failed for trajectory {k}; it is stopped at t = {X[-1]:.2f} a.u.")
+                active[k] = False
+                continue
+            tdm = None if tdm_b is None else tdm_b[i]
+            nac[k], nac_hist[k], tdm_hist[k] = correct_nac_sign(nac[k], nac_hist[k], tdm, tdm_hist[k])
+
+        new_energy = get_energy(au_mas, y[:, 0], y[:, 1], elecE)
+        end_time = time.time()
+        rk_stats = rk_integrator.get_step_stats()
+        for i, k in enumerate(idx):
+            if not active[k]:
+                continue
+            # Check energy conservation
+            if (init_energy[k]-new_energy[k])/init_energy[k] > 0.02: # 2% deviation = terrible without doubt
+                print(f"Energy conservation failed for trajectory {k}; it is stopped at t = {X[-1]:.2f} a.u.")
+                active[k] = False
+                continue
+
+            n_valid[k] += 1
+            record_nuc_geo(0, t, atoms, y[k, 0, nel:], com_ang, loggers[k])
+            timings_b[i]['Wall_Time'] = end_time - start_time
+            timings_b[i].update(rk_stats)
+            loggers[k].write(t, total_E=new_energy[k], elec_E=elecE[k], grads=grad[k], NACs=nac[k], timings=timings_b[i], elec_q=y[k, 0, :nel], elec_p=y[k, 1, :nel], nuc_p=y[k, 1, nel:], jobs_data=jobs_b[i])
+            aggregator.add(traj_index + k, t, compute_CF_single(y[k, 0, :nel], y[k, 1, :nel]))
+        aggregator.flush()
+
+        X.append(t)
+        Y.append(y.copy())
+
+    rk_integrator.print_summary()
+    qc.print_summary()
+    print(f"{np.sum(active)} of {n_traj} trajectories propagated to the final time step.")
+
+    coords = np.stack(Y, axis=-1)
+    for k in all_traj:
+        traj_dir = os.path.join(logging_dir, f'traj_{k:04d}')
+        compute_CF(X[:n_valid[k]], coords[k, :, :, :n_valid[k]], corr_file=os.path.join(traj_dir, 'corr.out'))
+    aggregator.write(os.path.join(logging_dir, 'pops_avg.txt'))
+
+    return np.array(X), coords, n_valid
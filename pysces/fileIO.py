@@ -2,7 +2,6 @@ import os
 import json
 import numpy as np
 #import qcRunners.TeraChem as TC
-from copy import deepcopy
 
 def read_restart(file_loc: str='restart.out', ndof: int=0, integrator: str='RK4') -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, float, float]:
     '''
@@ -160,7 +159,7 @@ class LoggerData():
         self.jobs_data = jobs_data
 
 class SimulationLogger():
-    def __init__(self, n_states, save_energy=True, save_grad=True, save_nac=True, save_corr=True, save_timigs=True, dir=None, save_geo=True, save_elec=True, save_p=True, save_jobs=True, atoms=None) -> None:
+    def __init__(self, n_states, save_energy=True, save_grad=True, save_nac=True, save_corr=True, save_timigs=True, dir=None, save_geo=True, save_elec=True, save_p=True, save_jobs=True, atoms=None, verbose=True) -> None:
         if dir is None:
             dir = os.path.abspath(os.path.curdir)
         self.atoms = atoms
@@ -176,7 +175,7 @@ class SimulationLogger():
         if save_corr:
             self._loggers.append(CorrelationLogger(os.path.join(dir, 'corr.txt')))
         if save_timigs:
-            self._loggers.append(TimingsLogger(os.path.join(dir, 'timings.txt')))
+            self._loggers.append(TimingsLogger(os.path.join(dir, 'timings.txt'), verbose=verbose))
         if save_elec:
             self._loggers.append(ElectricPQLogger(os.path.join(dir, 'electric_pq.txt')))
         if save_p:
@@ -199,10 +198,33 @@ class SimulationLogger():
 
         #TODO: add nuc_geo logging here
 
+def _jobs_dumper():
+    '''
+        YAML dumper that writes numpy arrays as lists, numpy scalars as
+        numbers, bytes as strings and captured TC output as its contents
+        while emitting, so the job results do not have to be copied and
+        converted beforehand
+    '''
+    import yaml
+    from qcRunners.TCOutput import CapturedOutput
+    class JobsDumper(yaml.Dumper):
+        def ignore_aliases(self, data):
+            return True
+    JobsDumper.add_representer(np.ndarray, lambda dumper, value: dumper.represent_list(value.tolist()))
+    JobsDumper.add_multi_representer(np.generic, lambda dumper, value: dumper.represent_data(value.item()))
+    JobsDumper.add_representer(bytes, lambda dumper, value: dumper.represent_str(value.decode('utf-8')))
+    #   waits for the tc.out still being read in the background
+    JobsDumper.add_representer(CapturedOutput, lambda dumper, value: dumper.represent_data(value.result()))
+    return JobsDumper
+
 class TCJobsLogger():
+    #   entries of the TC results that are not logged
+    remove = ('orb_energies', 'bond_order', 'orb_occupations', 'spins')
+
     def __init__(self, file_loc: str) -> None:
         self._file_loc = file_loc
         self._file = None
+        self._dumper = None
         
     def __del__(self):
         if self._file is not None:
@@ -212,14 +234,14 @@ class TCJobsLogger():
         if data.jobs_data is not None:
             if self._file is None:
                 self._file = open(self._file_loc, 'w')
+                self._dumper = _jobs_dumper()
                 
             import yaml
-            import qcRunners.TeraChem as TC
-            results = deepcopy(data.jobs_data)
-            cleaned = TC.TCRunner.cleanup_multiple_jobs(results, 'orb_energies', 'bond_order', 'orb_occupations', 'spins')
+            #   only the top level of each job is rebuilt, the values are shared
+            jobs = [{k: v for k, v in job.items() if k not in self.remove} for job in data.jobs_data]
 
-            out_data = {'time': data.time, 'jobs_data': cleaned}
-            yaml.dump(out_data, self._file, allow_unicode=True, explicit_start=True, default_flow_style=False, sort_keys=False)
+            out_data = {'time': data.time, 'jobs_data': jobs}
+            yaml.dump(out_data, self._file, Dumper=self._dumper, allow_unicode=True, explicit_start=True, default_flow_style=False, sort_keys=False)
             self._file.flush()
 
 class NucGeoLogger():
@@ -294,9 +316,10 @@ class NuclearPLogger():
         self._file.flush()
 
 class TimingsLogger():
-    def __init__(self, file_loc: str) -> None:
+    def __init__(self, file_loc: str, verbose=True) -> None:
         self._file = open(file_loc, 'w')
         self._write_header = True
+        self._verbose = verbose
 
         labels = ['gradient_0', 'gradient_n', 'nac_0_n', 'nac_n_m', 'total']
         self._descriptions = ['Ground state gradient', 'Excited state gradients', 
@@ -315,7 +338,7 @@ class TimingsLogger():
         if self._n_steps == 0:
             n_steps = 1
         total = self._totals['total']
-        if total == 0.0:
+        if total == 0.0 or not self._verbose:
             return
         print("Electronic Structure Average Timings")
         for l, v in self._totals.items():
@@ -343,12 +366,14 @@ class TimingsLogger():
         # Write timings
         self._file.write(f'{total:12.3f}')
         for key, value in times.items():
-            self._file.write(f'{value:12.3f}')
+            if key.endswith('_Error'):
+                self._file.write(f'{value:12.3e}')
+            else:
+                self._file.write(f'{value:12.3f}')
         self._file.write('\n')
         self._file.flush()
 
         #   print a sumamry for this timestep
-        print("Electronic Structure Timings:")
         g_0, g_n, d_0n, d_nm = 0.0, 0.0, 0.0, 0.0
         for key, value in times.items():
             if 'gradient_0' == key:
@@ -364,14 +389,17 @@ class TimingsLogger():
                 d_nm += value
                 self._totals['nac_n_m'] += value
         self._totals['total'] += total
-        
+        self._n_steps += 1
+        if not self._verbose:
+            return
+
+        print("Electronic Structure Timings:")
         print(f'    Ground state gradient:  { g_0:.2f} s')
         print(f'    Excited state gradients: {g_n:.2f} s')
         print(f'    Ground-Excited NACs:     {d_0n:.2f} s')
         print(f'    Excited-Excited NACs:    {d_nm:.2f} s')
         print(f'    Total:                   {total:.2f} s')
         print("")
-        self._n_steps += 1
 
 
 class CorrelationLogger():
@@ -36,6 +36,34 @@ timestep, nstep = 1.0, 16700
 tmax_bsh, Hbsh, tol = 10, 3.0, 0.01 
 # Maximum propagation time (a.u.), one Runge-Kutta step (a.u.) (Only relevant for RK4)
 tmax_rk4, Hrk4 = 20671, 1.0 
+# Scheme used for each RK4 step (Only relevant for RK4):
+#   'scipy' (adaptive scipy RK45), a fixed-step tableau: 'rk4', 'rk38', 'bs32', 'dopri5',
+#   or 'split': velocity Verlet for the nuclei with the electronic mapping variables propagated exactly by a
+#   matrix exponential (2nd order), so that the step is not limited by the electronic oscillations of large gaps
+rk_method = 'scipy'
+# Embedded error tolerance for 'bs32' and 'dopri5'; steps above it are split into sub-steps (None = off)
+rk_tol = None
+# Electronic sub-steps per RK4 step (1 = off). With n > 1, the QC results at the start and end of every step
+#   are interpolated linearly in time and each of the n sub-steps uses the values at its midpoint, so that
+#   Hrk4 can be larger for the same accuracy. The end of the step is predicted with extrapolated values first.
+#   QC runs once per step, at the predicted geometry: the nuclear positions are those of the predictor, and
+#   the corrector only updates the momenta and electronic variables (no second QC call at corrected positions).
+mts_substeps = 1
+
+# Number of trajectories propagated together in one process (lockstep ensemble, RK4 only).
+# Each trajectory logs to its own '<logging_dir>/traj_XXXX' directory.
+ensemble_size = 1
+
+# Randomized quasi-Monte Carlo initial conditions: None (pseudo-random), 'sobol' or 'halton'.
+# Replicates of `qmc_replicate_size` trajectories are scrambled independently and give the
+# error estimate. Single runs need a bank (`pysces sample`), ensembles sample it directly.
+sampling_qmc = None
+qmc_replicate_size = 64
+
+# Bank of initial conditions written by `pysces sample` (.npz); if given, trajectory
+# `traj_index` of the bank is propagated instead of sampling a new initial condition
+init_cond_bank = None
+traj_index = 0
 
 # Scaling factor of normal mode frequencies
 frq_scale = 1.0
@@ -56,10 +84,20 @@ init_state = 2
 restart = 0
 restart_file_in = 'restart.out'
 
-#   type of QC runner, either 'gamess' or 'terachem'
+#   type of QC runner, either 'gamess', 'terachem' or 'model'
 QC_RUNNER = 'gamess'
 #QC_RUNNER = 'terachem'
 
+#   analytic model Hamiltonian of QC_RUNNER = 'model' ('lvc', 'spin_boson', 'tully1',
+#   'tully2' or 'tully3'), expressed in the normal modes of the molecule read with
+#   mol_input_format; model_params are passed to the model (see model_hamiltonians.py)
+#   and model_dipoles are the (nel, nel, 3) diabatic dipoles (None = 1 a.u. along z)
+model_type = 'lvc'
+model_params = {}
+model_dipoles = None
+#   LVC/QVC model file written by `pysces lvc`; if given, it replaces model_type and model_params
+model_file = None
+
 #   TeraChem runner options
 tcr_host = '10.1.1.154'
 tcr_port = 9876
@@ -68,6 +106,9 @@ tcr_job_options = {}
 tcr_state_options = {
     'max_state': nel-1, 'grads': 'all'
 }
+#   add 'share_scf': True to tcr_state_options to run one reference job per frame
+#   first and start all other jobs of the frame from its converged orbitals and
+#   CIS vectors; the number of jobs that did so is logged as 'Saved_SCF'
 #   TeraChem runner job specific options
 tcr_spec_job_opts = {}
 #    TeraChem runner job options for first frame only
@@ -76,6 +117,41 @@ tcr_initial_frame_opts = {
 }
 #   log TC job results
 tcr_log_jobs = True
+#   share all servers (tcr_host/tcr_port lists) between trajectories through one
+#   broker with work stealing; a trajectory prefers the server of its previous frame.
+#   Failing or stalled servers are quarantined, their jobs run on the others, and
+#   they are re-admitted once they respond again
+tcr_use_pool = False
+#   with the pool, re-run jobs that take longer than this quantile of their
+#   previous run times on an idle server and use the first result (e.g. 0.95)
+tcr_hedge_quantile = None
+#   wait for TC jobs on one asyncio event loop with adaptive backoff polling
+#   instead of a thread per server and fixed sleeps
+tcr_async = False
+#   skip the NAC jobs of state pairs whose energy gap (hartree) stays above
+#   tcr_nac_prune_gap and whose last computed NAC norm is below tcr_nac_prune_norm,
+#   for at most tcr_nac_prune_max_skip consecutive steps (RK4 only; None disables)
+tcr_nac_prune_gap = None
+tcr_nac_prune_norm = 1.0e-3
+tcr_nac_prune_max_skip = 5
+#   tc.out of every job kept in the job results: 'full', 'tail' (last tcr_output_tail
+#   lines), 'summary' (final energy, timing, warnings), 'path' (file location only)
+#   or 'none'. Files are read in a background thread; with tcr_output_archive set to
+#   a directory, every tc.out is also gzipped there
+tcr_output_capture = 'full'
+tcr_output_tail = 50
+tcr_output_archive = None
+#   remove old TC job and scratch directories in a background thread: None keeps
+#   everything, an integer K keeps the directories of the last K steps, 'guess'
+#   keeps only the orbital files the next step starts from (archive tc.out with
+#   tcr_output_archive if 'path' references are needed)
+tcr_cleanup = None
+#   launch tcr_start_servers local TeraChem servers on free ports instead of using
+#   tcr_host/tcr_port; server i runs in server_<port> and is pinned to device
+#   tcr_server_devices[i] (e.g. [0, 1, 2, 3]) through CUDA_VISIBLE_DEVICES
+tcr_start_servers = 0
+tcr_server_devices = None
+tcr_server_exe = 'terachem'
 
 # Terachem files
 fname_tc_xyz      = "tmp/tc_hf/hf.spherical.freq/Geometry.xyz"
@@ -83,6 +159,25 @@ fname_tc_geo_freq = "tmp/tc_hf/hf.spherical.freq/Geometry.frequencies.dat"
 fname_tc_redmas   = "tmp/tc_hf/hf.spherical.freq/Reduced.mass.dat"
 fname_tc_freq     = "tmp/tc_hf/hf.spherical.freq/Frequencies.dat"
 
+#   cache of QC results keyed by the (quantized) geometry and the QC options,
+#   stored in an append-only file that is reused by restarts
+qc_cache = False
+qc_cache_file = 'qc_cache.pkl'
+qc_cache_tol = 1.0e-6   # bohr
+qc_cache_size = 256     # entries kept (least recently used are evicted)
+
+#   interpolation of energies, gradients and NACs from previously computed geometries
+#   in front of the QC runner (RK4 only): a QC call is skipped if pes_interp_min_points
+#   stored points lie within pes_interp_radius (bohr), the estimated energy error is
+#   below pes_interp_tol (hartree) and fewer than pes_interp_max_skip steps in a row
+#   were interpolated. Trajectories that use the same pes_interp_file share the points.
+pes_interp = False
+pes_interp_radius = 0.1
+pes_interp_tol = 1.0e-4
+pes_interp_max_skip = 3
+pes_interp_min_points = 2
+pes_interp_file = None
+
 #   GAMESS submission script name
 sub_script = None
 
@@ -107,9 +202,19 @@ def _check_settings():
         opts.p0 = [0.0]*nel
 
 
+    if opts.ensemble_size > 1:
+        if opts.integrator != 'RK4':
+            raise ValueError('Ensemble runs (ensemble_size > 1) are only implemented for the RK4 integrator')
+        if opts.restart != 0:
+            raise ValueError('Ensemble runs (ensemble_size > 1) can not be restarted')
+        if opts.mts_substeps > 1:
+            raise ValueError('Electronic sub-steps (mts_substeps > 1) are not implemented for ensemble runs')
+
     #   set input format to the same type of QC runner
     if opts.mol_input_format == '':
         opts.mol_input_format = opts.QC_RUNNER
+    if opts.QC_RUNNER == 'model' and opts.mol_input_format not in ('gamess', 'terachem'):
+        raise ValueError('QC_RUNNER = "model" needs the normal modes of a molecule: set mol_input_format to "gamess" or "terachem"')
 
     #   logging directory
     opts.logging_dir = os.path.abspath(opts.logging_dir)
@@ -129,6 +234,10 @@ def _check_settings():
             raise RecursionError('logging dir already eists, cou not copy to new numbered dir')
     os.makedirs(opts.logging_dir)
 
+    #   the QC cache is opened lazily, e.g. from the trajectory directories of an ensemble
+    if opts.qc_cache_file is not None:
+        opts.qc_cache_file = os.path.abspath(opts.qc_cache_file)
+
     #   TeraChem settings
     if opts.QC_RUNNER == 'terachem':
         max_state = opts.tcr_state_options.get('max_state', False)
@@ -159,8 +268,14 @@ def _check_settings():
        
 def _set_seed():
     '''
-        set the random number generator seed
+        set the random number generator seed. The PYSCES_SEED environment
+        variable (set by `pysces ensemble` for each trajectory) takes
+        precedence over `input_seed`.
     '''
+    if 'PYSCES_SEED' in os.environ:
+        opts.input_seed = int(os.environ['PYSCES_SEED'])
+    if 'PYSCES_TRAJ_INDEX' in os.environ:
+        opts.traj_index = int(os.environ['PYSCES_TRAJ_INDEX'])
     if 'input_seed' in opts.__dict__:
         import numpy as np
         import random
@@ -186,13 +301,24 @@ def _print_settings():
     print(f'Number of electronic states:        {nel}')
     print(f'Total degress of freedom:           {3*natom + nel}')
     print(f'Sampling method:                    {sampling}')
+    if sampling_qmc is not None:
+        print(f'Quasi-Monte Carlo sequence:         {sampling_qmc} ({qmc_replicate_size} per replicate)')
+    if init_cond_bank is not None:
+        print(f'Initial condition bank:             {init_cond_bank} (trajectory {traj_index})')
+    if ensemble_size > 1:
+        print(f'Number of lockstep trajectories:    {ensemble_size}')
     print(f'Type fo integrator:                 {integrator}')
-    if integrator == 'RK4:':
+    if integrator == 'RK4':
         print(f'Maximum simulation time:            {tmax_rk4:.2f} a.u.')
         print(f'Integrator time step:               {Hrk4} a.u.')
+        print(f'Runge-Kutta scheme:                 {rk_method}')
+        if mts_substeps > 1:
+            print(f'Electronic sub-steps:               {mts_substeps}')
 
     print(f'Normal mode frequency scaling:      {frq_scale}')
     print(f'Electronic structure runner:        {QC_RUNNER}')
+    if QC_RUNNER == 'model':
+        print(f'Model Hamiltonian:                  {model_type if model_file is None else model_file}')
     print(f'Restart file will be written to     {restart_file_in}')
     print(f'current working directory:          {os.path.abspath(os.path.curdir)}')
     print(f'Logs will be written to:            {logging_dir}')
@@ -0,0 +1,378 @@
+"""
+Explicit Runge-Kutta engine used to take one MD step with frozen
+electronic structure (energies, gradients and NACs do not change within
+a step). Schemes are defined by their Butcher tableaus and all stage
+vectors are preallocated once, so a step does not allocate new arrays.
+
+`SplitStep` instead takes steps given in closed form, e.g. by a splitting
+with the electronic mapping variables propagated by a matrix exponential.
+`MultipleTimeStep` splits a step into sub-steps whose derivative functions
+may differ, for electronic structure interpolated in time between QC calls.
+"""
+import time
+import numpy as np
+import scipy.integrate as it
+
+
+class ButcherTableau():
+    def __init__(self, name: str, a, b, c, b_err=None, order: int=None) -> None:
+        '''
+            Coefficients of an explicit Runge-Kutta method
+
+            Parameters
+            ----------
+            name: str
+                label of the method
+            a: array (s, s)
+                strictly lower triangular stage coefficients
+            b: array (s,)
+                weights of the propagating solution
+            c: array (s,)
+                stage nodes
+            b_err: array (s,), optional
+                weights of the embedded solution. If given, the difference
+                `b - b_err` is used as a local error estimate
+            order: int
+                order of the propagating solution
+        '''
+        self.name = name
+        self.a = np.array(a, dtype=float)
+        self.b = np.array(b, dtype=float)
+        self.c = np.array(c, dtype=float)
+        self.order = order
+        self.e = None
+        if b_err is not None:
+            self.e = self.b - np.array(b_err, dtype=float)
+
+    @property
+    def n_stages(self):
+        return len(self.b)
+
+    @property
+    def embedded(self):
+        return self.e is not None
+
+
+TABLEAUS = {
+    #   classical 4th-order Runge-Kutta
+    'rk4': ButcherTableau('rk4',
+        a=[[0.0, 0.0, 0.0, 0.0],
+           [0.5, 0.0, 0.0, 0.0],
+           [0.0, 0.5, 0.0, 0.0],
+           [0.0, 0.0, 1.0, 0.0]],
+        b=[1/6, 1/3, 1/3, 1/6],
+        c=[0.0, 0.5, 0.5, 1.0],
+        order=4),
+
+    #   Kutta's 3/8-rule
+    'rk38': ButcherTableau('rk38',
+        a=[[ 0.0,  0.0, 0.0, 0.0],
+           [ 1/3,  0.0, 0.0, 0.0],
+           [-1/3,  1.0, 0.0, 0.0],
+           [ 1.0, -1.0, 1.0, 0.0]],
+        b=[1/8, 3/8, 3/8, 1/8],
+        c=[0.0, 1/3, 2/3, 1.0],
+        order=4),
+
+    #   Bogacki-Shampine 3(2)
+    'bs32': ButcherTableau('bs32',
+        a=[[0.0, 0.0, 0.0, 0.0],
+           [0.5, 0.0, 0.0, 0.0],
+           [0.0, 0.75, 0.0, 0.0],
+           [2/9, 1/3, 4/9, 0.0]],
+        b=[2/9, 1/3, 4/9, 0.0],
+        b_err=[7/24, 1/4, 1/3, 1/8],
+        c=[0.0, 0.5, 0.75, 1.0],
+        order=3),
+
+    #   Dormand-Prince 5(4), the same pair used by scipy's RK45
+    'dopri5': ButcherTableau('dopri5',
+        a=[[0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+           [1/5, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+           [3/40, 9/40, 0.0, 0.0, 0.0, 0.0, 0.0],
+           [44/45, -56/15, 32/9, 0.0, 0.0, 0.0, 0.0],
+           [19372/6561, -25360/2187, 64448/6561, -212/729, 0.0, 0.0, 0.0],
+           [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656, 0.0, 0.0],
+           [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84, 0.0]],
+        b=[35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84, 0.0],
+        b_err=[5179/57600, 0.0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40],
+        c=[0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0],
+        order=5),
+}
+
+
+class _OneStepIntegrator():
+    def __init__(self, name: str, n: int) -> None:
+        self.name = name
+        self.n = n
+
+        #   statistics
+        self.n_evals = 0
+        self.n_steps = 0
+        self.total_time = 0.0
+        self.last_evals = 0
+        self.last_time = 0.0
+
+    def _update_stats(self, start_time):
+        self.last_time = time.time() - start_time
+        self.n_evals += self.last_evals
+        self.total_time += self.last_time
+        self.n_steps += 1
+
+    def get_step_stats(self):
+        '''
+            Cost of the last step, in the form used for the timings log
+        '''
+        return {'RK_Time': self.last_time, 'RK_Evals': self.last_evals}
+
+    def print_summary(self):
+        n_steps = max(self.n_steps, 1)
+        print(f"Runge-Kutta integrator ({self.name}) summary")
+        print(f"    Steps taken:               {self.n_steps:d}")
+        print(f"    Derivative evaluations:    {self.n_evals:d} ({self.n_evals/n_steps:.1f} per step)")
+        print(f"    Average time per step:     {1000*self.total_time/n_steps:.3f} ms")
+        print()
+
+
+class ExplicitRK(_OneStepIntegrator):
+    def __init__(self, method: str | ButcherTableau, n: int, tol: float=None, max_substeps: int=64) -> None:
+        '''
+            Fixed-step explicit Runge-Kutta integrator working on
+            preallocated stage buffers
+
+            Parameters
+            ----------
+            method: str or ButcherTableau
+                name of a tableau in `TABLEAUS` or a user supplied tableau
+            n: int
+                length of the state vector
+            tol: float, optional
+                tolerance on the embedded error estimate (RMS of the error
+                scaled by 1 + |y|). If the estimate is larger, the step is
+                repeated with twice as many sub-steps. Only used with
+                embedded tableaus.
+            max_substeps: int
+                maximum number of sub-steps a single call may be split into
+        '''
+        if isinstance(method, str):
+            if method not in TABLEAUS:
+                raise ValueError(f'Unknown Runge-Kutta method "{method}". Choose from {list(TABLEAUS.keys())}')
+            method = TABLEAUS[method]
+        if tol is not None and not method.embedded:
+            raise ValueError(f'Runge-Kutta method "{method.name}" has no embedded error estimate; `tol` can not be used')
+
+        super().__init__(method.name, n)
+        self.tableau = method
+        self.tol = tol
+        self.max_substeps = max_substeps
+
+        #   stage buffers
+        self._k = np.zeros((method.n_stages, n))
+        self._y_stage = np.zeros(n)
+        self._y_err = np.zeros(n)
+        self._y0 = np.zeros(n)
+
+        self.last_error = 0.0
+        self.last_substeps = 1
+
+    def _single_step(self, f, y, h, out):
+        '''
+            One step of size h from y, result written into out.
+            Returns the embedded error estimate (or 0.0).
+        '''
+        a, b = self.tableau.a, self.tableau.b
+        k = self._k
+        for s in range(self.tableau.n_stages):
+            np.matmul(h*a[s, :s], k[:s], out=self._y_stage)
+            self._y_stage += y
+            f(self._y_stage, k[s])
+        self.last_evals += self.tableau.n_stages
+
+        error = 0.0
+        if self.tableau.embedded:
+            np.matmul(self.tableau.e, k, out=self._y_err)
+            self._y_err *= h
+            scale = 1.0 + np.abs(y)
+            error = np.sqrt(np.mean((self._y_err/scale)**2))
+
+        #   y and out may be the same array
+        np.matmul(h*b, k, out=self._y_stage)
+        np.add(y, self._y_stage, out=out)
+        return error
+
+    def step(self, f, y, h, out=None):
+        '''
+            Advance y by h
+
+            Parameters
+            ----------
+            f: callable
+                f(y, out) writes dy/dt evaluated at y into out
+            y: ndarray
+                current state
+            h: float
+                step size
+            out: ndarray, optional
+                buffer for the new state
+
+            Returns
+            -------
+            out: ndarray
+                state at t + h
+        '''
+        start = time.time()
+        if out is None:
+            out = np.empty(self.n)
+        np.copyto(self._y0, y)
+        self.last_evals = 0
+
+        n_sub = 1
+        while True:
+            h_sub = h/n_sub
+            error = 0.0
+            np.copyto(out, self._y0)
+            for i in range(n_sub):
+                error = max(error, self._single_step(f, out, h_sub, out))
+            if self.tol is None or error <= self.tol or 2*n_sub > self.max_substeps:
+                break
+            n_sub *= 2
+
+        self.last_error = error
+        self.last_substeps = n_sub
+        self._update_stats(start)
+        return out
+
+    def get_step_stats(self):
+        stats = super().get_step_stats()
+        if self.tableau.embedded:
+            stats['RK_Error'] = self.last_error
+        return stats
+
+
+class ScipyRK45(_OneStepIntegrator):
+    def __init__(self, n: int, rtol: float=1e-10, atol: float=1e-10) -> None:
+        '''
+            Adaptive scipy RK45 (`solve_ivp`) with the same interface as
+            `ExplicitRK`. This is the original PySCES integrator.
+        '''
+        super().__init__('scipy_rk45', n)
+        self.rtol = rtol
+        self.atol = atol
+        self._der = np.zeros(n)
+
+    def step(self, f, y, h, out=None):
+        start = time.time()
+        def get_deriv(t, y0):
+            f(y0, self._der)
+            return self._der.copy()
+        result = it.solve_ivp(get_deriv, (0, h), y, method='RK45', max_step=h, t_eval=[h], rtol=self.rtol, atol=self.atol)
+        if out is None:
+            out = np.empty(self.n)
+        out[:] = result.y[:, -1]
+
+        self.last_evals = result.nfev
+        self._update_stats(start)
+        return out
+
+
+class SplitStep(_OneStepIntegrator):
+    def __init__(self, n: int) -> None:
+        '''
+            Splitting scheme whose parts are integrated exactly, so that the
+            step is given in closed form by the equations of motion
+            themselves (see `subroutines.get_split_step`)
+        '''
+        super().__init__('split', n)
+
+    def step(self, f, y, h, out=None):
+        '''
+            Advance y by h
+
+            Parameters
+            ----------
+            f: callable
+                f(y, h, out) writes the state advanced by h into out and
+                returns its number of evaluations
+            y: ndarray
+                current state
+            h: float
+                step size
+            out: ndarray, optional
+                buffer for the new state, may be y itself
+        '''
+        start = time.time()
+        if out is None:
+            out = np.empty_like(y)
+        self.last_evals = f(y, h, out)
+        self._update_stats(start)
+        return out
+
+
+class MultipleTimeStep():
+    def __init__(self, integrator: _OneStepIntegrator, n_substeps: int) -> None:
+        '''
+            Splits every step of `integrator` into `n_substeps` sub-steps,
+            each with its own derivative function, so that quantities that
+            change within the step (the electronic structure interpolated
+            between two QC results) are resolved on the sub-step scale
+        '''
+        self.integrator = integrator
+        self.n_substeps = n_substeps
+        self.name = f'{integrator.name}, {n_substeps} sub-steps'
+
+        #   cost since the last call of get_step_stats
+        self._evals = 0
+        self._time = 0.0
+
+    def step(self, f_at, y, h, out=None):
+        '''
+            Advance y by h
+
+            Parameters
+            ----------
+            f_at: callable
+                f_at(s) returns the derivative function f(y, out) of the
+                sub-step centered at the fraction s of the step
+            y: ndarray
+                current state
+            h: float
+                step size
+            out: ndarray, optional
+                result array, may be y itself
+        '''
+        start = time.time()
+        if out is None:
+            out = np.array(y, dtype=float)
+        elif out is not y:
+            np.copyto(out, y)
+        h_sub = h/self.n_substeps
+        for k in range(self.n_substeps):
+            self.integrator.step(f_at((k + 0.5)/self.n_substeps), out, h_sub, out=out)
+            self._evals += self.integrator.last_evals
+        self._time += time.time() - start
+        return out
+
+    def get_step_stats(self):
+        '''
+            Cost of all steps since the last call (e.g. predictor and
+            corrector of one MD step), in the form used for the timings log
+        '''
+        stats = self.integrator.get_step_stats()
+        stats.update({'RK_Time': self._time, 'RK_Evals': self._evals})
+        self._evals = 0
+        self._time = 0.0
+        return stats
+
+    def print_summary(self):
+        self.integrator.print_summary()
+
+
+def get_integrator(method: str, n: int, tol: float=None):
+    '''
+        Returns the one-step integrator requested by `rk_method`
+    '''
+    if method.lower() == 'scipy':
+        return ScipyRK45(n)
+    if method.lower() == 'split':
+        return SplitStep(n)
+    return ExplicitRK(method.lower(), n, tol=tol)
@@ -40,15 +40,21 @@ def main():
                 print('WARNING: Wigner population estimator with nel=1 will result in\n')
                 print('an unphysical radius of sampling. Use "sc" option instead.\n')
                 exit()
-            coord = sample_wignerLSC(normal_geo, frq)
-        elif sampling == 'sc':
-            coord = sample_scLSC(normal_geo, frq)
         elif sampling == 'spin':
             if nel != 3:
                 print('WARNING: Spin mapping population estimator with nel being other than 3\n')
                 print('is not implemented. Use "wigner" or "sc" option instead.\n')
                 exit()
-            coord = sample_spinLSC(normal_geo, frq)
+
+        if ensemble_size > 1:
+            # Propagate all trajectories in lockstep
+            from ensemble import sample_ensemble, rk4_ensemble
+            initq, initp = sample_ensemble(ensemble_size, normal_geo, frq)
+            rk4_ensemble(initq, initp, tmax_rk4, Hrk4, amu_mat, U, com_ang, AN_mat)
+            print("\n\nSimulation completed successfully")
+            return
+
+        coord = get_initial_condition(normal_geo, frq)
         
         initq = coord[0,:] # A.U.
         initp = coord[1,:] # A.U.
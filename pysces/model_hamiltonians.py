@@ -0,0 +1,302 @@
+"""
+Analytic multistate model Hamiltonians, used in place of a QC code with
+QC_RUNNER = 'model'.
+
+All models are diabatic potentials W(Q) in the mass-weighted normal
+coordinates Q (a.u.) of the molecule read from the frequency data, measured
+from the reference geometry. `ModelRunner` transforms Cartesian geometries
+into Q, diagonalizes W and returns adiabatic energies, gradients, NACs and
+transition dipoles in the Cartesian form that the QC runners return.
+
+    'lvc'           linear (and optionally quadratic) vibronic coupling in the
+                    dimensionless coordinates q_k = sqrt(w_k) Q_k,
+
+                        W_ij = E_ij + d_ij [sum_k w_k/2 q_k^2 + kappa_ik q_k
+                                            + 1/2 sum_kl gamma_ikl q_k q_l]
+                                    + (1 - d_ij) sum_k lambda_ijk q_k
+
+    'spin_boson'    two states +/- epsilon coupled by delta, with the modes as
+                    an Ohmic bath (Kondo parameter xi, cutoff omega_c); an LVC
+    'tully1'        Tully's single avoided crossing,
+    'tully2'        dual avoided crossing and
+    'tully3'        extended coupling models along one mode, x = x0 + Q_m/sqrt(mass);
+                    the other modes stay harmonic
+
+The diabats carry constant dipoles, by default 1 a.u. along z between every
+pair of states, which give the adiabatic transition dipoles.
+
+LVC models fitted to QC data (see vibronic.py) are stored as .npz files
+and read with `load_model`.
+"""
+import numpy as np
+
+
+class ModelHamiltonian():
+    '''
+        Diabatic potential of `n_states` states in `n_modes` normal coordinates
+    '''
+    n_states = 0
+    n_modes = 0
+
+    def diabatic(self, dQ: np.ndarray):
+        '''
+            Parameters
+            ----------
+            dQ: (..., n_modes) displacements from the reference geometry
+
+            Returns
+            -------
+            W: (..., n_states, n_states) diabatic potential
+            dW: (..., n_states, n_states, n_modes) derivatives with respect to Q
+        '''
+        raise NotImplementedError
+
+
+class LVCModel(ModelHamiltonian):
+    def __init__(self, frq, energies, kappa=None, lam=None, gamma=None) -> None:
+        '''
+            Parameters
+            ----------
+            frq: (n_modes,) vibrational frequencies in a.u.
+            energies: (n_states,) vertical energies, or a (n_states, n_states)
+                matrix that also holds constant diabatic couplings (hartree)
+            kappa: (n_states, n_modes) intrastate couplings (hartree)
+            lam: (n_states, n_states, n_modes) interstate couplings (hartree)
+            gamma: (n_states, n_modes, n_modes) quadratic intrastate couplings (hartree)
+        '''
+        self.frq = np.asarray(frq, dtype=float)
+        energies = np.asarray(energies, dtype=float)
+        if energies.ndim == 1:
+            energies = np.diag(energies)
+        self.n_states, self.n_modes = len(energies), len(self.frq)
+        n, m = self.n_states, self.n_modes
+
+        self.energies = 0.5*(energies + energies.T)
+        self.kappa = np.zeros((n, m)) if kappa is None else np.asarray(kappa, dtype=float).reshape(n, m)
+        self.lam = np.zeros((n, n, m)) if lam is None else np.asarray(lam, dtype=float).reshape(n, n, m)
+        self.lam = 0.5*(self.lam + self.lam.transpose(1, 0, 2))
+        self.lam[np.arange(n), np.arange(n)] = 0.0
+        self.gamma = None
+        if gamma is not None:
+            self.gamma = np.asarray(gamma, dtype=float).reshape(n, m, m)
+            self.gamma = 0.5*(self.gamma + self.gamma.transpose(0, 2, 1))
+
+        #   imaginary modes (negative frequencies) get a negative curvature
+        self._sqrt_frq = np.sqrt(np.abs(self.frq))
+        self._curv = np.sign(self.frq)*np.abs(self.frq)
+
+    def diabatic(self, dQ):
+        n = self.n_states
+        q = dQ*self._sqrt_frq
+        #   derivatives with respect to q
+        dWq = np.broadcast_to(self.lam, q.shape[:-1] + self.lam.shape).copy()
+        diag = (self._curv*q)[..., None, :] + self.kappa
+        if self.gamma is not None:
+            diag = diag + np.einsum('ikl,...l->...ik', self.gamma, q)
+        dWq[..., np.arange(n), np.arange(n), :] = diag
+
+        W = self.energies + np.einsum('ijk,...k->...ij', self.lam, q)
+        onsite = 0.5*np.sum(self._curv*q**2, axis=-1)[..., None] + q @ self.kappa.T
+        if self.gamma is not None:
+            onsite = onsite + 0.5*np.einsum('ikl,...k,...l->...i', self.gamma, q, q)
+        W[..., np.arange(n), np.arange(n)] += onsite
+        return W, dWq*self._sqrt_frq
+
+    def save(self, file_loc: str, dipoles=None, **metadata):
+        '''
+            Writes the parameters (and diabatic dipoles) to an .npz file that
+            `load_model` reads
+        '''
+        data = {'model': 'lvc', 'frq': self.frq, 'energies': self.energies, 'kappa': self.kappa, 'lam': self.lam}
+        if self.gamma is not None:
+            data['gamma'] = self.gamma
+        if dipoles is not None:
+            data['dipoles'] = np.asarray(dipoles, dtype=float)
+        data.update({f'meta_{k}': v for k, v in metadata.items()})
+        np.savez(file_loc, **data)
+
+
+def spin_boson(frq, epsilon=0.0, delta=0.001, xi=0.1, omega_c=None):
+    '''
+        Spin-boson model with the modes as the bath,
+
+            W = [[epsilon + sum_k c_k Q_k, delta], [delta, -epsilon - sum_k c_k Q_k]] + sum_k w_k^2/2 Q_k^2
+
+        with the couplings c_k^2 = xi w_k^2 exp(-w_k/omega_c) dw_k of the
+        Ohmic spectral density J(w) = pi/2 xi w exp(-w/omega_c) discretized
+        on the mode frequencies. omega_c defaults to the mean frequency.
+    '''
+    frq = np.abs(np.asarray(frq, dtype=float))
+    if omega_c is None:
+        omega_c = np.mean(frq)
+    #   frequency interval of every mode (midpoints between sorted frequencies)
+    order = np.argsort(frq)
+    edges = np.concatenate(([0.0], 0.5*(frq[order][1:] + frq[order][:-1]), [frq[order][-1]]))
+    edges[-1] += edges[-1] - edges[-2]
+    dw = np.empty_like(frq)
+    dw[order] = np.diff(edges)
+
+    c = np.sqrt(xi*frq**2*np.exp(-frq/omega_c)*dw)
+    #   LVC couplings in the dimensionless coordinates
+    kappa = np.array([c, -c])/np.sqrt(frq)
+    energies = np.array([[epsilon, delta], [delta, -epsilon]])
+    return LVCModel(frq, energies, kappa)
+
+
+class TullyModel(ModelHamiltonian):
+    PARAMS = {
+        'tully1': {'A': 0.01, 'B': 1.6, 'C': 0.005, 'D': 1.0},
+        'tully2': {'A': 0.1, 'B': 0.28, 'C': 0.015, 'D': 0.06, 'E0': 0.05},
+        'tully3': {'A': 6.0e-4, 'B': 0.1, 'C': 0.9},
+    }
+
+    def __init__(self, kind, frq, mode=None, mass=2000.0, x0=0.0, **params) -> None:
+        '''
+            Parameters
+            ----------
+            kind: 'tully1', 'tully2' or 'tully3'
+            frq: (n_modes,) vibrational frequencies in a.u.
+            mode: index of the normal mode that carries the model coordinate,
+                defaults to the lowest frequency mode
+            mass: mass (a.u.) of the model coordinate x = x0 + Q_mode/sqrt(mass)
+            x0: value of x at the reference geometry
+            params: overrides of Tully's parameters (A, B, C, D, E0)
+        '''
+        if kind not in self.PARAMS:
+            raise ValueError(f'Tully model must be one of {list(self.PARAMS)}, not "{kind}"')
+        self.kind = kind
+        self.frq = np.asarray(frq, dtype=float)
+        self.n_states, self.n_modes = 2, len(self.frq)
+        self.mode = int(np.argmin(np.abs(self.frq))) if mode is None else mode
+        self.mass = mass
+        self.x0 = x0
+        self.params = {**self.PARAMS[kind], **params}
+
+        self._curv = np.sign(self.frq)*self.frq**2
+        self._curv[self.mode] = 0.0
+
+    def _potential(self, x):
+        '''
+            diabatic V11, V22, V12 and their derivatives along x
+        '''
+        p = self.params
+        if self.kind == 'tully1':
+            e = np.exp(-p['B']*np.abs(x))
+            V11 = np.sign(x)*p['A']*(1.0 - e)
+            dV11 = p['A']*p['B']*e
+            V12 = p['C']*np.exp(-p['D']*x**2)
+            return V11, -V11, V12, dV11, -dV11, -2.0*p['D']*x*V12
+        if self.kind == 'tully2':
+            V22 = -p['A']*np.exp(-p['B']*x**2) + p['E0']
+            dV22 = -2.0*p['B']*x*(V22 - p['E0'])
+            V12 = p['C']*np.exp(-p['D']*x**2)
+            zero = np.zeros_like(x)
+            return zero, V22, V12, zero, dV22, -2.0*p['D']*x*V12
+        e = np.exp(-p['C']*np.abs(x))
+        V11 = np.full_like(x, p['A'])
+        V12 = np.where(x < 0, p['B']*e, p['B']*(2.0 - e))
+        dV12 = p['B']*p['C']*e
+        zero = np.zeros_like(x)
+        return V11, -V11, V12, zero, zero, dV12
+
+    def diabatic(self, dQ):
+        x = self.x0 + dQ[..., self.mode]/np.sqrt(self.mass)
+        V11, V22, V12, dV11, dV22, dV12 = self._potential(x)
+        bath = 0.5*np.sum(self._curv*dQ**2, axis=-1)
+
+        W = np.empty(dQ.shape[:-1] + (2, 2))
+        W[..., 0, 0], W[..., 1, 1] = V11 + bath, V22 + bath
+        W[..., 0, 1] = W[..., 1, 0] = V12
+
+        dW = np.zeros(dQ.shape[:-1] + (2, 2, self.n_modes))
+        dW[..., 0, 0, :] = dW[..., 1, 1, :] = self._curv*dQ
+        dW[..., 0, 0, self.mode] = dV11/np.sqrt(self.mass)
+        dW[..., 1, 1, self.mode] = dV22/np.sqrt(self.mass)
+        dW[..., 0, 1, self.mode] = dW[..., 1, 0, self.mode] = dV12/np.sqrt(self.mass)
+        return W, dW
+
+
+def build_model(model_type: str, frq, **params):
+    '''
+        Model Hamiltonian `model_type` in the modes with frequencies `frq` (a.u.)
+    '''
+    if model_type == 'lvc':
+        return LVCModel(frq, **params)
+    if model_type == 'spin_boson':
+        return spin_boson(frq, **params)
+    if model_type in TullyModel.PARAMS:
+        return TullyModel(model_type, frq, **params)
+    raise ValueError(f'Unknown model Hamiltonian "{model_type}"')
+
+
+def load_model(file_loc: str):
+    '''
+        Model written by `LVCModel.save`
+
+        Returns
+        -------
+        model, diabatic dipoles (None if the file has none)
+    '''
+    data = np.load(file_loc)
+    if str(data['model']) != 'lvc':
+        raise ValueError(f'{file_loc} does not hold an LVC model')
+    gamma = data['gamma'] if 'gamma' in data else None
+    dipoles = data['dipoles'] if 'dipoles' in data else None
+    return LVCModel(data['frq'], data['energies'], data['kappa'], data['lam'], gamma), dipoles
+
+
+class ModelRunner():
+    def __init__(self, model: ModelHamiltonian, modes: np.ndarray, au_mas: np.ndarray, Q0: np.ndarray, dipoles=None) -> None:
+        '''
+            Parameters
+            ----------
+            model: ModelHamiltonian
+            modes: (n_modes, nnuc) mass-weighted normal modes as rows (U[6:])
+            au_mas: (nnuc,) masses of the Cartesian coordinates in a.u.
+            Q0: (n_modes,) normal coordinates of the reference geometry
+            dipoles: (n_states, n_states, 3) diabatic dipoles in a.u.
+        '''
+        if len(modes) != model.n_modes:
+            raise ValueError(f'Model Hamiltonian has {model.n_modes} modes, the molecule has {len(modes)}')
+        self.model = model
+        self.modes = np.asarray(modes)
+        self.sqrt_mas = np.sqrt(au_mas)
+        self.Q0 = np.asarray(Q0)
+        n = model.n_states
+        if dipoles is None:
+            dipoles = np.zeros((n, n, 3))
+            dipoles[..., 2] = 1.0 - np.eye(n)
+        self.dipoles = np.asarray(dipoles, dtype=float)
+        self.n_calls = 0
+
+    def compute(self, qCart: np.ndarray):
+        '''
+            Parameters
+            ----------
+            qCart: (..., nnuc) Cartesian geometries in bohr
+
+            Returns
+            -------
+            elecE (..., n), grad (..., n, nnuc), nac (..., n, n, nnuc) with
+            nac[i, j] = <i|d/dR j>, trans_dips (..., n, n, 3)
+        '''
+        qCart = np.asarray(qCart, dtype=float)
+        dQ = (qCart*self.sqrt_mas) @ self.modes.T - self.Q0
+        W, dW = self.model.diabatic(dQ)
+        elecE, U = np.linalg.eigh(W)
+        #   deterministic phases: the largest component of every state is positive
+        big = np.argmax(np.abs(U), axis=-2)[..., None, :]
+        U = U*np.sign(np.take_along_axis(U, big, axis=-2))
+
+        G = np.einsum('...ia,...jb,...ijk->...abk', U, U, dW)
+        G = (G @ self.modes)*self.sqrt_mas
+        n = self.model.n_states
+        grad = G[..., np.arange(n), np.arange(n), :]
+        diff = elecE[..., None, :] - elecE[..., :, None]
+        diff[..., np.arange(n), np.arange(n)] = 1.0
+        nac = G/diff[..., None]
+        nac[..., np.arange(n), np.arange(n), :] = 0.0
+        trans_dips = np.einsum('...ia,...jb,ijx->...abx', U, U, self.dipoles)
+
+        self.n_calls += int(np.prod(qCart.shape[:-1]))
+        return elecE, grad, nac, trans_dips
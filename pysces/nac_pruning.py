@@ -0,0 +1,138 @@
+"""
+Adaptive skipping of NAC jobs for well separated states.
+
+A pair of states (i, j) is not recomputed in the next frame when its
+energy gap, and the gap linearly extrapolated from the last two frames,
+are both above `gap_threshold`, and the norm of the last computed NAC is
+below `norm_threshold`. A pair is recomputed at least every
+`max_skip + 1` frames, and immediately once the gap closes. Skipped NACs
+(and transition dipoles) are replaced by the same linear extrapolation
+of the history that `correct_nac_sign` uses to detect sign flips.
+"""
+import numpy as np
+
+
+class NACPruner():
+    def __init__(self, n_states: int, gap_threshold: float, norm_threshold: float=1.0e-3, max_skip: int=5) -> None:
+        '''
+            Parameters
+            ----------
+            n_states: int
+                number of electronic states
+            gap_threshold: float
+                energy gap (hartree) above which a NAC may be skipped
+            norm_threshold: float
+                norm (a.u.) below which the last computed NAC must be
+            max_skip: int
+                maximum number of consecutive frames a pair is skipped
+        '''
+        self.n_states = n_states
+        self.gap_threshold = gap_threshold
+        self.norm_threshold = norm_threshold
+        self.max_skip = max_skip
+
+        self._energies = []
+        self._norms = np.full((n_states, n_states), np.inf)
+        self._n_skipped = np.zeros((n_states, n_states), dtype=int)
+        self._skip = []
+
+        #   statistics
+        self.n_computed = 0
+        self.n_pruned = 0
+        self.time_saved = 0.0
+        self.n_time_unknown = 0
+        self._frame_time_saved = 0.0
+
+    def select(self):
+        '''
+            Returns
+            -------
+            list of state pairs (i, j), i < j, to skip in the next frame
+        '''
+        self._skip = []
+        if len(self._energies) < 2:
+            return self._skip
+        gap = np.abs(np.subtract.outer(self._energies[-1], self._energies[-1]))
+        prev_gap = np.abs(np.subtract.outer(self._energies[-2], self._energies[-2]))
+        pred_gap = np.minimum(gap, 2.0*gap - prev_gap)
+        for i in range(self.n_states):
+            for j in range(i+1, self.n_states):
+                if pred_gap[i, j] < self.gap_threshold:
+                    continue
+                if self._norms[i, j] >= self.norm_threshold:
+                    continue
+                if self._n_skipped[i, j] >= self.max_skip:
+                    continue
+                self._skip.append((i, j))
+        return self._skip
+
+    def set_time_saved(self, time_saved: float):
+        '''
+            Measured QC time of the skipped jobs of the next frame, None
+            (logged as NaN) if it is not known
+        '''
+        self._frame_time_saved = np.nan if time_saved is None else time_saved
+
+    def update(self, elecE, nac, trans_dips, nac_hist, tdm_hist, has_trans_dip=None):
+        '''
+            Fills the skipped pairs of a new frame with extrapolated values
+            and updates the history of the policy. Must be called before
+            `correct_nac_sign`.
+
+            `trans_dips` may be the partial array of a pruned frame, with
+            `has_trans_dip` (n_states, n_states) marking the computed pairs;
+            only the skipped pairs without a transition dipole are filled.
+            If pairs other than the skipped ones are missing, the transition
+            dipoles of the frame are returned as None.
+
+            Returns
+            -------
+            nac, trans_dips
+        '''
+        if has_trans_dip is not None:
+            has_trans_dip = np.array(has_trans_dip, dtype=bool)
+        for i, j in self._skip:
+            nac[i, j] = 2.0*nac_hist[i, j, :, -1] - nac_hist[i, j, :, -2]
+            nac[j, i] = 2.0*nac_hist[j, i, :, -1] - nac_hist[j, i, :, -2]
+            if trans_dips is None:
+                continue
+            if has_trans_dip is None or not has_trans_dip[i, j]:
+                trans_dips[i, j] = 2.0*tdm_hist[i, j, :, -1] - tdm_hist[i, j, :, -2]
+                trans_dips[j, i] = 2.0*tdm_hist[j, i, :, -1] - tdm_hist[j, i, :, -2]
+            if has_trans_dip is not None:
+                has_trans_dip[i, j] = has_trans_dip[j, i] = True
+        if has_trans_dip is not None and not np.all(has_trans_dip):
+            trans_dips = None
+
+        skipped = np.zeros((self.n_states, self.n_states), dtype=bool)
+        for i, j in self._skip:
+            skipped[i, j] = skipped[j, i] = True
+        norms = np.linalg.norm(nac, axis=-1)
+        self._norms = np.where(skipped, self._norms, norms)
+        self._n_skipped = np.where(skipped, self._n_skipped + 1, 0)
+        self._energies = [self._energies[-1], np.copy(elecE)] if self._energies else [np.copy(elecE)]
+
+        n_pairs = self.n_states*(self.n_states - 1)//2
+        self.n_pruned += len(self._skip)
+        self.n_computed += n_pairs - len(self._skip)
+        if np.isnan(self._frame_time_saved):
+            self.n_time_unknown += 1
+        else:
+            self.time_saved += self._frame_time_saved
+        return nac, trans_dips
+
+    def get_stats(self):
+        return {'NAC_Pruned': len(self._skip), 'NAC_Time_Saved': self._frame_time_saved}
+
+    def print_summary(self):
+        total = self.n_computed + self.n_pruned
+        if total == 0:
+            return
+        print("NAC Pruning")
+        print(f'    Computed:          {self.n_computed:8d}')
+        print(f'    Pruned:            {self.n_pruned:8d}  ({100*self.n_pruned/total:5.1f} %)')
+        if self.n_time_unknown:
+            print(f'    QC time saved (s): {self.time_saved:8.1f}  (unknown in {self.n_time_unknown} frames)')
+        else:
+            print(f'    QC time saved (s): {self.time_saved:8.1f}')
+        print()
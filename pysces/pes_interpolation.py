@@ -0,0 +1,230 @@
+"""
+Trust-radius interpolation of energies, gradients and NACs from previously
+computed geometries, used in front of the QC runner.
+
+Every QC result is stored as a point of a database. At a new geometry x,
+the points within `radius` (bohr) are combined by modified Shepard
+interpolation of their first-order Taylor expansions,
+
+    E_i(x) = sum_p w_p [E_i(x_p) + g_i(x_p).(x - x_p)] / sum_p w_p,
+    w_p    = (1/d_p - 1/radius)^2,
+
+whose analytic derivative gives the gradients, so that the interpolated
+forces are conservative. NACs and transition dipoles are Shepard averages,
+with the sign of every state pair of every point aligned to the nearest
+point first (points can come from trajectories with different phases).
+
+The weighted spread of the Taylor predictions of the points serves as the
+error estimate. The interpolation is used only if at least `min_points`
+points are in range, the estimate is below `tol` (hartree) and fewer than
+`max_skip` QC calls were skipped in a row. Otherwise the QC call is made.
+The interpolant is then compared with the QC result whenever it was
+available, which gives the true error to calibrate `tol` against, and the
+new point is added.
+
+Logged per step: PES_Interp (1 if interpolated), PES_Error (estimate),
+PESQC_Error (interpolant against the QC result, 0 if not checked),
+PES_Saved (QC calls saved so far) and PES_Points (database size).
+
+With `file_loc`, points are appended to a pickle file and the points other
+processes appended are read before every query, so that trajectories
+running in parallel (e.g. `pysces ensemble`) share one database.
+"""
+import os
+import time
+import pickle
+import numpy as np
+
+
+class PESInterpolator():
+    def __init__(self, radius: float=0.1, tol: float=1.0e-4, max_skip: int=3, min_points: int=2, file_loc: str=None) -> None:
+        '''
+            Parameters
+            ----------
+            radius: float
+                trust radius in bohr
+            tol: float
+                largest estimated energy error (hartree) that is interpolated
+            max_skip: int
+                maximum number of consecutive interpolated steps
+            min_points: int
+                number of points within the radius needed to interpolate
+            file_loc: str
+                shared append-only database, or None to keep it in memory
+        '''
+        self.radius = radius
+        self.tol = tol
+        self.max_skip = max_skip
+        self.min_points = max(min_points, 1)
+        self.file_loc = None if file_loc is None else os.path.abspath(file_loc)
+
+        self._geoms = []
+        self._values = []
+        self._geom_array = None
+        self._offset = 0
+        self._n_skipped = 0
+        self._prediction = None
+        self._qc_start = None
+
+        #   statistics
+        self.n_interpolated = 0
+        self.n_computed = 0
+        self.qc_time = 0.0
+        self.step_interpolated = False
+        self.step_error = 0.0
+        self.step_true_error = 0.0
+        self.max_true_error = 0.0
+        self._error_ratios = []
+
+        if self.file_loc is not None:
+            self._sync()
+            if len(self._geoms):
+                print(f'PES interpolation: {len(self._geoms)} points loaded from {self.file_loc}')
+
+    def __len__(self):
+        return len(self._geoms)
+
+    def _sync(self):
+        '''
+            Reads the points appended to the file since the last read
+        '''
+        if self.file_loc is None or not os.path.isfile(self.file_loc):
+            return
+        with open(self.file_loc, 'rb') as file:
+            file.seek(self._offset)
+            while True:
+                try:
+                    geom, values = pickle.load(file)
+                except (EOFError, pickle.UnpicklingError, ValueError):
+                    #   end of file, or a record that is still being written
+                    break
+                self._offset = file.tell()
+                self._geoms.append(geom)
+                self._values.append(values)
+                self._geom_array = None
+
+    def _neighbors(self, qCart):
+        if self._geom_array is None and len(self._geoms):
+            self._geom_array = np.array(self._geoms)
+        if self._geom_array is None:
+            return np.array([], dtype=int), np.array([])
+        dist = np.linalg.norm(self._geom_array - qCart, axis=1)
+        idx = np.flatnonzero(dist < self.radius)
+        return idx, dist[idx]
+
+    def interpolate(self, qCart: np.ndarray):
+        '''
+            Returns
+            -------
+            (elecE, grad, nac, trans_dips), error estimate; or None, inf if
+            fewer than `min_points` points are within the radius
+        '''
+        idx, dist = self._neighbors(qCart)
+        if len(idx) < self.min_points:
+            return None, np.inf
+        nearest = idx[np.argmin(dist)]
+        if np.min(dist) == 0.0:
+            values = {k: None if v is None else np.copy(v) for k, v in self._values[nearest].items()}
+            return (values['elecE'], values['grad'], values['nac'], values['trans_dips']), 0.0
+
+        disp = qCart - self._geom_array[idx]
+        u = 1.0/dist - 1.0/self.radius
+        w = u**2
+        dw = (-2.0*u/dist**3)[:, None]*disp
+        W = np.sum(w)
+
+        E_p = np.array([self._values[k]['elecE'] for k in idx])
+        g_p = np.array([self._values[k]['grad'] for k in idx])
+        taylor = E_p + np.einsum('pin,pn->pi', g_p, disp)
+        elecE = w @ taylor/W
+        grad = (np.einsum('p,pin->in', w, g_p) + np.einsum('pn,pi->in', dw, taylor - elecE))/W
+        error = np.max(np.sqrt(w @ (taylor - elecE)**2/W))
+
+        nac = self._average(idx, w/W, nearest, 'nac')
+        trans_dips = None
+        if all(self._values[k]['trans_dips'] is not None for k in idx):
+            trans_dips = self._average(idx, w/W, nearest, 'trans_dips')
+        return (elecE, grad, nac, trans_dips), error
+
+    def _average(self, idx, weights, nearest, key):
+        ref = self._values[nearest][key]
+        total = np.zeros_like(ref)
+        for k, weight in zip(idx, weights):
+            values = self._values[k][key]
+            sign = np.where(np.sum(values*ref, axis=-1) < 0, -1.0, 1.0)
+            total += weight*sign[..., None]*values
+        return total
+
+    def query(self, qCart: np.ndarray):
+        '''
+            Interpolated (elecE, grad, nac, trans_dips) at qCart, or None if
+            a QC calculation is needed; it must then be passed to `add`
+        '''
+        self._sync()
+        qCart = np.asarray(qCart, dtype=float)
+        values, error = self.interpolate(qCart)
+        self.step_error = error if np.isfinite(error) else 0.0
+        self.step_true_error = 0.0
+        if values is not None and error <= self.tol and self._n_skipped < self.max_skip:
+            self._n_skipped += 1
+            self.n_interpolated += 1
+            self.step_interpolated = True
+            return values
+
+        self._n_skipped = 0
+        self.step_interpolated = False
+        self._prediction = values
+        self._qc_start = time.time()
+        return None
+
+    def add(self, qCart: np.ndarray, elecE, grad, nac, trans_dips=None):
+        '''
+            Stores the QC result at qCart
+        '''
+        if self._qc_start is not None:
+            self.qc_time += time.time() - self._qc_start
+            self._qc_start = None
+        self.n_computed += 1
+        if self._prediction is not None:
+            #   the interpolant was available: compare it with the QC result
+            self.step_true_error = np.max(np.abs(self._prediction[0] - elecE))
+            self.max_true_error = max(self.max_true_error, self.step_true_error)
+            if self.step_error > 0.0:
+                self._error_ratios.append(self.step_true_error/self.step_error)
+            self._prediction = None
+
+        geom = np.array(qCart, dtype=float)
+        values = {'elecE': np.array(elecE), 'grad': np.array(grad), 'nac': np.array(nac),
+                  'trans_dips': None if trans_dips is None else np.array(trans_dips)}
+        if self.file_loc is None:
+            self._geoms.append(geom)
+            self._values.append(values)
+            self._geom_array = None
+            return
+        #   one write per record, so that records of parallel writers do not interleave
+        record = pickle.dumps((geom, values))
+        fd = os.open(self.file_loc, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+        self._sync()
+
+    def get_stats(self):
+        return {'PES_Interp': int(self.step_interpolated), 'PES_Error': self.step_error,
+                'PESQC_Error': self.step_true_error, 'PES_Saved': self.n_interpolated, 'PES_Points': len(self._geoms)}
+
+    def print_summary(self):
+        total = self.n_computed + self.n_interpolated
+        if total == 0:
+            return
+        mean_qc = self.qc_time/self.n_computed if self.n_computed else 0.0
+        print("PES Interpolation")
+        print(f'    QC calls:                  {self.n_computed:8d}')
+        print(f'    Interpolated:              {self.n_interpolated:8d}  ({100*self.n_interpolated/total:5.1f} %)')
+        print(f'    QC time saved (s):         {self.n_interpolated*mean_qc:8.1f}')
+        print(f'    Database points:           {len(self._geoms):8d}')
+        print(f'    Max. checked error (Eh):   {self.max_true_error:8.1e}')
+        if len(self._error_ratios):
+            print(f'    True/estimated error:      {np.median(self._error_ratios):8.2f}  (median of {len(self._error_ratios)} checks)')
+        print()
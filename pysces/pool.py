@@ -0,0 +1,198 @@
+"""
+Process-pool runner for independent trajectories (`pysces ensemble`).
+
+Every trajectory runs in its own process and its own sandbox directory,
+which gets a private copy of the input files. All QC files (cas.inp,
+cas.out, cas.dat, geo_gamess, vec_gamess, progress.out, restart.out, ...)
+are therefore separate, and several GAMESS trajectories can share a node.
+Each trajectory gets its own random seed, and its results are collected
+as soon as it finishes.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+from aggregate import ReplicateAggregator
+
+
+def _trajectory_seeds(seed: int, n_traj: int):
+    '''
+        Independent seeds for each trajectory, spawned from one base seed
+    '''
+    children = np.random.SeedSequence(seed).spawn(n_traj)
+    return [int(c.generate_state(1)[0]) for c in children]
+
+
+def _prepare_sandbox(sandbox: str, input_dir: str, include: list, exclude: list):
+    os.makedirs(sandbox, exist_ok=True)
+    for name in os.listdir(input_dir):
+        path = os.path.join(input_dir, name)
+        if name in exclude or not os.path.isfile(path):
+            continue
+        shutil.copy2(path, sandbox)
+    for name in include:
+        path = os.path.join(input_dir, name)
+        dest = os.path.join(sandbox, name)
+        if os.path.isdir(path):
+            shutil.copytree(path, dest, dirs_exist_ok=True)
+        elif os.path.isfile(path):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(path, dest)
+        else:
+            raise FileNotFoundError(f'Included input "{path}" not found')
+
+
+def _run_trajectory(args):
+    '''
+        Runs one trajectory inside its sandbox. This is executed in a fresh
+        worker process, so the module level settings of `input_simulation`
+        and `subroutines` are loaded from the sandbox.
+    '''
+    index, seed, sandbox, use_bank = args
+    start = time.time()
+    result = {'index': index, 'seed': seed, 'sandbox': sandbox, 'status': 'ok', 'error': ''}
+
+    #   all output of the trajectory, including QC programs, goes to a log file
+    log = open(os.path.join(sandbox, 'pysces.out'), 'w')
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+
+    try:
+        os.chdir(sandbox)
+        os.environ['PYSCES_SEED'] = str(seed)
+        if use_bank:
+            #   the initial condition is read from the bank instead of being sampled
+            os.environ['PYSCES_TRAJ_INDEX'] = str(index)
+        from main import main
+        main()
+    except BaseException as e:
+        #   sys.exit() is used for failures inside the propagation routines
+        traceback.print_exc()
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    result['time'] = time.time() - start
+    return result
+
+
+def _collect_results(result: dict, results_dir: str):
+    '''
+        Copies the correlation functions of a finished trajectory
+        into the common results directory
+    '''
+    index = result['index']
+    sandbox = result['sandbox']
+    collected = []
+    for src, dest in [('corr.out', f'corr_{index:04d}.out'), (os.path.join('logs', 'corr.txt'), f'corr_{index:04d}.txt')]:
+        src = os.path.join(sandbox, src)
+        if os.path.isfile(src):
+            shutil.copy2(src, os.path.join(results_dir, dest))
+            collected.append(dest)
+    return collected
+
+
+def run_ensemble(n_traj: int, max_jobs: int=1, seed: int=None, root: str='ensemble', input_dir: str='.', include: list=[], first_index: int=0, use_bank: bool=False, replicate_size: int=None):
+    '''
+        Runs `n_traj` independent trajectories with a pool of `max_jobs`
+        worker processes (and therefore at most `max_jobs` concurrent
+        QC jobs).
+
+        Parameters
+        ----------
+        n_traj: int
+            number of trajectories
+        max_jobs: int
+            number of trajectories running at the same time
+        seed: int
+            base seed from which the per-trajectory seeds are spawned
+        root: str
+            directory holding the sandbox of each trajectory
+        input_dir: str
+            directory with the input files (input_simulation_local.py,
+            geo_gamess, hess_gamess, ...). All regular files in it are copied
+            into every sandbox
+        include: list of str
+            additional files or directories (relative to `input_dir`) to copy
+        first_index: int
+            index of the first trajectory, to extend a previous ensemble
+        use_bank: bool
+            trajectory k propagates entry k of the initial condition bank
+            (`init_cond_bank` in the input settings, see `pysces sample`)
+        replicate_size: int
+            trajectories per QMC replicate of the bank; the running
+            statistics are then kept per replicate
+
+        Returns
+        -------
+        list of result dictionaries, in the order the trajectories finished
+    '''
+    input_dir = os.path.abspath(input_dir)
+    root = os.path.abspath(root)
+    results_dir = os.path.join(root, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    aggregator = ReplicateAggregator(os.path.join(results_dir, 'pops.npy'), replicate_size)
+
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    seeds = _trajectory_seeds(seed, first_index + n_traj)[first_index:]
+
+    exclude = [os.path.basename(root)]
+    tasks = []
+    for i in range(n_traj):
+        index = first_index + i
+        sandbox = os.path.join(root, f'traj_{index:04d}')
+        _prepare_sandbox(sandbox, input_dir, include, exclude)
+        tasks.append((index, seeds[i], sandbox, use_bank))
+
+    print(f'Running {n_traj} trajectories with up to {max_jobs} at a time')
+    print(f'Base seed: {seed}')
+    print(f'Sandboxes and results in {root}')
+    print(f'Running ensemble statistics in {aggregator.file_loc}')
+
+    #   one fresh process per trajectory, since the simulation settings are module globals
+    ctx = multiprocessing.get_context('spawn')
+    finished = []
+    with ctx.Pool(processes=max_jobs, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(_run_trajectory, tasks):
+            result['collected'] = _collect_results(result, results_dir)
+            finished.append(result)
+            #   corr.out and corr.txt hold the same populations, only one of them is averaged
+            if len(result['collected']) > 0:
+                aggregator.ingest_file(result['index'], os.path.join(results_dir, result['collected'][-1]))
+                aggregator.flush()
+            print(f"[{len(finished):5d}/{n_traj}] trajectory {result['index']:4d} {result['status']:6s} in {result['time']:10.1f} s  {result['error']}")
+            sys.stdout.flush()
+
+    n_failed = sum([r['status'] != 'ok' for r in finished])
+    print(f'{n_traj - n_failed} of {n_traj} trajectories finished successfully')
+    if aggregator.n_states is not None:
+        aggregator.write(os.path.join(results_dir, 'pops_avg.txt'))
+        print(f"Ensemble averaged populations written to {os.path.join(results_dir, 'pops_avg.txt')}")
+    return finished
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pysces ensemble', description='Run independent PySCES trajectories with a process pool')
+    parser.add_argument('-n', '--ntraj', type=int, required=True, help='number of trajectories')
+    parser.add_argument('-j', '--max-jobs', type=int, default=1, help='number of trajectories (and QC jobs) running at the same time')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='base random seed; each trajectory gets its own seed spawned from it')
+    parser.add_argument('-r', '--root', default='ensemble', help='directory for the trajectory sandboxes')
+    parser.add_argument('-i', '--input-dir', default='.', help='directory with the input files')
+    parser.add_argument('--include', nargs='*', default=[], help='extra files or directories to copy into each sandbox')
+    parser.add_argument('--first-index', type=int, default=0, help='index of the first trajectory')
+    parser.add_argument('--use-bank', action='store_true', help='read trajectory k from the initial condition bank (init_cond_bank)')
+    parser.add_argument('--replicate-size', type=int, default=None, help='trajectories per QMC replicate of the bank, for the error estimate')
+    args = parser.parse_args(argv)
+
+    run_ensemble(args.ntraj, args.max_jobs, args.seed, args.root, args.input_dir, args.include, args.first_index, args.use_bank, args.replicate_size)
+
+
+if __name__ == '__main__':
+    main()
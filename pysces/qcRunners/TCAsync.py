@@ -0,0 +1,279 @@
+"""
+Asynchronous TeraChem protobuf clients that share one event loop.
+
+All TCPB connections of a runner are opened with asyncio streams on a
+single event loop running in a background thread, so the jobs of a frame
+are awaited together instead of occupying one thread each. Job input
+messages and results are built and parsed with the tcpb client itself;
+only the socket I/O is replaced.
+
+Instead of the fixed 0.1 s / 0.5 s sleeps of the blocking clients, job
+completion is polled with an adaptive backoff: the first checks are
+tight, and once the median of the previous run times of the same job is
+known, polling is skipped until shortly before the job is expected to
+finish. The detection delay (the last poll interval) and the number of
+status round trips are recorded for every job.
+"""
+import time
+import struct
+import asyncio
+import threading
+import collections
+import numpy as np
+from tcpb import TCProtobufClient as TCPBClient
+from tcpb.exceptions import ServerError
+from tcpb import terachem_server_pb2 as pb
+
+
+class AsyncTCClient():
+    def __init__(self, host: str, port: int) -> None:
+        '''
+            Asyncio counterpart of `TCPBClient` for one TeraChem server
+        '''
+        self.host = host
+        self.port = port
+        #   used to build job inputs and parse job outputs, never connected
+        self._pb_client = TCPBClient(host=host, port=port)
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, timeout=10.0):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+        except (OSError, asyncio.TimeoutError) as msg:
+            raise ServerError(f"Problem connecting to server: {msg}", self._pb_client)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def _send_msg(self, msg_type, msg_pb=None):
+        msg_str = b'' if msg_pb is None else msg_pb.SerializeToString()
+        try:
+            self._writer.write(struct.pack(">II", msg_type, len(msg_str)) + msg_str)
+            await self._writer.drain()
+        except OSError as msg:
+            raise ServerError(f"Could not send message: {msg}", self._pb_client)
+
+    async def _recv_msg(self, msg_type):
+        try:
+            header = await self._reader.readexactly(8)
+            recv_type, size = struct.unpack(">II", header)
+            msg_str = await self._reader.readexactly(size)
+        except (OSError, asyncio.IncompleteReadError) as msg:
+            raise ServerError(f"Could not recv message: {msg}", self._pb_client)
+        if recv_type != msg_type:
+            raise ServerError(f"Received header for incorrect packet type (expecting {msg_type} and got {recv_type})", self._pb_client)
+
+        if msg_type == pb.STATUS:
+            recv_pb = pb.Status()
+        elif msg_type == pb.JOBOUTPUT:
+            recv_pb = pb.JobOutput()
+        else:
+            raise ServerError(f"Unknown message type {msg_type} for received message.", self._pb_client)
+        recv_pb.ParseFromString(msg_str)
+        return recv_pb
+
+    async def is_available(self):
+        await self._send_msg(pb.STATUS, None)
+        status = await self._recv_msg(pb.STATUS)
+        return not status.busy
+
+    async def send_job(self, jobType="energy", geom=None, unitType="bohr", **kwargs):
+        '''
+            Returns True if the server accepted the job, False if it is busy
+        '''
+        if isinstance(geom, np.ndarray):
+            geom = geom.flatten()
+        job_input_msg = self._pb_client._create_job_input_msg(jobType, geom, unitType, **kwargs)
+        await self._send_msg(pb.JOBINPUT, job_input_msg)
+        status_msg = await self._recv_msg(pb.STATUS)
+        if status_msg.WhichOneof("job_status") == "accepted":
+            self._pb_client._set_status(status_msg)
+            return True
+        return False
+
+    async def check_job_complete(self):
+        await self._send_msg(pb.STATUS, None)
+        status = await self._recv_msg(pb.STATUS)
+        if status.WhichOneof("job_status") == "completed":
+            return True
+        elif status.WhichOneof("job_status") == "working":
+            return False
+        raise ServerError(
+            "Invalid or no job status received, either no job submitted before check_job_complete() or major server issue",
+            self._pb_client,
+        )
+
+    async def recv_job(self):
+        '''
+            Results dictionary of the completed job, as from `TCPBClient.recv_job_async`
+        '''
+        output = await self._recv_msg(pb.JOBOUTPUT)
+        #   let tcpb parse the message it would have received itself
+        self._pb_client._recv_msg = lambda msg_type: output
+        try:
+            return self._pb_client.recv_job_async()
+        finally:
+            del self._pb_client._recv_msg
+
+
+class JobTimeHistory():
+    def __init__(self, n_keep=10) -> None:
+        '''
+            Recent run times of every job, used to schedule the polling
+        '''
+        self._times = collections.defaultdict(lambda: collections.deque(maxlen=n_keep))
+
+    def add(self, job_name, run_time):
+        self._times[job_name].append(run_time)
+
+    def expected(self, job_name):
+        if len(self._times[job_name]) == 0:
+            return None
+        return float(np.median(self._times[job_name]))
+
+
+class AdaptiveBackoff():
+    def __init__(self, expected_time=None, min_interval=0.01, max_interval=0.5, growth=1.5, lead=0.8) -> None:
+        '''
+            Poll intervals for one job
+
+            Parameters
+            ----------
+            expected_time: float
+                typical run time of the job in seconds, or None if unknown
+            min_interval, max_interval: float
+                bounds of the interval between two status checks
+            growth: float
+                factor by which the interval grows after every check
+            lead: float
+                fraction of `expected_time` waited before the first check
+        '''
+        self.expected_time = expected_time
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.lead = lead
+        self._interval = min_interval
+        self._n_calls = 0
+
+    def next_interval(self, elapsed):
+        '''
+            Time to wait before the next status check, given the time
+            elapsed since the job was submitted
+        '''
+        self._n_calls += 1
+        if self._n_calls == 1 and self.expected_time is not None:
+            wait = self.lead*self.expected_time - elapsed
+            if wait > self.min_interval:
+                return wait
+        interval = self._interval
+        if self.expected_time is not None:
+            #   stay responsive around the expected completion
+            interval = min(interval, max(self.min_interval, 0.1*self.expected_time))
+        self._interval = min(self._interval*self.growth, self.max_interval)
+        return interval
+
+
+class AsyncTCLoop():
+    def __init__(self, min_interval=0.01, max_interval=0.5) -> None:
+        '''
+            Event loop in a background thread that runs all asynchronous
+            TeraChem jobs of a runner
+        '''
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.history = JobTimeHistory()
+        self._clients = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        #   statistics
+        self.job_stats = collections.defaultdict(lambda: {'n_jobs': 0, 'run_time': 0.0, 'overhead': 0.0, 'n_polls': 0})
+
+    def run(self, coro, timeout=None):
+        '''
+            Runs a coroutine on the loop and waits for its result
+        '''
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return future.result(timeout)
+
+    def get_client(self, host, port):
+        key = (host, port)
+        if key not in self._clients:
+            self._clients[key] = AsyncTCClient(host, port)
+        return self._clients[key]
+
+    def reset(self):
+        '''
+            Drops all connections, e.g. after a server was restarted
+        '''
+        def _close():
+            for client in self._clients.values():
+                client.close()
+        self._loop.call_soon_threadsafe(_close)
+
+    def shutdown(self):
+        self.reset()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def compute_job(self, client: AsyncTCClient, job_name, jobType="energy", geom=None, unitType="bohr", **kwargs):
+        '''
+            Submits a job and waits for it with adaptive backoff polling
+
+            Returns
+            -------
+            results dictionary, dictionary of timing statistics of the job
+        '''
+        if not client.connected:
+            await client.connect()
+
+        start = time.time()
+        backoff = AdaptiveBackoff(None, self.min_interval, self.max_interval)
+        while not await client.send_job(jobType, geom, unitType, **kwargs):
+            await asyncio.sleep(backoff.next_interval(time.time() - start))
+
+        submitted = time.time()
+        backoff = AdaptiveBackoff(self.history.expected(job_name), self.min_interval, self.max_interval)
+        n_polls = 0
+        interval = 0.0
+        while True:
+            n_polls += 1
+            if await client.check_job_complete():
+                break
+            interval = backoff.next_interval(time.time() - submitted)
+            await asyncio.sleep(interval)
+        results = await client.recv_job()
+        end = time.time()
+
+        #   the job finished at some point during the last wait
+        run_time = end - submitted
+        self.history.add(job_name, run_time - 0.5*interval)
+        stats = self.job_stats[job_name]
+        stats['n_jobs'] += 1
+        stats['run_time'] += end - start
+        stats['overhead'] += interval
+        stats['n_polls'] += n_polls
+        return results, {'run_time': end - start, 'overhead': interval, 'n_polls': n_polls}
+
+    def print_stats(self):
+        if len(self.job_stats) == 0:
+            return
+        print("Asynchronous TeraChem Jobs")
+        print(f"    {'Job':>20s}  {'N':>6s}  {'Avg. Time (s)':>14s}  {'Overhead/Job (s)':>18s}  {'Polls/Job':>10s}")
+        total_time = total_overhead = 0.0
+        for name, stats in self.job_stats.items():
+            n = stats['n_jobs']
+            total_time += stats['run_time']
+            total_overhead += stats['overhead']
+            print(f"    {name:>20s}  {n:6d}  {stats['run_time']/n:14.3f}  {stats['overhead']/n:18.3f}  {stats['n_polls']/n:10.1f}")
+        print(f"    Completion detection overhead: at most {total_overhead:.2f} s of {total_time:.2f} s ({100*total_overhead/max(total_time, 1e-12):.1f} %)")
+        print()
@@ -0,0 +1,168 @@
+"""
+Background removal of the job and scratch directories of TeraChem jobs.
+
+Every job leaves a job directory and a scratch directory in the root of its
+server. Once a frame has finished, the directories of older frames are
+handed to a background thread that removes them according to a retention
+policy:
+
+    K (int)     keep the directories of the last K frames
+    'guess'     keep only the orbital files that the next frame uses as
+                guesses (see `_set_guess`), and the job directory of the
+                last job of the frame
+
+Frames are tracked separately for every trajectory (restart tag), so the
+guesses of the trajectories of a batch are kept independently. Output
+files still being read by the `TCOutputCapture` are waited for before
+anything is removed.
+"""
+import os
+import shutil
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _job_dirs(results: dict):
+    root = results.get('server_root', '')
+    dirs = []
+    for key in ('job_dir', 'job_scr_dir'):
+        if results.get(key):
+            dirs.append(os.path.abspath(os.path.join(root, results[key])))
+    return dirs
+
+
+def _guess_files(frame_results: list):
+    '''
+        Orbital files of a frame that `_set_guess` uses for the next frame
+    '''
+    files = []
+    for results in reversed(frame_results):
+        if results.get('castarget', 0) >= 1 and str(results.get('orbfile', '')).endswith('casscf'):
+            files.append(results['orbfile'])
+            break
+    for results in reversed(frame_results):
+        if 'orbfile' in results:
+            files.append(results['orbfile'])
+            break
+
+    paths = []
+    for results in frame_results:
+        root = results.get('server_root', '')
+        for orb_file in files:
+            paths.append(os.path.abspath(os.path.join(root, orb_file)))
+            if orb_file[-6:] == 'casscf':
+                paths.append(os.path.abspath(os.path.join(root, orb_file[0:-7])))
+    return set(paths)
+
+
+def _is_within(path, directory):
+    return path.startswith(directory + os.sep)
+
+
+class TCJanitor():
+    def __init__(self, retention=1, output_capture=None) -> None:
+        '''
+            Parameters
+            ----------
+            retention: int or str
+                number of frames whose directories are kept, or 'guess'
+            output_capture: TCOutputCapture
+                capture whose pending reads are waited for before removing
+        '''
+        if retention != 'guess' and not (isinstance(retention, int) and retention >= 1):
+            raise ValueError(f'TC cleanup retention must be a positive number of frames or "guess", not "{retention}"')
+        self.retention = retention
+        self.output_capture = output_capture
+        self._frames = collections.defaultdict(collections.deque)
+        #   not a daemon: removals that were already queued are finished
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tc_janitor')
+
+        #   statistics
+        self.n_dirs_removed = 0
+        self.n_files_removed = 0
+
+    def add_frame(self, tag: str, frame_results: list):
+        '''
+            Registers the job results of a finished frame of a trajectory
+            and schedules the removal of what is no longer needed
+        '''
+        frames = self._frames[tag]
+        frames.append(list(frame_results))
+        if self.retention == 'guess':
+            remove = [results for frame in list(frames)[0:-1] for results in frame]
+            keep_results = frames[-1]
+            while len(frames) > 1:
+                frames.popleft()
+        else:
+            remove = []
+            while len(frames) > self.retention:
+                remove.extend(frames.popleft())
+            keep_results = []
+        if len(remove) == 0 and len(keep_results) == 0:
+            return
+
+        #   directories of the frames that are kept, of all trajectories
+        in_use = set()
+        for other_tag, kept in self._frames.items():
+            if other_tag == tag and self.retention == 'guess':
+                #   stripped down to its guesses instead
+                continue
+            in_use.update(d for frame in kept for results in frame for d in _job_dirs(results))
+        self._executor.submit(self._clean, remove, keep_results, in_use)
+
+    def _clean(self, remove: list, keep_results: list, in_use=set()):
+        if self.output_capture is not None:
+            self.output_capture.flush()
+
+        #   a directory used by more than one job (e.g. a scratch directory
+        #   shared by the jobs of a server) may still be in use
+        counts = collections.Counter(d for results in remove + keep_results for d in set(_job_dirs(results)))
+        shared = set(d for d, n in counts.items() if n > 1) | in_use
+
+        keep_files = set()
+        keep_dirs = set()
+        if self.retention == 'guess' and len(keep_results):
+            keep_files = _guess_files(keep_results)
+            #   the next frame checks that the last job directory exists
+            keep_dirs.update(_job_dirs(keep_results[-1])[0:1])
+            remove = remove + keep_results
+
+        strip_dirs = set()
+        for results in remove:
+            for job_dir in _job_dirs(results):
+                if job_dir in shared or job_dir in keep_dirs or not os.path.isdir(job_dir):
+                    continue
+                if any(_is_within(path, job_dir) for path in keep_files | keep_dirs):
+                    #   directories holding guess files lose everything else
+                    strip_dirs.add(job_dir)
+                    continue
+                shutil.rmtree(job_dir, ignore_errors=True)
+                self.n_dirs_removed += 1
+
+        for job_dir in strip_dirs:
+            for dir_path, dir_names, file_names in os.walk(job_dir):
+                for name in file_names:
+                    path = os.path.join(dir_path, name)
+                    if path not in keep_files:
+                        self._remove_file(path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+            self.n_files_removed += 1
+        except OSError:
+            pass
+
+    def flush(self):
+        '''
+            Waits until all scheduled removals are done
+        '''
+        self._executor.submit(lambda: None).result()
+
+    def print_stats(self):
+        self.flush()
+        print("TeraChem Directory Cleanup")
+        print(f"    Retention:           {str(self.retention):>8s}")
+        print(f"    Directories removed: {self.n_dirs_removed:8d}")
+        print(f"    Files removed:       {self.n_files_removed:8d}")
+        print()
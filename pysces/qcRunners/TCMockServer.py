@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+Mock TeraChem protobuf (TCPB) server for testing and benchmarking.
+
+Speaks the same protocol as `terachem -s <port>`: jobs are accepted one at
+a time per server, their status is polled, and the results are returned as
+a JobOutput message that the tcpb client parses as usual. Energies,
+gradients, NACs and transition dipoles come from an analytic diabatic
+model (`MockTCModel`), so they are consistent with each other: gradients
+and NACs are the exact derivatives of the adiabatic states.
+
+The run time of every job is drawn from a log-normal distribution per job
+type. A fraction of the jobs can be made to stall (run for `stall_time`
+seconds) or to fail (the server answers the status request without a job
+status, which the client reports as a ServerError). Job and scratch
+directories, a short tc.out and an orbital file are written into the
+working directory, like TeraChem does.
+
+As a script, it is a drop-in replacement for the TeraChem executable,
+e.g. for `TCServerFarm(executable=...)`:
+
+    TCMockServer.py -s <port> [--config config.json]
+
+The configuration (see `DEFAULT_CONFIG`) is read from the JSON file or
+from the TCMOCK_CONFIG environment variable.
+"""
+import os
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+import threading
+import numpy as np
+from tcpb import terachem_server_pb2 as pb
+
+
+ANG2BOHR = 1.0/0.529177210903
+
+DEFAULT_CONFIG = {
+    #   job type -> [median run time (s), sigma of its logarithm]
+    'latency': {'energy': [0.05, 0.0], 'gradient': [0.1, 0.0], 'coupling': [0.2, 0.0]},
+    #   run time increase per excited state of the target
+    'state_scale': 0.0,
+    'stall_prob': 0.0,
+    'stall_time': 60.0,
+    'error_prob': 0.0,
+    'n_states': 6,
+    'write_files': True,
+    'seed': 0,
+}
+
+
+class MockTCModel():
+    def __init__(self, n_states=6, gap=0.08, k=0.02, shift=0.3, coupling=0.004, seed=0) -> None:
+        '''
+            Diabatic model with harmonic diabats displaced along random
+            directions and constant couplings:
+
+                V_ii(x) = i*gap + k/2 |x - x0 - shift*d_i|^2
+                V_ij    = coupling
+
+            x0 is the first geometry (bohr) evaluated. The diabats carry
+            constant random dipoles, which give the transition dipoles.
+        '''
+        self.n_states = n_states
+        self.gap = gap
+        self.k = k
+        self.shift = shift
+        self.coupling = coupling
+        self.seed = seed
+        self.x0 = None
+
+    def _setup(self, x):
+        rng = np.random.default_rng(self.seed)
+        self.x0 = np.copy(x)
+        self.directions = rng.normal(size=(self.n_states, len(x)))
+        self.directions /= np.linalg.norm(self.directions, axis=1)[:, None]
+        self.directions[0] = 0.0
+        self.dipoles = rng.normal(scale=0.5, size=(self.n_states, 3))
+
+    def evaluate(self, x: np.ndarray):
+        '''
+            Parameters
+            ----------
+            x: flat Cartesian geometry in bohr
+
+            Returns
+            -------
+            energies (n,), gradients (n, 3N), NACs (n, n, 3N) with
+            nac[i, j] = <i|d/dx j>, transition dipoles (n, n, 3)
+        '''
+        x = np.asarray(x, dtype=float)
+        if self.x0 is None or len(self.x0) != len(x):
+            self._setup(x)
+        n = self.n_states
+        disp = (x - self.x0)[None, :] - self.shift*self.directions
+        V = np.full((n, n), self.coupling)
+        V[np.diag_indices(n)] = self.gap*np.arange(n) + 0.5*self.k*np.sum(disp**2, axis=1)
+        energies, U = np.linalg.eigh(V)
+        #   deterministic phases
+        U *= np.sign(U[np.argmax(np.abs(U), axis=0), np.arange(n)])
+
+        dV = self.k*disp
+        G = np.einsum('ia,ib,ix->abx', U, U, dV)
+        grads = np.einsum('aax->ax', G)
+        diff = energies[None, :] - energies[:, None]
+        np.fill_diagonal(diff, 1.0)
+        nacs = G/diff[:, :, None]
+        nacs[np.arange(n), np.arange(n)] = 0.0
+        trans_dips = np.einsum('ia,ib,ix->abx', U, U, self.dipoles)
+        return energies, grads, nacs, trans_dips
+
+
+class _Job():
+    def __init__(self, job_id, job_input, done_at, fail) -> None:
+        self.id = job_id
+        self.input = job_input
+        self.done_at = done_at
+        self.fail = fail
+        self.owner = None
+
+
+class MockTCServer():
+    def __init__(self, port: int, host: str='127.0.0.1', config: dict=None, root: str='.') -> None:
+        '''
+            Parameters
+            ----------
+            port, host: address the server listens on
+            config: dictionary of settings, see `DEFAULT_CONFIG`
+            root: directory the job directories are written to
+        '''
+        self.host = host
+        self.port = port
+        self.root = root
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.config['latency'] = {**DEFAULT_CONFIG['latency'], **self.config['latency']}
+        self.model = MockTCModel(self.config['n_states'], seed=self.config['seed'])
+        self._rng = np.random.default_rng(self.config['seed'] + port)
+        self._job = None
+        self._n_jobs = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+        #   statistics
+        self.n_completed = 0
+        self.n_stalled = 0
+        self.n_failed = 0
+
+    @staticmethod
+    def _options(job_input):
+        opts = job_input.user_options
+        return {opts[i]: opts[i+1] for i in range(0, len(opts) - 1, 2)}
+
+    def _run_time(self, job_input, options):
+        run_type = pb.JobInput.RunType.Name(job_input.run).lower()
+        median, sigma = self.config['latency'].get(run_type, self.config['latency']['gradient'])
+        state = max(int(options.get(key, 0)) for key in ('cistarget', 'castarget', 'nacstate1', 'nacstate2'))
+        median *= 1.0 + self.config['state_scale']*state
+        return median*np.exp(sigma*self._rng.normal()) if sigma > 0 else median
+
+    def _accept(self, job_input):
+        options = self._options(job_input)
+        run_time = self._run_time(job_input, options)
+        fail = False
+        draw = self._rng.random()
+        if draw < self.config['stall_prob']:
+            run_time = self.config['stall_time']
+            self.n_stalled += 1
+        elif draw < self.config['stall_prob'] + self.config['error_prob']:
+            fail = True
+        self._n_jobs += 1
+        return _Job(self._n_jobs, job_input, time.time() + run_time, fail)
+
+    def _job_dirs(self, job_id):
+        return f'mock_{self.port}/job_{job_id}', f'mock_{self.port}/scr_{job_id}'
+
+    def _job_output(self, job: _Job):
+        job_input = job.input
+        options = self._options(job_input)
+        xyz = np.array(job_input.mol.xyz)
+        if job_input.mol.units == pb.Mol.ANGSTROM:
+            xyz = xyz*ANG2BOHR
+        energies, grads, nacs, trans_dips = self.model.evaluate(xyz)
+
+        cis = options.get('cis', 'no') == 'yes'
+        cas = options.get('casscf', 'no') == 'yes'
+        n_states = 1
+        if cis:
+            n_states = int(options.get('cisnumstates', 1)) + 1
+        elif cas:
+            n_states = int(options.get('casnumstates', options.get('cassinglets', 1)))
+        n_states = min(n_states, self.model.n_states)
+
+        job_dir, scr_dir = self._job_dirs(job.id)
+        output = pb.JobOutput()
+        output.mol.CopyFrom(job_input.mol)
+        output.energy.extend(energies[0:n_states])
+        output.charges.extend([0.0]*len(job_input.mol.atoms))
+        output.dipoles.extend([0.0, 0.0, 0.0, 0.0])
+        output.job_dir = job_dir
+        output.job_scr_dir = scr_dir
+        output.server_job_id = job.id
+        output.orb1afile = f'{scr_dir}/c0'
+        if not job_input.mol.closed:
+            output.orb1bfile = f'{scr_dir}/c0'
+
+        target = int(options.get('cistarget', options.get('castarget', 0)))
+        if job_input.run == pb.JobInput.GRADIENT:
+            output.gradient.extend(grads[target])
+        elif job_input.run == pb.JobInput.COUPLING:
+            i, j = int(options['nacstate1']), int(options['nacstate2'])
+            output.nacme.extend(nacs[i, j])
+            if cas:
+                output.cas_transition_dipole.extend(trans_dips[i, j])
+        if cis:
+            output.cis_states = n_states - 1
+            for i in range(n_states):
+                for j in range(i+1, n_states):
+                    td = trans_dips[i, j]
+                    output.cis_transition_dipoles.extend(list(td) + [float(np.linalg.norm(td))])
+        if cas:
+            output.cas_energy_states.extend(range(n_states))
+            output.cas_energy_mults.extend([1]*n_states)
+
+        if self.config['write_files']:
+            self._write_files(job_dir, scr_dir, energies[target])
+        return output
+
+    def _write_files(self, job_dir, scr_dir, energy):
+        os.makedirs(os.path.join(self.root, job_dir), exist_ok=True)
+        os.makedirs(os.path.join(self.root, scr_dir), exist_ok=True)
+        with open(os.path.join(self.root, job_dir, 'tc.out'), 'w') as file:
+            file.write(f'Mock TeraChem server on port {self.port}\n')
+            file.write(f'FINAL ENERGY: {energy:.10f} a.u.\n')
+            file.write('Job finished\n')
+        with open(os.path.join(self.root, scr_dir, 'c0'), 'w') as file:
+            file.write('mock orbitals\n')
+
+    async def _send(self, writer, msg_type, msg):
+        msg_str = msg.SerializeToString()
+        writer.write(struct.pack(">II", msg_type, len(msg_str)) + msg_str)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        owner = object()
+        try:
+            while True:
+                header = await reader.readexactly(8)
+                msg_type, size = struct.unpack(">II", header)
+                msg_str = await reader.readexactly(size)
+
+                if self._job is not None and self._job.owner is None and time.time() >= self._job.done_at:
+                    #   a job abandoned by its client has finished
+                    self._job = None
+
+                if msg_type == pb.JOBINPUT:
+                    if self._job is not None:
+                        await self._send(writer, pb.STATUS, pb.Status(busy=True))
+                        continue
+                    job_input = pb.JobInput()
+                    job_input.ParseFromString(msg_str)
+                    self._job = self._accept(job_input)
+                    self._job.owner = owner
+                    job_dir, scr_dir = self._job_dirs(self._job.id)
+                    await self._send(writer, pb.STATUS, pb.Status(accepted=True, job_dir=job_dir, job_scr_dir=scr_dir, server_job_id=self._job.id))
+
+                elif msg_type == pb.STATUS:
+                    job = self._job
+                    if job is None or job.owner is not owner:
+                        await self._send(writer, pb.STATUS, pb.Status(busy=job is not None))
+                    elif time.time() < job.done_at:
+                        await self._send(writer, pb.STATUS, pb.Status(working=True))
+                    elif job.fail:
+                        self._job = None
+                        self.n_failed += 1
+                        await self._send(writer, pb.STATUS, pb.Status())
+                    else:
+                        self._job = None
+                        self.n_completed += 1
+                        output = self._job_output(job)
+                        await self._send(writer, pb.STATUS, pb.Status(completed=True))
+                        await self._send(writer, pb.JOBOUTPUT, output)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._job is not None and self._job.owner is owner:
+                #   the job keeps the server busy until it would have finished
+                self._job.owner = None
+                if time.time() >= self._job.done_at:
+                    self._job = None
+            writer.close()
+
+    async def serve(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self):
+        '''
+            Runs the server on an event loop in a background thread
+        '''
+        started = threading.Event()
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            started.set()
+            self._loop.run_forever()
+            #   close the connections of clients that are still attached
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+        self._thread = threading.Thread(target=_run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        def _stop():
+            self._server.close()
+            self._loop.stop()
+        self._loop.call_soon_threadsafe(_stop)
+        self._thread.join()
+        self._loop = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mock TeraChem protobuf server')
+    parser.add_argument('-s', '--port', type=int, required=True)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--config', default=None, help='JSON file with the server settings')
+    args = parser.parse_args(argv)
+
+    config = json.loads(os.environ.get('TCMOCK_CONFIG', '{}'))
+    if args.config is not None:
+        with open(args.config) as file:
+            config.update(json.load(file))
+    server = MockTCServer(args.port, args.host, config)
+    print(f'Mock TeraChem server listening on {args.host}:{args.port}', flush=True)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
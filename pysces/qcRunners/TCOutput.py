@@ -0,0 +1,140 @@
+"""
+Capture of the tc.out files of TeraChem jobs.
+
+Reading the output of every job into the results can mean megabytes per
+frame from a shared filesystem. The output is instead read (and optionally
+archived) by a background thread after the job has finished, and only
+what the capture mode asks for is kept:
+
+    'full'      all lines
+    'tail'      the last `n_tail` lines
+    'summary'   a few parsed fields (final energy, timing, warnings)
+    'path'      the location of the file (of the archive, if archiving)
+    'none'      nothing
+
+The 'full', 'tail' and 'summary' results are attached to the job results as
+`CapturedOutput` objects, which are only waited for when the jobs are logged.
+With `archive_dir`, every tc.out is gzipped into that directory.
+"""
+import os
+import re
+import gzip
+import shutil
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+CAPTURE_MODES = ('full', 'tail', 'summary', 'path', 'none')
+
+_FINAL_ENERGY = re.compile(r'FINAL ENERGY:\s+(-?\d+\.\d+)')
+_PROCESSING_TIME = re.compile(r'Total processing time:\s+(\d+\.?\d*)')
+
+
+def parse_tc_summary(lines):
+    '''
+        Final energy, total processing time, warnings and whether the job
+        finished, from the lines of a tc.out file
+    '''
+    summary = {'final_energy': None, 'processing_time': None, 'finished': False, 'n_warnings': 0, 'warnings': []}
+    for line in lines:
+        match = _FINAL_ENERGY.search(line)
+        if match:
+            summary['final_energy'] = float(match.group(1))
+        match = _PROCESSING_TIME.search(line)
+        if match:
+            summary['processing_time'] = float(match.group(1))
+        if 'Job finished' in line:
+            summary['finished'] = True
+        if 'WARNING' in line.upper():
+            summary['n_warnings'] += 1
+            if len(summary['warnings']) < 5:
+                summary['warnings'].append(line.strip())
+    return summary
+
+
+class CapturedOutput():
+    __slots__ = ('path', '_future')
+
+    def __init__(self, path, future) -> None:
+        '''
+            Output of a job that is being read in the background
+        '''
+        self.path = path
+        self._future = future
+
+    def result(self):
+        '''
+            The captured lines or summary, None if there was no output file
+        '''
+        return self._future.result()
+
+
+class TCOutputCapture():
+    def __init__(self, mode: str='full', n_tail: int=50, archive_dir: str=None) -> None:
+        '''
+            Parameters
+            ----------
+            mode: str
+                one of 'full', 'tail', 'summary', 'path' or 'none'
+            n_tail: int
+                number of lines kept in 'tail' mode
+            archive_dir: str
+                directory the tc.out files are gzipped to, or None
+        '''
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f'TC output capture mode must be one of {CAPTURE_MODES}, not "{mode}"')
+        self.mode = mode
+        self.n_tail = n_tail
+        self.archive_dir = None
+        if archive_dir is not None:
+            self.archive_dir = os.path.abspath(archive_dir)
+            os.makedirs(self.archive_dir, exist_ok=True)
+        #   not a daemon: pending archives are finished before the program exits
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tc_output')
+
+    def archive_path(self, job_dir: str):
+        name = job_dir.strip(os.sep).replace(os.sep, '_')
+        return os.path.join(self.archive_dir, f'{name}.tc.out.gz')
+
+    def capture(self, results: dict, server_root: str=''):
+        '''
+            Attaches the output of a finished job to its results under
+            'tc.out', according to the capture mode
+        '''
+        if self.mode == 'none' and self.archive_dir is None:
+            return results
+        output_file = os.path.join(server_root, results['job_dir'], 'tc.out')
+        archive_file = None if self.archive_dir is None else self.archive_path(results['job_dir'])
+        future = self._executor.submit(self._process, output_file, archive_file)
+
+        if self.mode == 'path':
+            results['tc.out'] = output_file if archive_file is None else archive_file
+        elif self.mode != 'none':
+            results['tc.out'] = CapturedOutput(output_file, future)
+        return results
+
+    def flush(self):
+        '''
+            Waits until all output files submitted so far have been read
+        '''
+        self._executor.submit(lambda: None).result()
+
+    def _process(self, output_file, archive_file=None):
+        if not os.path.isfile(output_file):
+            print("Warning: Output file not found at ", output_file)
+            return None
+
+        if archive_file is not None:
+            with open(output_file, 'rb') as src, gzip.open(archive_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+
+        if self.mode in ('path', 'none'):
+            return None
+        with open(output_file) as file:
+            if self.mode == 'summary':
+                return parse_tc_summary(file)
+            if self.mode == 'tail':
+                lines = collections.deque(file, maxlen=self.n_tail)
+            else:
+                lines = file.readlines()
+        return [line[0:-1] if line.endswith('\n') else line for line in lines]
@@ -0,0 +1,526 @@
+"""
+Broker that shares a pool of TeraChem servers between many trajectories.
+
+The broker owns one TCPB client per server and runs one worker thread for
+each of them. Trajectories submit the jobs of a frame at once; the jobs
+are queued on the server that finished the trajectory's previous frame,
+so that the `guess`, `casguess` and `cisrestart` files it produced last
+are reused. Workers that run out of jobs steal from the back of the longest
+queue of the other servers.
+
+Servers are health-monitored: a server whose job fails with a server
+error or stalls (runs much longer than the same job usually does) is
+quarantined. Its queued jobs and the failed job are stolen by the healthy
+servers, so trajectories continue at reduced throughput. Idle servers are
+sent a heartbeat every `heartbeat_interval` seconds, and quarantined
+servers are re-admitted once they accept connections and are idle again.
+
+With `hedge_quantile` set, a server that runs out of jobs re-executes a
+straggler: a job running longer than that quantile of the previous run
+times of the same job. The first copy to finish is used and the other one
+is cancelled; its server is disconnected and drained (re-admitted, and
+the abandoned job directory removed, once it is idle again).
+"""
+import os
+import time
+import shutil
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+from tcpb import TCProtobufClient as TCPBClient
+from tcpb.exceptions import ServerError
+
+
+class _PoolJob():
+    __slots__ = ('frame', 'order', 'name', 'props', 'preferred', 'attempts',
+                 'running', 'started', 'hedged', 'done', 'cancel')
+
+    def __init__(self, frame, order, name, props, preferred):
+        self.frame = frame
+        self.order = order
+        self.name = name
+        self.props = props
+        self.preferred = preferred
+        self.attempts = 0
+        #   servers running a copy of the job, for hedged re-execution
+        self.running = []
+        self.started = None
+        self.hedged = False
+        self.done = False
+        self.cancel = threading.Event()
+
+
+class _PoolFrame():
+    def __init__(self, traj_id, n_jobs, geom, excited_type, prev_results) -> None:
+        '''
+            All jobs of one frame of one trajectory
+        '''
+        self.traj_id = traj_id
+        self.geom = geom
+        self.excited_type = excited_type
+        self.prev_results = prev_results
+        self.n_remaining = n_jobs
+        self.results = [None]*n_jobs
+        self.servers = [None]*n_jobs
+        #   job orders in the order the jobs finished
+        self.finished = []
+        self.times = {}
+        self.n_hedged = 0
+        #   results of this frame per server, used as guesses like in `_run_jobs`
+        self.server_results = collections.defaultdict(list)
+        self.future = concurrent.futures.Future()
+
+
+class _PoolServer():
+    def __init__(self, index, host, port, server_root) -> None:
+        self.index = index
+        self.host = host
+        self.port = port
+        self.server_root = server_root
+        self.client = TCPBClient(host=host, port=port)
+        self.queue = collections.deque()
+        self.busy = False
+
+        #   health
+        self.healthy = True
+        self.draining = False
+        self.abandoned_dirs = []
+        self.quarantined_at = None
+        self.last_heartbeat = time.time()
+        #   held while the connection is in use
+        self.lock = threading.Lock()
+
+        #   statistics
+        self.n_jobs = 0
+        self.n_stolen = 0
+        self.n_local = 0
+        self.busy_time = 0.0
+        self.job_times = collections.defaultdict(list)
+        self.n_failures = 0
+        self.n_readmitted = 0
+        self.downtime = 0.0
+
+
+class TCPoolBroker():
+    def __init__(self, hosts: list, ports: list, server_roots: list, max_wait=20, heartbeat_interval=10.0, stall_factor=10.0, max_job_time=None, max_attempts=None, hedge_quantile=None, hedge_min_samples=5) -> None:
+        '''
+            Parameters
+            ----------
+            hosts, ports: lists of the TeraChem server addresses
+            server_roots: list of the directories the servers run in, used
+                to locate guess orbitals of previous jobs
+            max_wait: maximum time in seconds to wait for each server
+            heartbeat_interval: seconds between health checks of idle and
+                quarantined servers
+            stall_factor: a job is considered stalled once it runs this many
+                times longer than the median of its previous run times
+            max_job_time: fixed stall limit in seconds, overrides `stall_factor`
+            max_attempts: number of servers a job is tried on before its
+                frame fails, defaults to twice the number of servers
+            hedge_quantile: quantile (e.g. 0.95) of the run times of a job
+                after which an idle server starts a duplicate; None disables
+                hedged re-execution
+            hedge_min_samples: number of previous run times of a job needed
+                before it can be hedged
+        '''
+        from qcRunners.TeraChem import TCRunner
+        if len(server_roots) == 1:
+            server_roots = list(server_roots)*len(hosts)
+
+        self.servers = []
+        for i, (h, p, r) in enumerate(zip(hosts, ports, server_roots)):
+            server = _PoolServer(i, h, p, r)
+            TCRunner.wait_until_available(server.client, max_wait=max_wait)
+            self.servers.append(server)
+
+        #   server that finished the previous frame of each trajectory, and
+        #   the order in which the jobs of that frame finished
+        self._affinity = {}
+        self._finish_order = {}
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._start_time = time.time()
+
+        self.heartbeat_interval = heartbeat_interval
+        self.stall_factor = stall_factor
+        self.max_job_time = max_job_time
+        self.max_attempts = max_attempts if max_attempts is not None else 2*len(self.servers)
+        self._job_history = collections.defaultdict(lambda: collections.deque(maxlen=50))
+
+        #   hedged re-execution of stragglers
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._running = {}
+        self.n_unique_jobs = 0
+        self.n_hedged = 0
+        self.n_hedge_wins = 0
+        self._latencies = []
+        #   time each copy took that was used, and how long the cancelled
+        #   primary copies had run (a lower bound of their run time)
+        self._primary_latencies = []
+        self._censored = []
+
+        self._threads = []
+        for server in self.servers:
+            thread = threading.Thread(target=self._worker, args=(server,), daemon=True, name=f'TCPool-{server.host}:{server.port}')
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._monitor, daemon=True, name='TCPool-monitor')
+        thread.start()
+        self._threads.append(thread)
+
+    def __del__(self):
+        self.shutdown()
+
+    @property
+    def clients(self):
+        return [s.client for s in self.servers]
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def submit_frame(self, traj_id, jobs: dict, geom, excited_type, prev_results=[]) -> concurrent.futures.Future:
+        '''
+            Queues all jobs of a new frame of trajectory `traj_id`
+
+            Parameters
+            ----------
+            jobs: dictionary of job name -> {'opts', 'type', 'state'}, as
+                built by `TCRunner`
+            geom: geometry in angstrom
+            excited_type: 'cis', 'cas' or None
+            prev_results: job results of the trajectory's previous frame
+
+            Returns
+            -------
+            Future that resolves to (job_results, times), with the job
+            results in the same order as `jobs`
+        '''
+        frame = _PoolFrame(traj_id, len(jobs), geom, excited_type, prev_results)
+        if len(jobs) == 0:
+            frame.future.set_result(([], {}))
+            return frame.future
+
+        with self._cond:
+            order = self._finish_order.get(traj_id)
+            if order is not None and len(order) == len(prev_results):
+                #   newest results last, where `_set_guess` looks first
+                frame.prev_results = [prev_results[i] for i in order]
+            preferred = self._affinity.get(traj_id)
+            if preferred is None or not self.servers[preferred].healthy:
+                #   new trajectory or quarantined server: least loaded healthy server
+                loads = [len(s.queue) + s.busy + (0 if s.healthy else np.inf) for s in self.servers]
+                preferred = int(np.argmin(loads))
+            queue = self.servers[preferred].queue
+            for order, (name, props) in enumerate(jobs.items()):
+                queue.append(_PoolJob(frame, order, name, props, preferred))
+            self._cond.notify_all()
+        return frame.future
+
+    def _next_job(self, server: _PoolServer):
+        '''
+            Own queue first (front), otherwise steal from the back of the
+            longest queue. Quarantined servers take no jobs; their queues
+            are emptied by the others. Must be called with the lock held.
+        '''
+        if not server.healthy:
+            return None
+        if len(server.queue):
+            return server.queue.popleft()
+        victim = max(self.servers, key=lambda s: len(s.queue))
+        if len(victim.queue):
+            return victim.queue.pop()
+        return self._straggler()
+
+    def _straggler(self):
+        '''
+            Longest running job past its hedge quantile that has no
+            duplicate yet. Must be called with the lock held.
+        '''
+        if self.hedge_quantile is None:
+            return None
+        now = time.time()
+        best, best_excess = None, 0.0
+        for job in self._running.values():
+            if job.hedged or job.done or job.frame.future.done():
+                continue
+            history = self._job_history[job.name]
+            if len(history) < self.hedge_min_samples:
+                continue
+            excess = now - job.started - np.quantile(history, self.hedge_quantile)
+            if excess > best_excess:
+                best, best_excess = job, excess
+        if best is not None:
+            best.hedged = True
+            best.frame.n_hedged += 1
+        return best
+
+    def _worker(self, server: _PoolServer):
+        from qcRunners.TeraChem import _run_single_job, TCServerStallError, TCJobCancelled
+        #   with hedging, idle workers look for stragglers regularly
+        wait_time = None if self.hedge_quantile is None else 0.25
+        while True:
+            with self._cond:
+                job = self._next_job(server)
+                while job is None and not self._shutdown:
+                    self._cond.wait(wait_time)
+                    job = self._next_job(server)
+                if self._shutdown:
+                    return
+                server.busy = True
+                if job.started is None:
+                    job.started = time.time()
+                job.running.append(server.index)
+                is_copy = len(job.running) > 1
+                self._running[id(job)] = job
+
+            frame = job.frame
+            guess_results = frame.server_results[server.index] + frame.prev_results
+            start = time.time()
+            server_failed = False
+            cancelled = False
+            try:
+                with server.lock:
+                    results = _run_single_job(server.client, job.name, job.props, frame.geom, frame.excited_type, server.server_root, server.index, guess_results,
+                                              fail_fast=True, stall_time=self._stall_time(job.name), cancel_event=job.cancel)
+                error = None
+            except TCJobCancelled as e:
+                cancelled = True
+            except (ServerError, TCServerStallError, OSError) as e:
+                error = e
+                server_failed = True
+            except BaseException as e:
+                error = e
+            job_time = time.time() - start
+
+            with self._cond:
+                server.busy = False
+                job.running.remove(server.index)
+                if len(job.running) == 0:
+                    self._running.pop(id(job), None)
+                if cancelled:
+                    #   the other copy finished first
+                    self._censored.append(time.time() - job.started)
+                    self._drain(server)
+                    continue
+                if job.done:
+                    #   finished just after the other copy
+                    continue
+                if server_failed:
+                    job.attempts += 1
+                    self._quarantine(server, error)
+                    if len(job.running):
+                        #   the duplicate is still running
+                        continue
+                    if job.attempts < self.max_attempts and not frame.future.done():
+                        #   re-dispatch to the least loaded healthy server; the
+                        #   rest of the queue is stolen by the healthy servers
+                        target = min(self.servers, key=lambda s: (not s.healthy, len(s.queue) + s.busy))
+                        target.queue.appendleft(job)
+                        self._cond.notify_all()
+                        continue
+                job.done = True
+                if len(job.running):
+                    job.cancel.set()
+                server.n_jobs += 1
+                server.busy_time += job_time
+                server.job_times[job.props['type']].append(job_time)
+                if job.preferred == server.index:
+                    server.n_local += 1
+                else:
+                    server.n_stolen += 1
+
+                if frame.future.done():
+                    continue
+                if error is not None:
+                    frame.future.set_exception(error)
+                    continue
+                latency = time.time() - job.started
+                self.n_unique_jobs += 1
+                self._latencies.append(latency)
+                if job.hedged:
+                    self.n_hedged += 1
+                    self.n_hedge_wins += is_copy
+                if not is_copy:
+                    self._primary_latencies.append(latency)
+                self._job_history[job.name].append(job_time)
+                frame.results[job.order] = results
+                frame.servers[job.order] = server.index
+                frame.finished.append(job.order)
+                frame.server_results[server.index].append(results)
+                frame.times[job.name] = job_time
+                frame.n_remaining -= 1
+                if frame.n_remaining == 0:
+                    #   the job that finished last left the newest orbitals on this server
+                    self._affinity[frame.traj_id] = server.index
+                    self._finish_order[frame.traj_id] = frame.finished
+                    if self.hedge_quantile is not None:
+                        frame.times['Hedged'] = frame.n_hedged
+                    frame.future.set_result((frame.results, frame.times))
+
+    def _drain(self, server: _PoolServer):
+        '''
+            Disconnects a server whose job copy was cancelled; it takes new
+            jobs once it has finished the abandoned one. Must be called with
+            the lock held.
+        '''
+        if server.client.curr_job_dir:
+            server.abandoned_dirs.append(os.path.join(server.server_root, server.client.curr_job_dir))
+        try:
+            server.client.disconnect()
+        except Exception:
+            pass
+        server.healthy = False
+        server.draining = True
+        server.quarantined_at = time.time()
+
+    def _stall_time(self, job_name):
+        if self.max_job_time is not None:
+            return self.max_job_time
+        with self._cond:
+            history = list(self._job_history[job_name])
+        if len(history) == 0:
+            return None
+        return self.stall_factor*float(np.median(history))
+
+    def _quarantine(self, server: _PoolServer, error):
+        '''
+            Takes a failing server out of the pool. Must be called with the
+            lock held.
+        '''
+        if not server.healthy:
+            return
+        print(f'TeraChem server {server.host}:{server.port} quarantined: {error}')
+        server.healthy = False
+        server.n_failures += 1
+        server.quarantined_at = time.time()
+        try:
+            server.client.disconnect()
+        except Exception:
+            pass
+        n_healthy = sum(s.healthy for s in self.servers)
+        if n_healthy == 0:
+            print('WARNING: no healthy TeraChem servers left; waiting for one to recover')
+        self._cond.notify_all()
+
+    def _heartbeat(self, server: _PoolServer):
+        '''
+            Health check of an idle server, or recovery check of a
+            quarantined one
+        '''
+        if not server.lock.acquire(blocking=False):
+            #   a job is running, its status polling is the heartbeat
+            return
+        try:
+            if server.healthy:
+                try:
+                    server.client.is_available()
+                    server.last_heartbeat = time.time()
+                except (ServerError, OSError, AttributeError) as error:
+                    with self._cond:
+                        self._quarantine(server, error)
+                return
+
+            client = TCPBClient(host=server.host, port=server.port)
+            try:
+                client.connect()
+                available = client.is_available()
+            except (ServerError, OSError):
+                return
+            if not available:
+                #   still busy with the job it stalled on
+                client.disconnect()
+                return
+            with self._cond:
+                server.client = client
+                server.healthy = True
+                server.last_heartbeat = time.time()
+                if server.draining:
+                    server.draining = False
+                    for job_dir in server.abandoned_dirs:
+                        shutil.rmtree(job_dir, ignore_errors=True)
+                    server.abandoned_dirs = []
+                else:
+                    server.n_readmitted += 1
+                    server.downtime += time.time() - server.quarantined_at
+                    print(f'TeraChem server {server.host}:{server.port} re-admitted')
+                self._cond.notify_all()
+        finally:
+            server.lock.release()
+
+    def _monitor(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._shutdown, timeout=self.heartbeat_interval)
+                if self._shutdown:
+                    return
+                servers = [s for s in self.servers if not s.busy]
+            for server in servers:
+                self._heartbeat(server)
+
+    def get_stats(self):
+        '''
+            Per-server throughput statistics
+
+            Returns
+            -------
+            list of dictionaries, one per server
+        '''
+        wall = time.time() - self._start_time
+        stats = []
+        with self._cond:
+            for s in self.servers:
+                stats.append({
+                    'server': f'{s.host}:{s.port}',
+                    'jobs': s.n_jobs,
+                    'local': s.n_local,
+                    'stolen': s.n_stolen,
+                    'busy_time': s.busy_time,
+                    'utilization': s.busy_time / wall if wall > 0 else 0.0,
+                    'jobs_per_hour': 3600 * s.n_jobs / wall if wall > 0 else 0.0,
+                    'mean_job_time': {k: float(np.mean(v)) for k, v in s.job_times.items()},
+                    'healthy': s.healthy,
+                    'draining': s.draining,
+                    'failures': s.n_failures,
+                    'readmitted': s.n_readmitted,
+                    'downtime': s.downtime + (time.time() - s.quarantined_at if not s.healthy and not s.draining else 0.0),
+                })
+        return stats
+
+    def print_stats(self):
+        print("TeraChem Server Pool Statistics")
+        print(f"    {'Server':25s} {'Jobs':>6s} {'Local':>6s} {'Stolen':>6s} {'Busy (s)':>10s} {'Util.':>6s} {'Jobs/h':>8s} {'Fail':>5s} {'Down (s)':>9s} {'State':>12s}")
+        for s in self.get_stats():
+            state = 'healthy' if s['healthy'] else ('draining' if s['draining'] else 'quarantined')
+            print(f"    {s['server']:25s} {s['jobs']:6d} {s['local']:6d} {s['stolen']:6d} {s['busy_time']:10.1f} {100*s['utilization']:5.1f}% {s['jobs_per_hour']:8.1f} {s['failures']:5d} {s['downtime']:9.1f} {state:>12s}")
+        print()
+        if self.hedge_quantile is not None and self.n_unique_jobs > 0:
+            self.print_hedge_stats()
+
+    def get_hedge_stats(self):
+        '''
+            Hedged re-execution statistics. Cancelled primary copies only
+            give a lower bound of the latency they would have had.
+        '''
+        with self._cond:
+            primary = self._primary_latencies + self._censored
+            stats = {'jobs': self.n_unique_jobs,
+                     'hedged': self.n_hedged,
+                     'hedge_wins': self.n_hedge_wins,
+                     'hedged_fraction': self.n_hedged / max(self.n_unique_jobs, 1)}
+            for q in (0.5, 0.95, 0.99):
+                stats[f'p{int(100*q)}'] = float(np.quantile(self._latencies, q)) if self._latencies else 0.0
+                stats[f'p{int(100*q)}_primary'] = float(np.quantile(primary, q)) if primary else 0.0
+        return stats
+
+    def print_hedge_stats(self):
+        s = self.get_hedge_stats()
+        print("Hedged Re-execution of Stragglers")
+        print(f"    Hedged jobs:     {s['hedged']:8d} of {s['jobs']} ({100*s['hedged_fraction']:5.1f} %), duplicate finished first: {s['hedge_wins']}")
+        print(f"    {'Latency (s)':16s} {'p50':>8s} {'p95':>8s} {'p99':>8s}")
+        print(f"    {'hedged':16s} {s['p50']:8.2f} {s['p95']:8.2f} {s['p99']:8.2f}")
+        print(f"    {'primary (>=)':16s} {s['p50_primary']:8.2f} {s['p95_primary']:8.2f} {s['p99_primary']:8.2f}")
+        print()
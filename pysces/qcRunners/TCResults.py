@@ -0,0 +1,127 @@
+"""
+Array-backed results of one TeraChem frame.
+
+The energies, gradients, NACs and transition dipoles of a frame are
+written into arrays of shape (nel,), (nel, 3N), (nel, nel, 3N) and
+(nel, nel, 3) that are allocated once per frame, in LSC-IVR state order,
+as the job results are added. The raw results dictionary of every job is
+kept as well (it holds the orbital files used as guesses and is what is
+written to jobs_data.yaml); the frame behaves like the list of these
+dictionaries, so it can be used wherever a list of job results was used.
+"""
+import numpy as np
+
+
+def _pair_index(i, j, n):
+    '''
+        Position of the pair (i, j), i < j, in the upper triangle ordering
+        of the `n` states used by `cis_transition_dipoles`
+    '''
+    return i*(2*n - i - 1)//2 + (j - i - 1)
+
+
+class TCFrameResult():
+    __slots__ = ('states', 'energies', 'grads', 'nacs', 'trans_dips', 'has_nac', 'has_trans_dip', 'n_extra_nacs', 'jobs', '_index')
+
+    def __init__(self, states: list, n_atoms: int) -> None:
+        '''
+            Parameters
+            ----------
+            states: list of int
+                TeraChem state numbers of the gradients of the frame
+            n_atoms: int
+                number of atoms
+        '''
+        self.states = sorted(states)
+        self._index = {state: i for i, state in enumerate(self.states)}
+        n = len(self.states)
+        self.energies = np.zeros(n)
+        self.grads = np.zeros((n, n_atoms*3))
+        self.nacs = np.zeros((n, n, n_atoms*3))
+        self.trans_dips = np.zeros((n, n, 3))
+        self.has_nac = np.eye(n, dtype=bool)
+        self.has_trans_dip = np.eye(n, dtype=bool)
+        #   NACs of states without a gradient
+        self.n_extra_nacs = 0
+        self.jobs = []
+
+    @classmethod
+    def from_jobs(cls, job_data: list[dict]):
+        '''
+            Frame of a list of job results, as returned by older runners
+        '''
+        states = [_target_state(job) for job in job_data if job['run'] == 'gradient']
+        frame = cls(states, len(job_data[0]['atoms']))
+        for job in job_data:
+            frame.add_job(job)
+        return frame
+
+    def add_job(self, job: dict):
+        '''
+            Writes the results of a job into the arrays of the frame
+        '''
+        self.jobs.append(job)
+        if job['run'] == 'gradient':
+            state = _target_state(job)
+            i = self._index[state]
+            self.grads[i] = np.ravel(job['gradient'])
+            energy = job['energy']
+            self.energies[i] = energy if isinstance(energy, float) else energy[state]
+
+        elif job['run'] == 'coupling':
+            state_1 = job['nacstate1']
+            state_2 = job['nacstate2']
+            if state_1 not in self._index or state_2 not in self._index:
+                self.n_extra_nacs += 1
+                return
+            i, j = self._index[state_1], self._index[state_2]
+            self.nacs[i, j] = np.ravel(job['nacme'])
+            np.negative(self.nacs[i, j], out=self.nacs[j, i])
+            self.has_nac[i, j] = self.has_nac[j, i] = True
+
+            if 'cis_transition_dipoles' in job:
+                x = len(job['cis_transition_dipoles'])
+                n = int((1 + int(np.sqrt(1 + 8*x)))/2)
+                low, high = min(state_1, state_2), max(state_1, state_2)
+                if high < n:
+                    self.trans_dips[i, j] = job['cis_transition_dipoles'][_pair_index(low, high, n)]
+                    self.trans_dips[j, i] = self.trans_dips[i, j]
+                    self.has_trans_dip[i, j] = self.has_trans_dip[j, i] = True
+
+    def lsc_ivr(self, allow_missing=False):
+        '''
+            Energies, gradients, NACs and transition dipoles in LSC-IVR
+            state order. The arrays of the frame are returned, not copies:
+            they belong to the frame, and callers that modify or keep them
+            copy them first (see `run_TC_cached`).
+            Missing NAC pairs are zero with `allow_missing` and raise an
+            error otherwise. Transition dipoles are None unless all pairs
+            have one; with `allow_missing` the partial array is returned
+            as long as any pair has one, and `has_trans_dip` tells which
+            pairs are set.
+        '''
+        if not allow_missing and (self.n_extra_nacs or not np.all(self.has_nac)):
+            raise RuntimeError('LSC-IVR requires a NAC vector for each gradient pair')
+        if np.all(self.has_trans_dip):
+            trans_dips = self.trans_dips
+        elif allow_missing and np.count_nonzero(self.has_trans_dip) > len(self.states):
+            trans_dips = self.trans_dips
+        else:
+            trans_dips = None
+        return self.energies, self.grads, self.nacs, trans_dips
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __iter__(self):
+        return iter(self.jobs)
+
+    def __reversed__(self):
+        return reversed(self.jobs)
+
+    def __getitem__(self, idx):
+        return self.jobs[idx]
+
+
+def _target_state(job: dict):
+    return job.get('cistarget', job.get('castarget', 0))
@@ -0,0 +1,157 @@
+"""
+Scheduling of the jobs of a frame across the clients of a TCRunner.
+
+The cost of every job is predicted from the run times of the same job in
+previous frames (the `times` dictionaries returned with every frame).
+Jobs are handed out longest-predicted-first from one shared queue, and a
+client that becomes idle pulls the next job, so a long excited-state NAC
+no longer ends up behind other jobs on the same client. One worker
+thread per client is kept alive for the whole run.
+"""
+import time
+import queue
+import threading
+import collections
+import numpy as np
+
+
+class JobCostModel():
+    def __init__(self, n_keep=5) -> None:
+        '''
+            Predicts the run time of a job from its recent history
+        '''
+        self._times = collections.defaultdict(lambda: collections.deque(maxlen=n_keep))
+
+    def update(self, times: dict):
+        for name, run_time in times.items():
+            self._times[name].append(run_time)
+
+    def measured(self, name):
+        '''
+            Mean of the recorded run times of a job, None without history
+        '''
+        if len(self._times.get(name, [])):
+            return float(np.mean(self._times[name]))
+        return None
+
+    def predict(self, name, props: dict):
+        run_time = self.measured(name)
+        if run_time is not None:
+            return run_time
+        #   no history yet: couplings cost more than gradients, and excited
+        #   states more than the ground state
+        if props['type'] == 'coupling':
+            return 2.0 + props['state']
+        return 1.0 + props['state']
+
+    def lpt_order(self, jobs: dict):
+        '''
+            Names of the jobs, longest predicted run time first
+        '''
+        costs = {name: self.predict(name, props) for name, props in jobs.items()}
+        return sorted(jobs, key=lambda name: -costs[name])
+
+
+class _FrameTask():
+    def __init__(self, n_jobs, n_clients, run_job) -> None:
+        self.run_job = run_job
+        self.n_remaining = n_jobs
+        self.results = {}
+        self.times = {}
+        #   results of this frame per client, used as guesses like in `_run_jobs`
+        self.client_results = [[] for i in range(n_clients)]
+        self.error = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+
+class TCJobScheduler():
+    def __init__(self, n_clients: int) -> None:
+        '''
+            Persistent worker threads, one per client, that pull jobs from
+            a shared queue in longest-processing-time order
+        '''
+        self.n_clients = n_clients
+        self.cost_model = JobCostModel()
+        self._queue = queue.Queue()
+        self._workers = []
+
+        #   statistics
+        self.n_frames = 0
+        self.makespan = 0.0
+        self.ideal = 0.0
+
+    def _start_workers(self):
+        for i in range(self.n_clients):
+            worker = threading.Thread(target=self._worker, args=(i,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _worker(self, client_ID):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            task, name, props = item
+            try:
+                start = time.time()
+                results = task.run_job(client_ID, name, props, task.client_results[client_ID])
+                task.times[name] = time.time() - start
+                task.results[name] = results
+                task.client_results[client_ID].append(results)
+            except BaseException as error:
+                task.error = error
+            with task.lock:
+                task.n_remaining -= 1
+                if task.n_remaining == 0:
+                    task.done.set()
+
+    def run_frame(self, jobs: dict, run_job):
+        '''
+            Runs all jobs of a frame
+
+            Parameters
+            ----------
+            jobs: dictionary of job name -> {'opts', 'type', 'state'}
+            run_job: callable(client_ID, name, props, frame_results) that
+                runs one job on a client and returns its results
+
+            Returns
+            -------
+            list of results in the order of `jobs`, dictionary of job times
+        '''
+        if len(self._workers) == 0:
+            self._start_workers()
+        task = _FrameTask(len(jobs), self.n_clients, run_job)
+        for name in self.cost_model.lpt_order(jobs):
+            self._queue.put((task, name, jobs[name]))
+        task.done.wait()
+        if task.error is not None:
+            raise task.error
+
+        return [task.results[name] for name in jobs], task.times
+
+    def record(self, times: dict, makespan: float):
+        '''
+            Adds the job times and the wall time of a frame to the history
+        '''
+        self.cost_model.update(times)
+        run_times = list(times.values())
+        self.n_frames += 1
+        self.makespan += makespan
+        self.ideal += max(np.sum(run_times)/self.n_clients, np.max(run_times))
+
+    def shutdown(self):
+        for worker in self._workers:
+            self._queue.put(None)
+        self._workers = []
+
+    def print_stats(self):
+        if self.n_frames == 0:
+            return
+        print("TeraChem Job Scheduling")
+        print(f"    Frames:              {self.n_frames:8d}")
+        print(f"    Avg. makespan (s):   {self.makespan/self.n_frames:8.3f}")
+        print(f"    Avg. ideal (s):      {self.ideal/self.n_frames:8.3f}")
+        print(f"    Efficiency:          {100*self.ideal/max(self.makespan, 1e-12):8.1f} %")
+        print()
@@ -0,0 +1,242 @@
+"""
+Local farm of TeraChem servers.
+
+Launches N `terachem -s <port>` processes at once, each on a free port, in
+its own working directory and pinned to its own device(s) through an
+environment variable (CUDA_VISIBLE_DEVICES by default). Instead of sleeping
+a fixed time, every server is probed with a TCPB status request until it
+answers. All processes (and their children) are stopped when the farm is
+stopped or the program exits.
+
+Any executable that accepts `-s <port>` and speaks TCPB can be used in
+place of `terachem`, which allows the startup to be tested with a fake
+server.
+"""
+import os
+import time
+import atexit
+import socket
+import shutil
+import subprocess
+import psutil
+from tcpb import TCProtobufClient as TCPBClient
+from tcpb.exceptions import ServerError
+
+
+def find_free_ports(n: int, host: str='127.0.0.1'):
+    '''
+        `n` distinct ports that are free on `host`. The sockets are kept
+        open until all ports are found so no port is handed out twice.
+    '''
+    sockets = []
+    try:
+        for i in range(n):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind((host, 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def port_in_use(host: str, port: int):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1.0)
+        return sock.connect_ex((host, port)) == 0
+
+
+def _kill_tree(process: subprocess.Popen, timeout=10.0):
+    try:
+        parent = psutil.Process(process.pid)
+        children = parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return
+    for proc in [parent] + children:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    gone, alive = psutil.wait_procs([parent] + children, timeout=timeout)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+    process.wait()
+
+
+class TCServerFarm():
+    def __init__(self,
+                 n_servers: int=None,
+                 ports: list=None,
+                 devices: list=None,
+                 server_roots=None,
+                 executable: str='terachem',
+                 host: str=None,
+                 device_env: str='CUDA_VISIBLE_DEVICES',
+                 startup_timeout: float=120.0,
+                 probe_interval: float=0.5,
+                 env: dict=None,
+                 ) -> None:
+        '''
+            Parameters
+            ----------
+            n_servers: int
+                number of servers, defaults to the number of `ports` or
+                `devices`
+            ports: list of int
+                ports of the servers; free ports are allocated if None
+            devices: list
+                device(s) of every server, e.g. [0, 1] or ['0,1', '2,3'];
+                servers are assigned to them round-robin
+            server_roots: str or list of str
+                working directory of every server (where its job directories
+                are written); defaults to server_<port> in the current directory
+            executable: str
+                TeraChem executable, called as `<executable> -s <port>`
+            host: str
+                address the servers are reached at, defaults to this host
+            device_env: str
+                environment variable the device is passed in
+            startup_timeout: float
+                seconds to wait for all servers to answer
+            probe_interval: float
+                seconds between two readiness probes of a server
+            env: dict
+                additional environment variables of the servers
+        '''
+        if n_servers is None:
+            n_servers = len(ports) if ports is not None else len(devices) if devices is not None else 1
+        if ports is not None and len(ports) != n_servers:
+            raise ValueError(f'{len(ports)} ports given for {n_servers} TeraChem servers')
+        if isinstance(server_roots, str):
+            server_roots = [server_roots]*n_servers
+
+        self.n_servers = n_servers
+        self.host = host if host is not None else socket.gethostbyname(socket.gethostname())
+        self.executable = executable
+        self.devices = devices
+        self.device_env = device_env
+        self.startup_timeout = startup_timeout
+        self.probe_interval = probe_interval
+        self._env = {} if env is None else dict(env)
+
+        self.ports = list(ports) if ports is not None else find_free_ports(n_servers, self.host)
+        if server_roots is None:
+            server_roots = [os.path.abspath(f'server_{port}') for port in self.ports]
+        self.server_roots = list(server_roots)
+
+        self._processes = [None]*n_servers
+        self._logs = [None]*n_servers
+        self._stopped = False
+        atexit.register(self.stop)
+
+    @property
+    def hosts(self):
+        return [self.host]*self.n_servers
+
+    def _server_env(self, index):
+        env = os.environ.copy()
+        env.update(self._env)
+        if self.devices is not None and len(self.devices):
+            env[self.device_env] = str(self.devices[index % len(self.devices)])
+        return env
+
+    def _launch(self, index):
+        port = self.ports[index]
+        if port_in_use(self.host, port):
+            raise RuntimeError(f'Port {port} on {self.host} is already in use; Python does not control that TeraChem server')
+        exe = shutil.which(self.executable)
+        if exe is None:
+            raise RuntimeError(f"executable '{self.executable}' not found")
+
+        root = self.server_roots[index]
+        os.makedirs(root, exist_ok=True)
+        self._logs[index] = open(os.path.join(root, f'tc_server_{port}.log'), 'w')
+        self._processes[index] = subprocess.Popen([exe, '-s', str(port)], cwd=root, env=self._server_env(index),
+                                                  stdout=self._logs[index], stderr=subprocess.STDOUT, shell=False)
+
+    def _probe(self, index):
+        '''
+            True once the server answers a status request
+        '''
+        client = TCPBClient(host=self.host, port=self.ports[index])
+        try:
+            client.connect()
+        except (ServerError, OSError):
+            return False
+        try:
+            client.is_available()
+            return True
+        except (ServerError, OSError):
+            return False
+        finally:
+            client.disconnect()
+
+    def _wait_ready(self, indices):
+        start = time.time()
+        waiting = list(indices)
+        while waiting:
+            for index in list(waiting):
+                process = self._processes[index]
+                if process.poll() is not None:
+                    raise RuntimeError(f'TeraChem server on port {self.ports[index]} exited with code {process.returncode} during startup; see {self._logs[index].name}')
+                if self._probe(index):
+                    waiting.remove(index)
+            if not waiting:
+                break
+            if time.time() - start > self.startup_timeout:
+                ports = [self.ports[i] for i in waiting]
+                raise TimeoutError(f'TeraChem servers on ports {ports} did not become available within {self.startup_timeout} seconds')
+            time.sleep(self.probe_interval)
+        return time.time() - start
+
+    def start(self):
+        '''
+            Launches all servers at once and waits until every one answers
+        '''
+        self._stopped = False
+        try:
+            for index in range(self.n_servers):
+                self._launch(index)
+            wait_time = self._wait_ready(range(self.n_servers))
+        except BaseException:
+            self.stop()
+            raise
+        print(f'Started {self.n_servers} TeraChem server(s) on {self.host}, ports {self.ports}, in {wait_time:.1f} seconds')
+        return self
+
+    def restart(self, port: int):
+        '''
+            Stops the server on `port` and starts it again
+        '''
+        index = self.ports.index(port)
+        self._stop_server(index)
+        self._launch(index)
+        self._wait_ready([index])
+        print(f'Restarted TeraChem server on {self.host}:{port}')
+
+    def _stop_server(self, index):
+        if self._processes[index] is not None:
+            _kill_tree(self._processes[index])
+            self._processes[index] = None
+        if self._logs[index] is not None:
+            self._logs[index].close()
+            self._logs[index] = None
+
+    def stop(self):
+        '''
+            Stops all servers and their child processes
+        '''
+        if self._stopped:
+            return
+        for index in range(self.n_servers):
+            self._stop_server(index)
+        self._stopped = True
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
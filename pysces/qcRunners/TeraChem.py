@@ -8,21 +8,36 @@ from tcpb import terachem_server_pb2 as pb
 import time
 import warnings
 import shutil
-import socket
-import subprocess
 import time
-import psutil
-import concurrent.futures
+import collections
+import asyncio
 import copy
+from qcRunners.TCPool import TCPoolBroker
+from qcRunners.TCAsync import AsyncTCLoop
+from qcRunners.TCScheduler import TCJobScheduler
+from qcRunners.TCResults import TCFrameResult
+from qcRunners.TCOutput import TCOutputCapture
+from qcRunners.TCJanitor import TCJanitor
+from qcRunners.TCServerFarm import TCServerFarm
 
 
 _server_processes = {}
 
+#   how the tc.out of every job is kept, set by the TCRunner
+_output_capture = TCOutputCapture('full')
+
+#   entries of the frame timings that are not job times
+_FRAME_STATS = ('TC_Overhead', 'Saved_SCF', 'Hedged')
+
 class TCServerStallError(Exception):
     def __init__(self, message):            
         # Call the base class constructor with the parameters it needs
         super().__init__(message)
 
+class TCJobCancelled(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
 def _val_or_iter(x):
     try:
         iter(x)
@@ -64,39 +79,10 @@ def start_TC_server(port: int):
         -------
         host: string, the host of the server being run
     '''
-    host = socket.gethostbyname(socket.gethostname())
-
-    #   make sure terachem executable is found
-    tc_bin = shutil.which('terachem')
-    if tc_bin is None:
-        raise RuntimeError("executable 'terachem' not fond")
-    
-    #   make sure the server isn't already running with this host:port combo
-    try:
-        tmp_client = TCPBClient(host, port)
-        tmp_client.connect()
-        if tmp_client.is_available():
-            raise Exception(f'Python does not controll TC Server at {host}:{port}')
-    except ServerError:
-        #   A server error indicates that it is NOT running.
-        #   This is GOOD, now we can continue to start our own process.
-        pass
-    
-    #   start TC process
-    command = f'terachem -s {port}'
-    process = subprocess.Popen(command.split(), shell=False)
-    time.sleep(10)
-
-    #   set up a temporary client to make sure it is open
-    try:
-        tmp_client = TCPBClient(host, port)
-        TCRunner.wait_until_available(tmp_client)
-        _server_processes[(host, port)] = process
-        tmp_client.disconnect()
-    except TimeoutError as e:
-        raise RuntimeError(f'Could not start TeraChem server on {host} with port {port}')
-    
-    return host
+    farm = TCServerFarm(ports=[port], server_roots='.')
+    farm.start()
+    _server_processes[(farm.host, port)] = farm
+    return farm.host
 
 def stop_TC_server(host: str, port: int):
     '''
@@ -105,32 +91,9 @@ def stop_TC_server(host: str, port: int):
     key = (host, port)
     if key not  in _server_processes:
         raise ValueError(f'Host:port {host}:{port} not found in current process list. Python must own the server process.')
-    
-    parent_pid = _server_processes[(host, port)].pid
-    parent = psutil.Process(parent_pid)
-    for child in parent.children(recursive=True):  # or parent.children() for recursive=False
-        child.kill()
-    parent.kill()
-
-def _start_TC_server(port: int):
-    ip = socket.gethostbyname(socket.gethostname())
-
-    #   make sure terachem executable is found
-    tc_bin = shutil.which('terachem')
-    if tc_bin is None:
-        raise RuntimeError("executable 'terachem' not fond")
-    
-    try:
-        command = f'terachem -s {port}'
-        process = subprocess.Popen(command.split())
-        # process = subprocess.run(command.split())
-        _server_processes[port] = process
-    except:
-        return None
-    
-    return ip
+    _server_processes.pop(key).stop()
 
-def compute_job_sync(client: TCPBClient, jobType="energy", geom=None, unitType="bohr", **kwargs):
+def compute_job_sync(client: TCPBClient, jobType="energy", geom=None, unitType="bohr", stall_time=None, cancel_event=None, **kwargs):
     """Wrapper for send_job_async() and recv_job_async(), using check_job_complete() to poll the server.
     Main funcitonality is coppied from TCProtobufClient.send_job_async() and
     TCProtobufClient.check_job_complete(). This is mostly to change the time in which the server is pinged. 
@@ -139,6 +102,8 @@ def compute_job_sync(client: TCPBClient, jobType="energy", geom=None, unitType="
         jobType:    Job type key, as defined in the pb.JobInput.RunType enum (defaults to 'energy')
         geom:       Cartesian geometry of the new point
         unitType:   Unit type key, as defined in the pb.Mol.UnitType enum (defaults to 'bohr')
+        stall_time: Seconds after which the server is considered stalled (defaults to no limit)
+        cancel_event: threading.Event that stops waiting for the job when set
         **kwargs:   Additional TeraChem keywords, check _process_kwargs for behaviour
 
     Returns:
@@ -146,6 +111,7 @@ def compute_job_sync(client: TCPBClient, jobType="energy", geom=None, unitType="
     """
 
     print("Submitting Job...")
+    start = time.time()
     accepted = client.send_job_async(jobType, geom, unitType, **kwargs)
     while accepted is False:
         time.sleep(0.1)
@@ -153,6 +119,10 @@ def compute_job_sync(client: TCPBClient, jobType="energy", geom=None, unitType="
 
     completed = client.check_job_complete()
     while completed is False:
+        if stall_time is not None and time.time() - start > stall_time:
+            raise TCServerStallError(f'TeraChem server {client.host}:{client.port} might have stalled')
+        if cancel_event is not None and cancel_event.is_set():
+            raise TCJobCancelled(f'Job on TeraChem server {client.host}:{client.port} cancelled')
         time.sleep(0.1)
         client._send_msg(pb.STATUS, None)
         status = client._recv_msg(pb.STATUS)
@@ -180,8 +150,22 @@ class TCRunner():
                  start_new:  bool=False,
                  run_options: dict={}, 
                  max_wait=20,
+                 use_pool: bool=False,
+                 use_async: bool=False,
+                 hedge_quantile: float=None,
+                 output_capture: TCOutputCapture=None,
+                 janitor: TCJanitor=None,
+                 server_farm: TCServerFarm=None,
                  ) -> None:
 
+        global _output_capture
+        if output_capture is not None:
+            _output_capture = output_capture
+        #   removes the directories of old jobs in the background
+        self._janitor = janitor
+        if janitor is not None and janitor.output_capture is None:
+            janitor.output_capture = _output_capture
+
         if isinstance(hosts, str):
             hosts = [hosts]
         if isinstance(ports, int):
@@ -190,17 +174,37 @@ class TCRunner():
             server_roots = [server_roots]
 
         #   set up the servers
-        if start_new:
-            hosts = start_TC_server(ports)
+        if start_new and server_farm is None:
+            server_farm = TCServerFarm(ports=ports, server_roots=server_roots if len(server_roots) > 1 else server_roots[0]).start()
+        self._farm = server_farm
+        if server_farm is not None:
+            hosts, ports, server_roots = server_farm.hosts, server_farm.ports, server_farm.server_roots
 
         self._host_list = hosts
         self._port_list = ports
         self._server_root_list = server_roots
         self._client_list = []
-        for h, p in zip(hosts, ports):
-            client = TCPBClient(host=h, port=p)
-            self.wait_until_available(client, max_wait=max_wait)
-            self._client_list.append(client)
+        self._pool = None
+        if use_pool:
+            #   the broker owns all connections and schedules the jobs
+            self._pool = TCPoolBroker(hosts, ports, server_roots, max_wait=max_wait, hedge_quantile=hedge_quantile)
+            self._client_list = self._pool.clients
+        else:
+            for h, p in zip(hosts, ports):
+                client = TCPBClient(host=h, port=p)
+                self.wait_until_available(client, max_wait=max_wait)
+                self._client_list.append(client)
+
+        #   event loop that multiplexes asynchronous connections to all servers
+        self._async = None
+        if use_async and self._pool is None:
+            self._async = AsyncTCLoop()
+            #   the blocking connections were only needed to wait for the servers
+            for client in self._client_list:
+                client.disconnect()
+
+        #   distributes the jobs of a frame over the clients
+        self._scheduler = TCJobScheduler(len(self._client_list))
 
         self._client = self._client_list[0]
         self._host = hosts[0]
@@ -231,6 +235,10 @@ class TCRunner():
         # self._max_state = run_options.get('max_state', 0)
         # self._grads = run_options.get('grads', False)
         self._NACs = run_options.pop('nacs', False)
+        #   start all jobs of a frame from one converged reference job
+        self._share_scf = run_options.get('share_scf', False)
+        #   NACs left out of the next frame
+        self._skip_nacs = set()
 
         #   job options for specific jobs
         self._spec_job_opts = tc_spec_job_opts
@@ -240,6 +248,10 @@ class TCRunner():
 
         self._prev_results = []
         self._frame_counter = 0
+
+        #   per-trajectory state for batched (ensemble) runs
+        self._restart_tag = str(os.getpid())
+        self._batch_states = {}
         
 
     @staticmethod
@@ -268,16 +280,11 @@ class TCRunner():
     
     @staticmethod
     def append_output_file(results: dict, server_root=''):
-        output_file = os.path.join(server_root, results['job_dir'], 'tc.out')
-        if os.path.isfile(output_file):
-            # results['tc.out'] = open(results_file).readlines()
-            lines = open(output_file).readlines()
-            for n in range(len(lines)):
-                lines[n] = lines[n][0:-1]
-            results['tc.out'] = lines
-        else:
-            print("Warning: Output file not found at ", output_file)
-        return results
+        '''
+            Attaches the tc.out of the job, read in the background according
+            to the output capture mode
+        '''
+        return _output_capture.capture(results, server_root)
     
     @staticmethod
     def remove_previous_job_dir(client: TCPBClient):
@@ -399,16 +406,105 @@ class TCRunner():
         except TCServerStallError as error:
             host, port = self._host, self._port
             print('TC Server stalled: attempting to restart server')
-            stop_TC_server(host, port)
-            time.sleep(2.0)
-            start_TC_server(port)
+            if self._farm is not None:
+                self._farm.restart(port)
+            else:
+                stop_TC_server(host, port)
+                time.sleep(2.0)
+                start_TC_server(port)
             self._client = TCPBClient(host=host, port=port)
             self.wait_until_available(self._client, max_wait=20)
+            if self._async is not None:
+                self._client.disconnect()
+                self._async.reset()
             print('Started new TC Server: re-running current step')
             result = self.run_TC_new_geom(geom)
                 
         return result
     
+    def run_TC_batch(self, geoms, traj_ids=None):
+        '''
+            Runs a new frame for several independent trajectories, e.g. the
+            members of a lockstep ensemble. Guess orbitals, CIS restart files
+            and frame counters are kept separately for every trajectory.
+
+            Parameters
+            ----------
+            geoms: list of geometries in angstrom
+            traj_ids: list of trajectory labels, defaults to 0, 1, 2, ...
+
+            Returns
+            -------
+            list of (job_results, times) tuples, one for each geometry.
+            Frames that failed are returned as (None, {}) and leave the
+            state of their trajectory unchanged.
+        '''
+        if traj_ids is None:
+            traj_ids = list(range(len(geoms)))
+
+        batch_results = []
+        if self._pool is None:
+            for traj_id, geom in zip(traj_ids, geoms):
+                self._set_batch_state(traj_id)
+                try:
+                    batch_results.append(self.run_TC_new_geom(geom))
+                except Exception as error:
+                    print(f"Frame of trajectory {traj_id} failed: {error}")
+                    batch_results.append((None, {}))
+                    continue
+                self._batch_states[traj_id] = (self._prev_results, self._frame_counter)
+            return batch_results
+
+        #   with a server pool, the frames of all trajectories are in flight at once
+        futures = []
+        for traj_id, geom in zip(traj_ids, geoms):
+            self._set_batch_state(traj_id)
+            jobs, excited_type = self._build_frame_jobs()
+            futures.append(self._pool.submit_frame(self._restart_tag, jobs, geom, excited_type, self._prev_results))
+        for traj_id, future in zip(traj_ids, futures):
+            self._set_batch_state(traj_id)
+            try:
+                all_results, times = future.result()
+            except Exception as error:
+                #   e.g. a ServerError on every server the job was tried on
+                print(f"Frame of trajectory {traj_id} failed: {error}")
+                batch_results.append((None, {}))
+                continue
+            batch_results.append(self._finish_frame(all_results, times))
+            self._batch_states[traj_id] = (self._prev_results, self._frame_counter)
+
+        return batch_results
+
+    def _set_batch_state(self, traj_id):
+        self._prev_results, self._frame_counter = self._batch_states.get(traj_id, ([], 0))
+        self._restart_tag = f'{os.getpid()}_{traj_id}'
+
+    def set_skipped_nacs(self, pairs: list):
+        '''
+            Leaves the NAC jobs of the pairs of (TC) states out of the next
+            frame
+
+            Returns
+            -------
+            mean measured run time of the skipped jobs in seconds summed
+            over the pairs, None if a skipped job has no recorded run time
+        '''
+        self._skip_nacs = set((min(i, j), max(i, j)) for i, j in pairs)
+        times = [self._scheduler.cost_model.measured(f'nac_{i}_{j}') for i, j in self._skip_nacs]
+        if None in times:
+            return None
+        return float(np.sum(times))
+
+    def print_pool_stats(self):
+        if self._pool is not None:
+            self._pool.print_stats()
+        if self._async is not None:
+            self._async.print_stats()
+        if self._pool is None and len(self._client_list) > 1:
+            self._scheduler.print_stats()
+        if self._janitor is not None:
+            self._janitor.print_stats()
+
     def set_avg_max_times(self, times: dict):
         max_time = np.max(list(times.values()))
         self._max_time_list.append(max_time)
@@ -418,7 +514,23 @@ class TCRunner():
     def _run_TC_new_geom_kernel(self, geom):
 
         self._n_calls += 1
-        client = self._client
+        jobs, excited_type = self._build_frame_jobs()
+        if self._pool is not None:
+            all_results, times = self._pool.submit_frame(self._restart_tag, jobs, geom, excited_type, self._prev_results).result()
+        else:
+            all_results, times = self._run_frame_jobs(jobs, geom, excited_type)
+
+        return self._finish_frame(all_results, times)
+
+    def _build_frame_jobs(self):
+        '''
+            Sets up the options of all jobs of the next frame
+
+            Returns
+            -------
+            jobs: dictionary of job name -> {'opts', 'type', 'state'}
+            excited_type: 'cis', 'cas' or None
+        '''
         atoms = self._atoms
         opts = self._base_options.copy()
         max_state = self._max_state
@@ -426,8 +538,6 @@ class TCRunner():
         couplings = self._NACs
 
         self._job_counter = 0
-    
-        times = {}
 
         #   convert all keys to lowercase
         orig_opts = {}
@@ -450,7 +560,7 @@ class TCRunner():
                     excited_options[key] = val
                 else:
                     base_options[key] = val
-            self._ci_guess = 'cis_restart_' + str(os.getpid())
+            self._ci_guess = 'cis_restart_' + self._restart_tag
         elif orig_opts.get('casscf', '') == 'yes' or orig_opts.get('casci', '') == 'yes':
             excited_type = 'cas'
             #   CAS-CI and CAS-SCF
@@ -502,25 +612,20 @@ class TCRunner():
                 excited_options['cassinglets'] = max_state + 1
 
         if max_state > 0:
-            base_options['cisrestart'] = 'cis_restart_' + str(os.getpid())
+            base_options['cisrestart'] = 'cis_restart_' + self._restart_tag
         base_options['purify'] = False
         base_options['atoms'] = atoms
 
 
-        n_clients = len(self._client_list)
-        jobs_to_run = [{} for i in range(n_clients)]
-        job_num = 0
+        jobs = {}
 
         #   run energy only if gradients and NACs are not requested
-        all_results = []
         if len(grads) == 0 and len(NACs) == 0:
-            job_opts = base_options.copy()
-            start = time.time()
-            results = self.compute_job_sync_with_restart('energy', geom, 'angstrom', **job_opts)
-            times[f'energy'] = time.time() - start
-            results['run'] = 'energy'
-            results.update(job_opts)
-            all_results.append(results)
+            jobs['energy'] = {
+                'opts': base_options.copy(),
+                'type': 'energy',
+                'state': 0
+                }
 
         #   create gradient job properties
         #   gradient computations have to be separated from NACs
@@ -541,12 +646,11 @@ class TCRunner():
                     
             # self._set_guess(job_opts, excited_type, all_results, state)
 
-            jobs_to_run[job_num % n_clients][name] = {
+            jobs[name] = {
                 'opts': job_opts.copy(), 
                 'type': 'gradient', 
                 'state': state
                 }
-            job_num += 1
 
 
         #   create NAC job properties
@@ -567,41 +671,152 @@ class TCRunner():
             job_opts['nacstate1'] = nac1
             job_opts['nacstate2'] = nac2
 
-            jobs_to_run[job_num % n_clients][name] = {
+            jobs[name] = {
                 'opts': job_opts.copy(),
                 'type': 'coupling',
                 'state': max(nac1, nac2)
                 }
-            job_num += 1
 
+        #   keep the timing columns fixed when NACs are skipped
+        self._job_order = list(jobs)
+        for i, j in self._skip_nacs:
+            jobs.pop(f'nac_{i}_{j}', None)
 
-        #   if only one client is being used, don't open up threads, easier to debug
-        if n_clients == 1:
-            start = time.time()
-            results, times = _run_jobs(self._client_list[0], jobs_to_run[0], geom, excited_type, self._server_root_list[0], 0, self._prev_results)
-            all_results += results
-            end = time.time()
+        return jobs, excited_type
 
+    def _run_frame_jobs(self, jobs: dict, geom, excited_type):
+        '''
+            Runs the jobs of a frame on this runner's own clients; jobs are
+            dispatched to idle clients in order of their predicted run time
+        '''
+        if 'energy' in jobs:
+            return self._run_energy_job(jobs['energy']['opts'], geom)
+
+        start = time.time()
+        ref_results, ref_times = [], {}
+        guess_results = self._prev_results
+        if self._share_scf and len(jobs) > 1:
+            #   the remaining jobs start from the converged reference at this geometry
+            ref_results, ref_times = self._run_reference_job(jobs, geom, excited_type)
+            guess_results = self._prev_results + ref_results
+            jobs = {name: job for name, job in jobs.items() if name not in ref_times}
+
+        if self._async is not None:
+            all_results, times, overhead = self._dispatch_jobs_async(jobs, geom, excited_type, guess_results)
+        else:
+            all_results, times, overhead = self._dispatch_jobs(jobs, geom, excited_type, guess_results)
+        times = {**ref_times, **times}
+        self._scheduler.record(times, time.time() - start)
+
+        if self._async is not None:
+            times['TC_Overhead'] = overhead
+        if self._share_scf:
+            times['Saved_SCF'] = _count_shared_guesses(ref_results, all_results)
+
+        return ref_results + all_results, times
+
+    def _run_energy_job(self, job_opts: dict, geom):
+        times = {}
+        start = time.time()
+        if self._async is not None:
+            client = self._async.get_client(self._host_list[0], self._port_list[0])
+            coro = self._async.compute_job(client, 'energy', 'energy', geom, 'angstrom', **job_opts)
+            results, stats = self._async.run(_wait_or_stall(coro, self._max_time))
+            times['TC_Overhead'] = stats['overhead']
+        else:
+            results = self.compute_job_sync_with_restart('energy', geom, 'angstrom', **job_opts)
+        times = {'energy': time.time() - start, **times}
+        results['run'] = 'energy'
+        results.update(job_opts)
+        return [results], times
+
+    def _run_reference_job(self, jobs: dict, geom, excited_type):
+        '''
+            Runs the first job of the frame on the first client and shares
+            its CIS restart file with the other clients
+        '''
+        name = next(iter(jobs))
+        start = time.time()
+        args = (name, jobs[name], geom, excited_type, self._server_root_list[0], 0, self._prev_results)
+        if self._async is not None:
+            client = self._async.get_client(self._host_list[0], self._port_list[0])
+            results, stats = self._async.run(_run_single_job_async(self._async, client, *args))
         else:
-            start = time.time()
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = []
-                for i in range(n_clients):
-                    jobs = jobs_to_run[i]
-                    args = (self._client_list[i], jobs, geom, excited_type, self._server_root_list[i], i, self._prev_results)
-                    future = executor.submit(_run_jobs, *args)
-                    futures.append(future)
-                for f in futures:
-                    batch_results, batch_times = f.result()
-                    all_results += batch_results
-                    times.update(batch_times)
-            end = time.time()
+            results = _run_single_job(self._client_list[0], *args)
+
+        restart_file = results.get('cisrestart', None)
+        if restart_file is not None:
+            base = restart_file[0:-len(f'_{self._host_list[0]}_{self._port_list[0]}')]
+            src = os.path.join(self._server_root_list[0], restart_file)
+            for i in range(1, len(self._client_list)):
+                dst = os.path.join(self._server_root_list[i], f'{base}_{self._host_list[i]}_{self._port_list[i]}')
+                if os.path.isfile(src) and os.path.abspath(src) != os.path.abspath(dst):
+                    shutil.copyfile(src, dst)
+
+        return [results], {name: time.time() - start}
+
+    def _dispatch_jobs(self, jobs: dict, geom, excited_type, guess_results: list):
+        if len(jobs) == 0:
+            return [], {}, 0.0
+
+        #   if only one client is being used, don't open up threads, easier to debug
+        if len(self._client_list) == 1:
+            all_results, times = _run_jobs(self._client_list[0], jobs, geom, excited_type, self._server_root_list[0], 0, guess_results)
+            return all_results, times, 0.0
+
+        #   idle clients pull the next job, longest predicted job first
+        def _run_job(client_ID, job_name, job_props, frame_results):
+            args = (self._client_list[client_ID], job_name, job_props, geom, excited_type, self._server_root_list[client_ID], client_ID, frame_results + guess_results)
+            return _run_single_job(*args)
+        all_results, times = self._scheduler.run_frame(jobs, _run_job)
 
+        return all_results, times, 0.0
+
+    def _dispatch_jobs_async(self, jobs: dict, geom, excited_type, guess_results: list):
+        '''
+            Same as `_dispatch_jobs`, but all clients are awaited on one
+            event loop. Also returns the completion detection overhead.
+        '''
+        n_clients = len(self._client_list)
+        clients = [self._async.get_client(h, p) for h, p in zip(self._host_list, self._port_list)]
+        pending = collections.deque(self._scheduler.cost_model.lpt_order(jobs))
+        async def _run_all():
+            tasks = []
+            for i in range(n_clients):
+                args = (self._async, clients[i], jobs, pending, geom, excited_type, self._server_root_list[i], i, guess_results)
+                tasks.append(_run_jobs_async(*args))
+            return await asyncio.gather(*tasks)
+
+        frame_results = {}
+        times = {}
+        overhead = 0.0
+        for batch_results, batch_times, batch_overhead in self._async.run(_run_all()):
+            frame_results.update(batch_results)
+            times.update(batch_times)
+            overhead += batch_overhead
+
+        return [frame_results[name] for name in jobs], times, overhead
+
+    def _finish_frame(self, all_results: list, times: dict):
+        '''
+            Returns
+            -------
+            the `TCFrameResult` of the jobs, and the job times in a fixed
+            order (skipped jobs as zero) followed by the frame statistics
+        '''
         self._prev_results = all_results
         self._frame_counter += 1
-        self.set_avg_max_times(times)
-
-        return all_results, times
+        if self._pool is not None:
+            #   without a pool, `_run_frame_jobs` records the times with the makespan
+            self._scheduler.cost_model.update({k: v for k, v in times.items() if k not in _FRAME_STATS})
+        if self._janitor is not None:
+            self._janitor.add_frame(self._restart_tag, all_results)
+        frame = TCFrameResult(self._grads, len(self._atoms))
+        for results in all_results:
+            frame.add_job(results)
+        job_times = {name: times.get(name, 0.0) for name in self._job_order}
+        self.set_avg_max_times({k: v for k, v in times.items() if k not in _FRAME_STATS})
+        return frame, {**job_times, **{k: v for k, v in times.items() if k in _FRAME_STATS}}
     
     # def _set_guess(self, job_opts: dict, excited_type: str, all_results: list[dict], state):
     #     return _set_guess(job_opts, excited_type, all_results, state)
@@ -610,43 +825,126 @@ def _run_jobs(client: TCPBClient, jobs, geom, excited_type, server_root, client_
     times = {}
     all_results = []
     for job_name, job_props in jobs.items():
-        job_opts =  copy.deepcopy(job_props['opts'])
-        job_type =  copy.deepcopy(job_props['type'])
-        job_state = copy.deepcopy(job_props['state'])
+        start = time.time()
+        results = _run_single_job(client, job_name, job_props, geom, excited_type, server_root, client_ID, all_results + prev_results)
+        times[job_name] = time.time() - start
+        all_results.append(results)
 
-        _set_guess(job_opts, excited_type, all_results + prev_results, job_state, client, server_root)
-        print(f"\nRunning {job_name} on client ID {client_ID}")
-        if 'cisrestart' in job_opts:
-            job_opts['cisrestart'] = f"{job_opts['cisrestart']}_{client.host}_{client.port}"
+    return all_results, times
 
-        start = time.time()
-        # results = client.compute_job_sync(job_type, geom, 'angstrom', **job_opts)
+def _run_single_job(client: TCPBClient, job_name, job_props, geom, excited_type, server_root, client_ID=0, prev_results=[], fail_fast=False, stall_time=None, cancel_event=None):
+    '''
+        Runs one job of a frame. Server errors are retried once and then
+        end the program, unless `fail_fast` is set: then server errors and
+        stalls (jobs running longer than `stall_time`) are raised for the
+        caller to handle. Setting `cancel_event` raises `TCJobCancelled`.
+    '''
+    job_type, job_opts = _prepare_job(client, job_name, job_props, excited_type, server_root, client_ID, prev_results)
 
-        max_tries = 2
-        try_count = 0
-        try_again = True
-        while try_again:
-            try:
-                results = compute_job_sync(client, job_type, geom, 'angstrom', **job_opts)
+    # results = client.compute_job_sync(job_type, geom, 'angstrom', **job_opts)
+
+    max_tries = 2
+    try_count = 0
+    try_again = True
+    while try_again:
+        try:
+            results = compute_job_sync(client, job_type, geom, 'angstrom', stall_time=stall_time, cancel_event=cancel_event, **job_opts)
+            try_again = False
+        except ServerError as e:
+            if fail_fast:
+                raise
+            try_count += 1
+            if try_count == max_tries:
                 try_again = False
-            except ServerError as e:
-                try_count += 1
-                if try_count == max_tries:
-                    try_again = False
-                    print("Server error recieved; will not try again")
-                    exit()
-                else:
-                    try_again = True
-                    print("Server error recieved; trying to run job one more")
-                    time.sleep(30)
+                print("Server error recieved; will not try again")
+                exit()
+            else:
+                try_again = True
+                print("Server error recieved; trying to run job one more")
+                time.sleep(30)
 
-        times[job_name] = time.time() - start
-        results['run'] = job_type
-        TCRunner.append_output_file(results, server_root)
-        results.update(job_opts)
-        all_results.append(results)
+    return _finish_job(results, job_type, job_opts, server_root)
 
-    return all_results, times
+def _prepare_job(client, job_name, job_props, excited_type, server_root, client_ID=0, prev_results=[]):
+    job_opts =  copy.deepcopy(job_props['opts'])
+    job_type =  copy.deepcopy(job_props['type'])
+    job_state = copy.deepcopy(job_props['state'])
+
+    _set_guess(job_opts, excited_type, prev_results, job_state, client, server_root)
+    print(f"\nRunning {job_name} on client ID {client_ID}")
+    if 'cisrestart' in job_opts:
+        job_opts['cisrestart'] = f"{job_opts['cisrestart']}_{client.host}_{client.port}"
+
+    return job_type, job_opts
+
+def _finish_job(results: dict, job_type, job_opts: dict, server_root):
+    results['run'] = job_type
+    results['server_root'] = server_root
+    TCRunner.append_output_file(results, server_root)
+    results.update(job_opts)
+
+    return results
+
+def _count_shared_guesses(ref_results: list, all_results: list):
+    '''
+        Number of jobs that used the orbitals of the reference job as guess
+    '''
+    if len(ref_results) == 0 or not ref_results[0].get('orbfile'):
+        return 0
+    orb_file = ref_results[0]['orbfile']
+    if orb_file[-6:] == 'casscf':
+        orb_file = orb_file[0:-7]
+    return sum(1 for res in all_results if str(res.get('guess', '')).endswith(orb_file))
+
+async def _wait_or_stall(coro, max_time=None):
+    if max_time is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, max_time)
+    except asyncio.TimeoutError:
+        raise TCServerStallError('TeraChem server might have stalled')
+
+async def _run_jobs_async(tc_loop: AsyncTCLoop, client, jobs, pending, geom, excited_type, server_root, client_ID=0, prev_results=[]):
+    '''
+        Awaitable version of `_run_jobs`. The client takes the names of the
+        jobs to run from the shared `pending` queue until it is empty.
+
+        Returns
+        -------
+        dictionary of job name -> results, dictionary of job times, total
+        completion detection overhead of the jobs
+    '''
+    times = {}
+    overhead = 0.0
+    all_results = {}
+    while pending:
+        job_name = pending.popleft()
+        results, stats = await _run_single_job_async(tc_loop, client, job_name, jobs[job_name], geom, excited_type, server_root, client_ID, list(all_results.values()) + prev_results)
+        times[job_name] = stats['run_time']
+        overhead += stats['overhead']
+        all_results[job_name] = results
+
+    return all_results, times, overhead
+
+async def _run_single_job_async(tc_loop: AsyncTCLoop, client, job_name, job_props, geom, excited_type, server_root, client_ID=0, prev_results=[]):
+    job_type, job_opts = _prepare_job(client, job_name, job_props, excited_type, server_root, client_ID, prev_results)
+
+    max_tries = 2
+    try_count = 0
+    while True:
+        try:
+            results, stats = await tc_loop.compute_job(client, job_name, job_type, geom, 'angstrom', **job_opts)
+            break
+        except ServerError as e:
+            client.close()
+            try_count += 1
+            if try_count == max_tries:
+                print("Server error recieved; will not try again")
+                raise
+            print("Server error recieved; trying to run job one more")
+            await asyncio.sleep(30)
+
+    return _finish_job(results, job_type, job_opts, server_root), stats
 
 def _set_guess(job_opts: dict, excited_type: str, prev_results: list[dict], state: int, client: TCPBClient, server_root='.'):
 
@@ -684,89 +982,25 @@ def _set_guess(job_opts: dict, excited_type: str, prev_results: list[dict], stat
     if os.path.isfile(str(scf_guess)):
         job_opts['guess'] = scf_guess
 
-def format_output_LSCIVR(job_data: list[dict]):
-    atoms = job_data[0]['atoms']
-    n_atoms = len(atoms)
-    
-    # energies = np.zeros(n_elec)
-    # grads = np.zeros((n_elec, n_atoms*3))
-    # nacs = np.zeros((n_elec, n_elec, n_atoms*3))
-    energies = {}
-    grads = {}
-    nacs = {}
-    trans_dips = {}
-    for job in job_data:
-        if job['run'] == 'gradient':
-            state = job.get('cistarget', job.get('castarget', 0))
-            grads[state] = np.array(job['gradient']).flatten()
-            if isinstance(job['energy'], float):
-                energies[state] = job['energy']
-            else:
-                energies[state] = job['energy'][state]
-        elif job['run'] == 'coupling':
-            state_1 = job['nacstate1']
-            state_2 = job['nacstate2']
-            nacs[(state_1, state_2)] = np.array(job['nacme']).flatten()
-            nacs[(state_2, state_1)] = - nacs[state_1, state_2]
-
-            if 'cis_transition_dipoles' in job:
-                x = len(job['cis_transition_dipoles'])
-                N = int((1 + int(np.sqrt(1+8*x)))/2) - 1
-                count = 0
-                for i in range(0, N):
-                    for j in range(i+1, N+1):
-                        if (i, j) == (state_1, state_2):
-                            trans_dips[(state_1, state_2)] = job['cis_transition_dipoles'][count]
-                            trans_dips[(state_2, state_1)] = job['cis_transition_dipoles'][count]
-                        count += 1
-
-
-    #   make sure there are the correct number of gradients and NACs
-    n_states = len(grads)
-    if n_states*(n_states-1) != len(nacs):
-        raise RuntimeError('LSC-IVR requires a NAC vector for each gradient pair')
-    
-    #   make sure each grad pair has a NAC vector
-    for grad_i in grads:
-        for grad_j in grads:
-            if grad_i == grad_j:
-                continue
-            if (grad_i, grad_j) not in nacs:
-                raise RuntimeError('LSC-IVR requires a NAC vector for each gradient pair')
-
-    #   print mapping
-    ivr_energies = np.zeros(n_states)
-    ivr_grads = np.zeros((n_states, n_atoms*3))
-    ivr_nacs  = np.zeros((n_states, n_states, n_atoms*3))
-    ivr_trans_dips = np.zeros((n_states, n_states, 3))
+def format_output_LSCIVR(job_data: list[dict], allow_missing=False):
+    '''
+        Energies, gradients, NACs and transition dipoles in LSC-IVR state
+        order. With `allow_missing`, NAC pairs without a job are returned
+        as zeros instead of raising an error. `job_data` is either a
+        `TCFrameResult`, whose arrays are returned as they are (not
+        copies, see `TCFrameResult.lsc_ivr`), or a list of job results.
+    '''
+    if not isinstance(job_data, TCFrameResult):
+        job_data = TCFrameResult.from_jobs(job_data)
+    energies, grads, nacs, trans_dips = job_data.lsc_ivr(allow_missing)
+
     print(" --------------------------------")
     print(" LSC-IVR to TeraChem")
     print(" state number mapping")
     print(" ---------------------------------")
     print(" LSC-IVR -->   QC  ")
-    grads_in_order = sorted(list(grads.keys()))
-    for i in range(n_states):
-        qc_i = grads_in_order[i]
+    for i, qc_i in enumerate(job_data.states):
         print(f"   {i:2d}    -->  {qc_i:2d}")
-        ivr_grads[i] = grads[qc_i]
-        ivr_energies[i] = energies[qc_i]
-        for j in range(n_states):
-            if i <= j:
-                continue
-            qc_idx_j = grads_in_order[j]
-            ivr_nacs[i, j] = nacs[(qc_i, qc_idx_j)]
-            ivr_nacs[j, i] = nacs[(qc_idx_j, qc_i)]
-
-            # ivr_trans_dips[i, j] = trans_dips[(qc_i, qc_idx_j)]
-            # ivr_trans_dips[j, i] = trans_dips[(qc_idx_j, qc_i)]
-
-            td = trans_dips.get((qc_i, qc_idx_j), None)
-            if td is not None:
-                ivr_trans_dips[i, j] = td
-                ivr_trans_dips[j, i] = td
-            else:
-                ivr_trans_dips = None
     print(" ---------------------------------")
 
-    return ivr_energies, ivr_grads, ivr_nacs, ivr_trans_dips
-    # return energies, grads, nacs
+    return energies, grads, nacs, trans_dips
@@ -0,0 +1,135 @@
+"""
+Cache of electronic structure results keyed by geometry.
+
+Geometries are quantized with a tolerance before hashing, so that a
+geometry that is recomputed (the end point of an accepted Bulirsch-Stoer
+step, the t=0 geometry of the ABM start-up, the last geometry of a
+restart) is found again. The QC options are part of the key. Entries are
+appended to a pickle file as they are computed and replayed when the
+cache is opened again; in memory, the least recently used entries are
+evicted once `max_entries` is exceeded.
+"""
+import os
+import copy
+import json
+import pickle
+import hashlib
+import collections
+import numpy as np
+
+
+def _copy_values(values: dict):
+    '''
+        Copy of a dictionary of results. Callers modify their results in
+        place (the NAC sign correction), so the cache never shares arrays
+        with them.
+    '''
+    return {k: np.array(v, copy=True) if isinstance(v, np.ndarray) else copy.deepcopy(v) for k, v in values.items()}
+
+
+class QCResultCache():
+    def __init__(self, file_loc: str='qc_cache.pkl', tol: float=1e-6, max_entries: int=256) -> None:
+        '''
+            Parameters
+            ----------
+            file_loc: str
+                append-only store; None keeps the cache in memory only
+            tol: float
+                quantization of the Cartesian coordinates in bohr
+            max_entries: int
+                number of entries kept (least recently used are evicted)
+        '''
+        self.file_loc = None if file_loc is None else os.path.abspath(file_loc)
+        self.tol = tol
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._n_records = 0
+
+        if self.file_loc is not None and os.path.isfile(self.file_loc):
+            self._load()
+
+    def _load(self):
+        with open(self.file_loc, 'rb') as file:
+            while True:
+                try:
+                    key, values = pickle.load(file)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError):
+                    #   partially written last record
+                    break
+                self._n_records += 1
+                self._entries[key] = values
+                self._entries.move_to_end(key)
+        self._evict()
+        print(f'QC cache: {len(self._entries)} entries loaded from {self.file_loc}')
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _compact(self):
+        #   the store is append-only; rewrite it once it holds mostly evicted records
+        tmp_loc = self.file_loc + '.tmp'
+        with open(tmp_loc, 'wb') as file:
+            for key, values in self._entries.items():
+                pickle.dump((key, values), file)
+        os.replace(tmp_loc, self.file_loc)
+        self._n_records = len(self._entries)
+
+    def key(self, geom: np.ndarray, options: dict):
+        '''
+            Hash of the quantized geometry and the QC options
+        '''
+        quantized = np.rint(np.asarray(geom, dtype=float) / self.tol).astype(np.int64)
+        h = hashlib.sha1(quantized.tobytes())
+        h.update(json.dumps(options, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def get(self, geom: np.ndarray, options: dict):
+        '''
+            Returns
+            -------
+            a copy of the stored dictionary of results, or None
+        '''
+        key = self.key(geom, options)
+        values = self._entries.get(key)
+        if values is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return _copy_values(values)
+
+    def put(self, geom: np.ndarray, options: dict, values: dict):
+        '''
+            Stores a dictionary of results (energies, gradients, NACs,
+            transition dipoles, ...) for a geometry. The arrays are copied.
+        '''
+        key = self.key(geom, options)
+        values = _copy_values(values)
+        self._entries[key] = values
+        self._entries.move_to_end(key)
+        self._evict()
+        if self.file_loc is None:
+            return
+        with open(self.file_loc, 'ab') as file:
+            pickle.dump((key, values), file)
+        self._n_records += 1
+        if self._n_records > 2*self.max_entries:
+            self._compact()
+
+    def get_stats(self):
+        return {'QC_Cache_Hits': self.hits, 'QC_Cache_Misses': self.misses}
+
+    def print_summary(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return
+        print("QC Result Cache")
+        print(f'    Hits:      {self.hits:8d}  ({100*self.hits/total:5.1f} %)')
+        print(f'    Misses:    {self.misses:8d}')
+        print(f'    Entries:   {len(self._entries):8d}')
+        print()
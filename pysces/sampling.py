@@ -0,0 +1,283 @@
+"""
+Batched sampling of LSC-IVR initial conditions.
+
+Trajectory k always draws from its own random stream, spawned from the
+base seed as `SeedSequence(seed, spawn_key=(k,))`, so its initial
+condition does not depend on how many trajectories are sampled together
+or on which worker samples it. Banks of initial conditions are stored as
+compact .npz files that ensemble runs read by trajectory index.
+
+Instead of pseudo-random draws, the electronic angles and nuclear normal
+deviates can be taken from scrambled Sobol or Halton sequences mapped
+through the inverse CDFs (randomized quasi-Monte Carlo). Trajectory k is
+then point k % R of the independently scrambled replicate k // R, and the
+spread between replicate means gives the error estimate.
+
+    pysces sample -n 1000 -s 1234 -o init_bank.npz
+    pysces sample -n 1024 -s 1234 --qmc sobol --replicate-size 64 -o init_bank.npz
+"""
+import argparse
+import warnings
+import functools
+import numpy as np
+
+
+@functools.lru_cache(maxsize=None)
+def wigner_radius(n_states: int):
+    '''
+        Sampling radius of the initially occupied state for the Wigner
+        population estimator
+    '''
+    from scipy.optimize import fsolve
+    def eqn(r):
+        return 2 ** (n_states + 1) * (r - 0.5) * np.exp(-(r + 0.5 * (n_states - 1))) - 1
+    return fsolve(eqn, 2)[0] ** 0.5
+
+
+def electronic_radii(method: str, n_states: int):
+    '''
+        Returns
+        -------
+        radius of the initially occupied state, radius of the other states
+    '''
+    if method == 'wigner':
+        return wigner_radius(n_states), np.sqrt(1.0/2.0)
+    elif method == 'sc':
+        return np.sqrt(3.0), 1.0
+    elif method == 'spin':
+        return np.sqrt(8.0/3.0), np.sqrt(2.0/3.0)
+    raise ValueError(f'Unknown sampling method "{method}"')
+
+
+def trajectory_rng(seed: int, index: int):
+    '''
+        Random number generator of trajectory `index`; identical to the
+        index-th child of `SeedSequence(seed).spawn()`
+    '''
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(index),)))
+
+
+def qmc_uniforms(indices, dim: int, seed: int, qmc: str='sobol', replicate_size: int=64):
+    '''
+        Points of randomized low-discrepancy sequences in [0, 1)^dim
+
+        Parameters
+        ----------
+        indices: (M,) array of trajectory indices; trajectory k is point
+            k % replicate_size of replicate k // replicate_size
+        dim: int
+            dimension of each point
+        seed: int
+            base seed; the scrambling of replicate r is seeded with
+            `SeedSequence(seed, spawn_key=(r, 1))`
+        qmc: str
+            'sobol' or 'halton'
+        replicate_size: int
+            number of points per replicate, a power of 2 for Sobol
+
+        Returns
+        -------
+        (M, dim) array
+    '''
+    from scipy.stats import qmc as scipy_qmc
+    indices = np.asarray(indices, dtype=int)
+    replicates = indices // replicate_size
+    positions = indices % replicate_size
+    u = np.empty((len(indices), dim))
+    for r in np.unique(replicates):
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int(r), 1)))
+        if qmc == 'sobol':
+            engine = scipy_qmc.Sobol(d=dim, scramble=True, seed=rng)
+        elif qmc == 'halton':
+            engine = scipy_qmc.Halton(d=dim, scramble=True, seed=rng)
+        else:
+            raise ValueError(f'Unknown quasi-Monte Carlo sequence "{qmc}"')
+        sel = replicates == r
+        with warnings.catch_warnings():
+            #   Sobol balance warnings for partial replicates
+            warnings.simplefilter('ignore')
+            points = engine.random(positions[sel].max() + 1)
+        u[sel] = points[positions[sel]]
+    return u
+
+
+def rqmc_estimate(values, indices, replicate_size: int):
+    '''
+        Randomized QMC estimate of the mean of `values` over trajectories
+
+        Parameters
+        ----------
+        values: (M, ...) array, one entry per trajectory
+        indices: (M,) trajectory indices
+        replicate_size: number of points per replicate
+
+        Returns
+        -------
+        mean, standard error (from the spread of the replicate means), number of replicates
+    '''
+    values = np.asarray(values, dtype=float)
+    replicates = np.asarray(indices, dtype=int) // replicate_size
+    rep_means = np.array([np.mean(values[replicates == r], axis=0) for r in np.unique(replicates)])
+    n_rep = len(rep_means)
+    std_err = np.zeros_like(rep_means[0])
+    if n_rep > 1:
+        std_err = np.std(rep_means, axis=0, ddof=1) / np.sqrt(n_rep)
+    return np.mean(rep_means, axis=0), std_err, n_rep
+
+
+def sample_batch(indices, qN0, frq, n_states: int, init_state: int, beta: float, method: str='wigner', pN0: float=0.0, seed: int=0, qmc: str=None, replicate_size: int=64):
+    '''
+        Samples the initial conditions of the trajectories `indices`
+
+        Parameters
+        ----------
+        indices: int or list of int
+            trajectory indices; a single int N samples trajectories 0..N-1
+        qN0: (n_modes,) array
+            centers of the normal mode coordinates (a.u.)
+        frq: (n_modes + 6,) array
+            normal mode frequencies (a.u.), including the six zero modes
+        n_states: int
+            number of electronic states
+        init_state: int
+            initially occupied state (starting from 1)
+        beta: float
+            inverse temperature (a.u.)
+        method: str
+            population estimator, 'wigner', 'sc' or 'spin'
+        pN0: float
+            center of the nuclear momenta
+        seed: int
+            base seed
+        qmc: str
+            None for pseudo-random draws, or 'sobol' / 'halton'
+        replicate_size: int
+            number of points per QMC replicate
+
+        Returns
+        -------
+        (M, 2, n_states + n_modes) array with the electronic mapping
+        variables followed by the normal mode coordinates (row 0) and
+        momenta (row 1)
+    '''
+    if np.isscalar(indices):
+        indices = np.arange(indices)
+    indices = np.asarray(indices, dtype=int)
+    qN0 = np.asarray(qN0, dtype=float)
+    n_modes = len(qN0)
+    w = np.asarray(frq[6:6+n_modes], dtype=float)
+
+    M = len(indices)
+    if qmc is None:
+        #   draw from each trajectory's own stream
+        theta = np.empty((M, n_states))
+        z = np.empty((M, 2, n_modes))
+        for m, k in enumerate(indices):
+            rng = trajectory_rng(seed, k)
+            theta[m] = rng.random(n_states)
+            z[m] = rng.standard_normal((2, n_modes))
+    else:
+        #   map low-discrepancy points through the inverse CDFs
+        from scipy.stats import norm
+        u = qmc_uniforms(indices, n_states + 2*n_modes, seed, qmc, replicate_size)
+        theta = u[:, :n_states]
+        eps = np.finfo(float).eps
+        z = norm.ppf(np.clip(u[:, n_states:], eps, 1 - eps)).reshape(M, 2, n_modes)
+
+    coords = np.empty((M, 2, n_states + n_modes))
+
+    # Electronic phase space variables
+    r_occ, r_other = electronic_radii(method, n_states)
+    r = np.full(n_states, r_other)
+    r[init_state-1] = r_occ
+    coords[:, 0, :n_states] = r * np.cos(2.0*np.pi*theta)
+    coords[:, 1, :n_states] = r * np.sin(2.0*np.pi*theta)
+
+    # Nuclear phase space variables in harmonic approximation
+    real = w > 0
+    wr = np.where(real, w, 1.0)
+    coth = 1.0/np.tanh(beta*wr/2.0)
+    sigma_q = np.where(real, np.sqrt(coth/(2.0*wr)), 0.0)
+    sigma_p = np.where(real, np.sqrt(wr*coth/2.0), 0.0)
+    coords[:, 0, n_states:] = qN0 + sigma_q*z[:, 0]
+    coords[:, 1, n_states:] = pN0 + sigma_p*z[:, 1]
+
+    return coords
+
+
+def write_bank(file_loc: str, coords: np.ndarray, indices, seed: int, method: str, n_states: int, init_state: int, temp: float, qmc: str=None, replicate_size: int=0):
+    '''
+        Writes sampled initial conditions to a compressed .npz bank
+    '''
+    np.savez_compressed(file_loc, coords=coords, indices=np.asarray(indices, dtype=int), seed=str(seed),
+                        method=method, n_states=n_states, init_state=init_state, temp=temp,
+                        qmc=str(qmc or ''), replicate_size=replicate_size if qmc else 0)
+
+
+class InitialConditionBank():
+    def __init__(self, file_loc: str) -> None:
+        '''
+            Read access to a bank written by `write_bank`
+        '''
+        data = np.load(file_loc)
+        self.coords = data['coords']
+        self.indices = data['indices']
+        self.seed = int(str(data['seed']))
+        self.method = str(data['method'])
+        self.n_states = int(data['n_states'])
+        self.init_state = int(data['init_state'])
+        self.temp = float(data['temp'])
+        #   banks written before QMC sampling was added are pseudo-random
+        self.qmc = str(data['qmc']) if 'qmc' in data else ''
+        self.replicate_size = int(data['replicate_size']) if 'replicate_size' in data else 0
+        self._row = {int(k): i for i, k in enumerate(self.indices)}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __contains__(self, index):
+        return int(index) in self._row
+
+    def __getitem__(self, index):
+        '''
+            (2, n_states + n_modes) initial condition of trajectory `index`
+        '''
+        if int(index) not in self._row:
+            raise IndexError(f'Trajectory {index} is not in the initial condition bank')
+        return self.coords[self._row[int(index)]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pysces sample', description='Sample a bank of initial conditions with the settings in the current directory')
+    parser.add_argument('-n', '--ntraj', type=int, required=True, help='number of trajectories')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='base random seed (default: input_seed, otherwise random)')
+    parser.add_argument('-o', '--output', default='init_bank.npz', help='bank file')
+    parser.add_argument('--first-index', type=int, default=0, help='index of the first trajectory')
+    parser.add_argument('--qmc', choices=['sobol', 'halton'], default=None, help='randomized quasi-Monte Carlo sequence (default: sampling_qmc)')
+    parser.add_argument('--replicate-size', type=int, default=None, help='points per QMC replicate (default: qmc_replicate_size)')
+    args = parser.parse_args(argv)
+
+    #   the molecule and the sampling options come from the simulation settings
+    import input_simulation as opts
+    from subroutines import get_geo_hess, get_normal_geo, sample_initial_conditions
+
+    seed = args.seed
+    if seed is None:
+        seed = getattr(opts, 'input_seed', None)
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    amu_mat, xyz_ang, frq, redmas, L, U, com_ang, AN_mat = get_geo_hess()
+    normal_geo = get_normal_geo(U, xyz_ang, amu_mat)
+    qmc = args.qmc or opts.sampling_qmc
+    replicate_size = args.replicate_size or opts.qmc_replicate_size
+    indices = np.arange(args.first_index, args.first_index + args.ntraj)
+    coords = sample_initial_conditions(normal_geo, frq, indices, seed, qmc, replicate_size)
+    write_bank(args.output, coords, indices, seed, opts.sampling, opts.nel, opts.init_state, opts.temp, qmc, replicate_size)
+    print(f'{args.ntraj} initial conditions ({opts.sampling}) written to {args.output} with base seed {seed}')
+    if qmc:
+        print(f'Randomized {qmc} sequence with {replicate_size} trajectories per replicate')
+
+
+if __name__ == '__main__':
+    main()
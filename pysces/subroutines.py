@@ -22,6 +22,7 @@ import time
 from input_simulation import * 
 from input_gamess import nacme_option as opt 
 from fileIO import SimulationLogger, write_restart, read_restart
+from integrators import ExplicitRK, MultipleTimeStep, get_integrator
 # __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 __location__ = ''
 
@@ -399,6 +400,38 @@ def sample_spinLSC(qN0, frq):
     return(coord)
 
 
+'''Sampling function selected by the `sampling` setting'''
+def get_sampler():
+    if sampling == 'wigner':
+        return sample_wignerLSC
+    elif sampling == 'sc':
+        return sample_scLSC
+    elif sampling == 'spin':
+        return sample_spinLSC
+    raise ValueError(f'Unknown sampling method "{sampling}"')
+
+'''Batched sampling with one random stream per trajectory index'''
+def sample_initial_conditions(qN0, frq, indices, seed, qmc=sampling_qmc, replicate_size=qmc_replicate_size):
+    from sampling import sample_batch
+    return sample_batch(indices, qN0, frq, nel, init_state, beta, sampling, pN0, seed, qmc, replicate_size)
+
+'''The bank `init_cond_bank`, checked against the sampling method and number of states'''
+def get_init_cond_bank():
+    from sampling import InitialConditionBank
+    bank = InitialConditionBank(os.path.join(__location__, init_cond_bank))
+    if bank.method != sampling or bank.n_states != nel:
+        raise ValueError(f'Initial condition bank was sampled with "{bank.method}" and {bank.n_states} states')
+    return bank
+
+'''Initial condition of this trajectory, from the bank `init_cond_bank` or sampled'''
+def get_initial_condition(qN0, frq):
+    if init_cond_bank is not None:
+        return get_init_cond_bank()[traj_index]
+    if sampling_qmc is not None:
+        raise ValueError('QMC sampling of a single trajectory needs an initial condition bank from `pysces sample`')
+    return get_sampler()(qN0, frq)
+
+
 ####################################
 ### Get atomic symbols as a list ###
 ####################################
@@ -674,46 +707,354 @@ def read_gms_dat(input_name):
     return(flag_orb)
 
 
+###########################################################
+### Electronic structure calls through the QC cache     ###
+###########################################################
+_qc_cache = None
+
+def get_qc_cache():
+    '''The QC result cache, or None if `qc_cache` is off'''
+    global _qc_cache
+    if qc_cache and _qc_cache is None:
+        from qc_cache import QCResultCache
+        _qc_cache = QCResultCache(qc_cache_file, tol=qc_cache_tol, max_entries=qc_cache_size)
+    return _qc_cache
+
+_pes_interpolator = None
+
+def get_pes_interpolator():
+    '''The interpolation of QC results between stored geometries, or None if `pes_interp` is off'''
+    global _pes_interpolator
+    if pes_interp and _pes_interpolator is None:
+        from pes_interpolation import PESInterpolator
+        _pes_interpolator = PESInterpolator(pes_interp_radius, pes_interp_tol, pes_interp_max_skip, pes_interp_min_points, pes_interp_file)
+    return _pes_interpolator
+
+def run_gms_cached(input_name, opt, atoms, AN_mat, qCart, submit_script_loc=None):
+    '''
+        `run_gms_cas` followed by `read_gms_out` and `read_gms_dat`;
+        geometries that were already computed with the same options are
+        taken from the cache. On a hit, cas.dat is not read, as it belongs
+        to the last computed geometry: vec_gamess keeps the orbitals of that
+        geometry as the guess and the cached orbital flag is returned.
+
+        Returns
+        -------
+        elecE, grad, nac, flag_grad, flag_nac, flag_orb
+    '''
+    cache = get_qc_cache()
+    if cache is not None:
+        #   the guess setting does not change the converged result
+        key_opts = {k: v for k, v in opt.items() if k != 'guess'}
+        key_opts['QC_RUNNER'] = 'gamess'
+        key_opts['elab'] = elab
+        values = cache.get(qCart, key_opts)
+        if values is not None:
+            return values['elecE'], values['grad'], values['nac'], np.zeros(nel), 0, values.get('flag_orb', 0)
+
+    run_gms_cas(input_name, opt, atoms, AN_mat, qCart, submit_script_loc)
+    elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
+    flag_orb = read_gms_dat(input_name)
+
+    if cache is not None and not any([el == 1 for el in flag_grad]) and flag_nac == 0 and flag_orb == 0:
+        cache.put(qCart, key_opts, {'elecE': elecE, 'grad': grad, 'nac': nac, 'trans_dips': None, 'flag_orb': flag_orb})
+    return elecE, grad, nac, flag_grad, flag_nac, flag_orb
+
+def get_tc_output_capture():
+    '''How the tc.out of the TeraChem jobs is kept (`tcr_output_capture`)'''
+    from qcRunners.TCOutput import TCOutputCapture
+    return TCOutputCapture(tcr_output_capture, tcr_output_tail, tcr_output_archive)
+
+def get_tc_janitor():
+    '''Background cleanup of old TeraChem directories, or None if `tcr_cleanup` is off'''
+    if tcr_cleanup is None:
+        return None
+    from qcRunners.TCJanitor import TCJanitor
+    return TCJanitor(tcr_cleanup)
+
+_tc_server_farm = None
+
+def get_tc_server_farm():
+    '''The local TeraChem servers, started on first use, or None if `tcr_start_servers` is 0'''
+    global _tc_server_farm
+    if tcr_start_servers and _tc_server_farm is None:
+        from qcRunners.TCServerFarm import TCServerFarm
+        _tc_server_farm = TCServerFarm(tcr_start_servers, devices=tcr_server_devices, executable=tcr_server_exe).start()
+    return _tc_server_farm
+
+_model_runner = None
+
+def get_model_runner():
+    '''The analytic model Hamiltonian of QC_RUNNER = 'model', in the normal modes of the molecule'''
+    global _model_runner
+    if _model_runner is None:
+        from model_hamiltonians import ModelRunner, build_model, load_model
+        amu_mat, xyz_ang, frq, redmas, L, U, com_ang, AN_mat = get_geo_hess()
+        dipoles = model_dipoles
+        if model_file is not None:
+            model, file_dipoles = load_model(model_file)
+            if dipoles is None:
+                dipoles = file_dipoles
+        else:
+            model = build_model(model_type, frq[6:], **model_params)
+        if model.n_states != nel:
+            raise ValueError(f'Model Hamiltonian "{model_file or model_type}" has {model.n_states} states, but nel = {nel}')
+        Q0 = get_normal_geo(U, xyz_ang, amu_mat)
+        _model_runner = ModelRunner(model, U[6:], np.diag(amu_mat)*amu2au, Q0, dipoles)
+    return _model_runner
+
+def run_model(qCart):
+    '''
+        Energies, gradients, NACs and transition dipoles of the model
+        Hamiltonian at qCart (bohr), and the timings of the evaluation
+    '''
+    start = time.time()
+    elecE, grad, nac, trans_dips = get_model_runner().compute(qCart)
+    return elecE, grad, nac, trans_dips, {'model': time.time() - start}
+
+def run_gms_or_model(input_name, opt, atoms, AN_mat, qCart, update_geo=True, submit_script_loc=None):
+    '''
+        Electronic structure step of the GAMESS integrators (ME_ABM, BulStoer):
+        update of geo_gamess and `run_gms_cached`, or the
+        model Hamiltonian if QC_RUNNER is 'model'
+
+        Returns
+        -------
+        elecE, grad, nac, flag_grad, flag_nac, flag_orb
+    '''
+    if QC_RUNNER == 'model':
+        elecE, grad, nac, trans_dips, timings = run_model(qCart)
+        return elecE, grad, nac, np.zeros(nel), 0, 0
+
+    if update_geo:
+        update_geo_gamess(atoms, AN_mat, qCart)
+    return run_gms_cached(input_name, opt, atoms, AN_mat, qCart, submit_script_loc)
+
+def run_TC_cached(tc_runner, qCart, allow_missing=False):
+    '''
+        `TCRunner.run_TC_new_geom` followed by `format_output_LSCIVR`, with
+        the QC cache in front. Cache hits return no job data and zero timings.
+        With `allow_missing`, skipped NAC pairs are returned as zeros and the
+        frame is not cached. The returned arrays are copies that the caller
+        owns, as the NAC sign correction and pruning modify them in place.
+
+        Returns
+        -------
+        elecE, grad, nac, trans_dips, job_results, qc_timings
+    '''
+    from qcRunners.TeraChem import format_output_LSCIVR
+    cache = get_qc_cache()
+    if cache is not None:
+        key_opts = {'QC_RUNNER': 'terachem', 'job': tcr_job_options, 'states': tcr_state_options, 'spec': tcr_spec_job_opts}
+        values = cache.get(qCart, key_opts)
+        if values is not None:
+            #   keep the same timing columns as a computed frame
+            qc_timings = {k: 0.0 for k in values['times']}
+            return values['elecE'], values['grad'], values['nac'], values['trans_dips'], None, qc_timings
+
+    job_results, qc_timings = tc_runner.run_TC_new_geom(qCart/ang2bohr)
+    elecE, grad, nac, trans_dips = format_output_LSCIVR(job_results, allow_missing)
+    #   the arrays of the frame stay with `job_results`
+    elecE, grad, nac = np.copy(elecE), np.copy(grad), np.copy(nac)
+    if trans_dips is not None:
+        trans_dips = np.copy(trans_dips)
+
+    if cache is not None and not allow_missing:
+        cache.put(qCart, key_opts, {'elecE': elecE, 'grad': grad, 'nac': nac, 'trans_dips': trans_dips, 'times': list(qc_timings.keys())})
+    return elecE, grad, nac, trans_dips, job_results, qc_timings
+
+
 #####################################################################
 ### Compute equations of motion (mapping variables derivatives)   ###
 ### of adiabatic MM-ST Hamiltonian with the symmetrized potential ###
 #####################################################################
-def get_derivatives(au_mas, q, p, nac, grad, elecE):
-    der = np.zeros((2, ndof))
-    
+class _EOMWorkspace():
+    def __init__(self, batch: tuple, n_nuc: int) -> None:
+        '''
+            Constant state-pair operators and temporaries of `get_derivatives`
+            and `get_energy` for one shape of the leading ensemble axes,
+            allocated once. Products are taken with einsum into these
+            buffers, as broadcasting ufuncs allocate iteration buffers.
+        '''
+        eye = np.eye(nel)
+        self.triu = np.triu(np.ones((nel, nel)), 1)
+        self.off_diag = 1.0 - eye
+        #   x @ de_op = nel*x_i - sum_k x_k
+        self.de_op = nel*eye - 1.0
+        #   E @ gap_op = (Ej - Ei) for i < j, 0 otherwise
+        self.gap_op = (eye[:, None, :] - eye[:, :, None])*self.triu
+        self.inv_mas = np.empty(n_nuc)
+        self.vel = np.empty(batch + (n_nuc,))
+        self.nuc = np.empty(batch + (n_nuc,))
+        self.force = np.empty(batch + (n_nuc,))
+        self.el = np.empty(batch + (nel,))
+        self.dq = np.empty(batch + (nel,))
+        self.dp = np.empty(batch + (nel,))
+        self.pop = np.empty(batch + (nel,))
+        self.sum_DE = np.empty(batch + (nel,))
+        self.dpm = np.empty(batch + (nel, nel))
+        self.pair = np.empty(batch + (nel, nel))
+        self.pair_tmp = np.empty(batch + (nel, nel))
+
+
+_eom_workspaces = {}
+
+def _get_eom_workspace(batch: tuple, n_nuc: int):
+    key = (tuple(batch), n_nuc)
+    if key not in _eom_workspaces:
+        _eom_workspaces[key] = _EOMWorkspace(tuple(batch), n_nuc)
+    return _eom_workspaces[key]
+
+
+def get_derivatives(au_mas, q, p, nac, grad, elecE, out=None):
+    '''
+        Vectorized equations of motion. All pair sums over the electronic
+        states are done as contractions over the (nel, nel, nnuc) NAC tensor.
+        If `out` (shape (2, ndof)) is supplied, the derivatives are written
+        into it; all temporaries live in a workspace that is allocated once
+        per input shape, so that the call does not allocate new arrays.
+
+        All inputs except `au_mas` may carry a leading ensemble axis, e.g.
+        q of shape (M, ndof) and nac of shape (M, nel, nel, nnuc), in which
+        case the derivatives of all M trajectories are returned as (M, 2, ndof).
+    '''
+    batch = q.shape[:-1]
+    if out is None:
+        out = np.empty(batch + (2, q.shape[-1]))
+    w = _get_eom_workspace(batch, q.shape[-1] - nel)
+    qe, pe = q[..., :nel], p[..., :nel]
+    np.divide(1.0, au_mas, out=w.inv_mas)
+    vel = np.einsum('...n,n->...n', p[..., nel:], w.inv_mas, out=w.vel)
+
+    # d_ji . P/M for every state pair, without the diagonal (j == i) terms
+    dpm = np.einsum('...jin,...n,ji->...ji', nac, vel, w.off_diag, out=w.dpm)
+    # sum_j (Ei - Ej)
+    sum_DE = np.einsum('...k,ki->...i', elecE, w.de_op, out=w.sum_DE)
+
     # Derivatives of elctronic mapping variables
-    for i in range(nel):
-        xdpm   = 0 # x*d*p/m
-        pdpm   = 0 # p*d*p/m
-        sum_DE = 0 # sum(Ei - Ej)
-        for j in range(nel):
-            if j != i:
-                xdpm   += q[j] * np.matmul(nac[j,i,:], p[nel:]/au_mas)
-                pdpm   += p[j] * np.matmul(nac[j,i,:], p[nel:]/au_mas)
-                sum_DE += elecE[i] - elecE[j]
-        # postions
-        der[0, i] =  (1.0/nel) * p[i] * sum_DE + xdpm
-        # momenta
-        der[1, i] = -(1.0/nel) * q[i] * sum_DE + pdpm
-    
+    # (computed in contiguous buffers: in-place operations on strided views of `out` allocate)
+    # postions
+    np.einsum('...j,...ji->...i', qe, dpm, out=w.dq)
+    np.einsum('...i,...i->...i', pe, sum_DE, out=w.el)
+    w.el *= 1.0/nel
+    w.dq += w.el
+    # momenta
+    np.einsum('...j,...ji->...i', pe, dpm, out=w.dp)
+    np.einsum('...i,...i->...i', qe, sum_DE, out=w.el)
+    w.el *= 1.0/nel
+    w.dp -= w.el
+    out[..., 0, :nel] = w.dq
+    out[..., 1, :nel] = w.dp
+
     # Derivatives of nuclear mapping variables
-    for n in range(nnuc):
-        # positions
-        der[0, nel+n] = p[nel+n]/au_mas[n]
-        # momenta
-        sum_dEdR   = 0
-        p2x2_DdEdR = 0 # (pi^2 - pj^2 + qi^2 - qj^2) * (dEi/dR - dEj/dR)
-        ppxx_DEnac = 0 # (pi * pj + qi * qj) * (Ej - Ei) * dij
-        for i in range(nel):
-            sum_dEdR  += grad[i,n]
-            j = i + 1
-            while j < nel:
-                p2x2_DdEdR += (p[i]**2 - p[j]**2 + q[i]**2 - q[j]**2) * (grad[i,n] - grad[j,n])
-                ppxx_DEnac += (p[i]*p[j] + q[i]*q[j]) * (elecE[j] - elecE[i]) * nac[i,j,n]
-                j += 1
-        der[1, nel+n] = -(1.0/nel) * sum_dEdR - (0.5/nel) * p2x2_DdEdR - ppxx_DEnac
-            
-    return(der)
+    # positions
+    out[..., 0, nel:] = vel
+    # momenta
+    force = np.sum(grad, axis=-2, out=w.force)
+    force *= -(1.0/nel)
+    # sum_{i<j} (pi^2 - pj^2 + qi^2 - qj^2) * (dEi/dR - dEj/dR)
+    np.einsum('...i,...i->...i', pe, pe, out=w.el)
+    np.einsum('...i,...i->...i', qe, qe, out=w.pop)
+    w.el += w.pop
+    pop = np.einsum('...k,ki->...i', w.el, w.de_op, out=w.pop)
+    np.einsum('...i,...in->...n', pop, grad, out=w.nuc)
+    w.nuc *= 0.5/nel
+    force -= w.nuc
+    # sum_{i<j} (pi * pj + qi * qj) * (Ej - Ei) * dij
+    pair = np.einsum('...i,...j->...ij', pe, pe, out=w.pair)
+    np.einsum('...i,...j->...ij', qe, qe, out=w.pair_tmp)
+    pair += w.pair_tmp
+    np.einsum('...k,kij->...ij', elecE, w.gap_op, out=w.pair_tmp)
+    pair *= w.pair_tmp
+    np.einsum('...ij,...ijn->...n', pair, nac, out=w.nuc)
+    force -= w.nuc
+    out[..., 1, nel:] = force
+
+    return(out)
+
+
+def get_mapping_force(rho, grad, elecE, nac):
+    '''
+        Nuclear forces of `get_derivatives` for the electronic density
+        rho_ij = c_i^* c_j, c = q + ip, or its time average; leading
+        ensemble axes as in `get_derivatives`
+    '''
+    triu = _get_eom_workspace(np.shape(elecE)[:-1], grad.shape[-1]).triu
+    pop = np.real(np.diagonal(rho, axis1=-2, axis2=-1))
+    p2x2_DdEdR = np.einsum('...i,...in->...n', nel*pop - np.sum(pop, axis=-1, keepdims=True), grad)
+    # sum_{i<j} Re(rho_ij) * (Ej - Ei) * dij, Re(rho_ij) = pi * pj + qi * qj
+    ppxx_DE = np.real(rho) * (elecE[..., None, :] - elecE[..., :, None]) * triu
+    ppxx_DEnac = np.einsum('...ij,...ijn->...n', ppxx_DE, nac)
+    return -(1.0/nel)*np.sum(grad, axis=-2) - (0.5/nel)*p2x2_DdEdR - ppxx_DEnac
+
+
+def get_split_step(au_mas, elecE, grad, nac, n_iter=2):
+    '''
+        One step of the splitting integrator (rk_method = 'split') for frozen
+        energies, gradients and NACs, as step(y, h, out) on flattened states
+        with the leading ensemble axes of `get_derivatives`.
+
+        With the nuclear velocity v fixed, the electronic equations are
+        linear: c = q + ip obeys dc/dt = -i H c with the Hermitian
+        H = diag(E_i - mean(E)) + i A, A_ij = d_ji . v, so that
+        c(t) = U exp(-i w t) U^+ c(0) with the eigenpairs (w, U) of H.
+        The electrons are propagated exactly with the midpoint velocity, and
+        the nuclei by velocity Verlet with the forces averaged analytically
+        over each half of the step, so that fast electronic oscillations
+        (large gaps) do not limit the step. The midpoint velocity is found
+        by `n_iter` fixed-point iterations, one eigendecomposition each.
+        step returns the number of eigendecompositions.
+    '''
+    shape = np.shape(elecE)[:-1] + (2, ndof)
+    rel_E = elecE - np.mean(elecE, axis=-1, keepdims=True)
+    #   antisymmetric part of the NACs, so that H is exactly Hermitian
+    nac_A = 0.5*(np.swapaxes(nac, -3, -2) - nac)
+    diag = np.arange(nel)
+
+    def average_rho(U, b, dw, t0, t1):
+        #   time average of rho over [t0, t1]: U^* (b^* b^T o K) U^T
+        #   with K_ab = average of exp(i (w_a - w_b) t)
+        z = 1j*dw*(t1 - t0)
+        phi = np.where(z == 0, 1.0, np.expm1(z)/np.where(z == 0, 1.0, z))
+        K = np.exp(1j*dw*t0)*phi
+        M = b.conj()[..., :, None]*b[..., None, :]*K
+        return np.einsum('...ia,...ab,...jb->...ij', U.conj(), M, U)
+
+    def step(y, h, out):
+        y, out = y.reshape(shape), out.reshape(shape)
+        c = y[..., 0, :nel] + 1j*y[..., 1, :nel]
+        P = y[..., 1, nel:]
+        force_0 = get_mapping_force(c.conj()[..., :, None]*c[..., None, :], grad, elecE, nac)
+        P_half = P + 0.5*h*force_0
+        for _ in range(n_iter):
+            H = 1j*np.einsum('...ijn,...n->...ij', nac_A, P_half/au_mas)
+            H[..., diag, diag] = rel_E
+            w, U = np.linalg.eigh(H)
+            b = np.einsum('...ji,...j->...i', U.conj(), c)
+            dw = w[..., :, None] - w[..., None, :]
+            P_half = P + 0.5*h*get_mapping_force(average_rho(U, b, dw, 0.0, 0.5*h), grad, elecE, nac)
+
+        c_h = np.einsum('...ij,...j->...i', U, np.exp(-1j*w*h)*b)
+        out[..., 0, nel:] = y[..., 0, nel:] + h*P_half/au_mas
+        out[..., 1, nel:] = P_half + 0.5*h*get_mapping_force(average_rho(U, b, dw, 0.5*h, h), grad, elecE, nac)
+        out[..., 0, :nel] = c_h.real
+        out[..., 1, :nel] = c_h.imag
+        return n_iter
+
+    return step
+
+
+def get_frozen_step(au_mas, elecE, grad, nac):
+    '''
+        What `rk_integrator.step` advances the state with for frozen
+        energies, gradients and NACs: the derivative function of a
+        Runge-Kutta scheme, or the step of the splitting
+    '''
+    if rk_method == 'split':
+        return get_split_step(au_mas, elecE, grad, nac)
+    def get_deriv(y0, der):
+        get_derivatives(au_mas, y0[:ndof], y0[ndof:], nac, grad, elecE, out=der.reshape(2, ndof))
+    return get_deriv
 
 
 ##########################################################
@@ -753,23 +1094,19 @@ def compute_ABM_corrector(timestep, init_coord, f1, f2, f3, f4):
 ### the symmetrized potential
 ##############################################################################
 def get_energy(au_mas, q, p, elecE):
+    w = _get_eom_workspace(q.shape[:-1], q.shape[-1] - nel)
     # Nuclear part (sum of P**2/M)
-    p2m_sum = 0
-    for n in range(nnuc):
-        p2m_temp = 0
-        p2m_temp = p[nel+n]**2/au_mas[n]
-        p2m_sum += p2m_temp
-        
-    # Electronic part ((pi2 - p2j + qi2 - qj2) * (Ei - Ej))
-    p2x2_DE = 0
-    for i in range(nel):
-        j = i + 1
-        while j < nel:
-            p2x2_DE += (p[i]**2 - p[j]**2 + q[i]**2 - q[j]**2) * (elecE[i] - elecE[j])
-            j += 1
-    
+    np.divide(1.0, au_mas, out=w.inv_mas)
+    p2m_sum = np.einsum('...n,...n,n->...', p[..., nel:], p[..., nel:], w.inv_mas)
+
+    # Electronic part (sum_{i<j} (pi2 - p2j + qi2 - qj2) * (Ei - Ej))
+    np.einsum('...i,...i->...i', p[..., :nel], p[..., :nel], out=w.el)
+    np.einsum('...i,...i->...i', q[..., :nel], q[..., :nel], out=w.pop)
+    w.el += w.pop
+    p2x2_DE = np.einsum('...k,ki,...i->...', w.el, w.de_op, elecE)
+
     # Total energy at updated t
-    energy = 0.5*p2m_sum + (1.0/nel)*sum(elecE) + (0.5/nel)*p2x2_DE
+    energy = 0.5*p2m_sum + (1.0/nel)*np.sum(elecE, axis=-1) + (0.5/nel)*p2x2_DE
     return(energy)
 
 
@@ -858,21 +1195,9 @@ def ME_ABM(restart, initq, initp, amu_mat, U, com_ang, AN_mat):
     while proceed and not terminate:
         au_mas = np.diag(amu_mat) * amu2au # masses of atoms in atomic unit
         
-        # Update geo_gamess with qC
-        update_geo_gamess(atoms, AN_mat, qC)
-        
-        # Call GAMESS to compute E, dE/dR, and NAC
-        run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-
-        # Read GAMESS out file
-        elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-        if any([el == 1  for el in flag_grad]) or flag_nac == 1:
-            proceed = False
-            break
-        
-        # Read GAMESS dat file
-        flag_orb = read_gms_dat(input_name)
-        if flag_orb == 1:
+        # Call GAMESS (or the model Hamiltonian) to compute E, dE/dR, and NAC
+        elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+        if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
             proceed = False
             break
         
@@ -900,21 +1225,9 @@ def ME_ABM(restart, initq, initp, amu_mat, U, com_ang, AN_mat):
                     ppred[i] = compute_ME_predictor(-timestep/200, p[i], force[1,i,-(t+2)])
                 qC = qpred[nel:]
                 
-                # Update geo_gamess with qC
-                update_geo_gamess(atoms, AN_mat, qC)
-                
-                # Call GAMESS to compute E, dE/dR, and NAC
-                run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-                
-                # Read GAMESS out file
-                elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-                if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-                    proceed = False
-                    break
-                
-                # Read GAMESS dat file
-                flag_orb = read_gms_dat(input_name)
-                if flag_orb == 1:
+                # Call GAMESS (or the model Hamiltonian) to compute E, dE/dR, and NAC
+                elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+                if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
                     proceed = False
                     break
                 
@@ -931,21 +1244,9 @@ def ME_ABM(restart, initq, initp, amu_mat, U, com_ang, AN_mat):
                 # Save the corrected coordinates
                 q, p = qcorr, pcorr
                 
-                # Update geo_gamess with qC
-                update_geo_gamess(atoms, AN_mat, qC)
-                
-                # Call GAMESS to compute E, dE/dR, and NAC
-                run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-                
-                # Read GAMESS out file
-                elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-                if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-                    proceed = False
-                    break
-                
-                # Read GAMESS dat file
-                flag_orb = read_gms_dat(input_name)
-                if flag_orb == 1:
+                # Call GAMESS (or the model Hamiltonian) to compute E, dE/dR, and NAC
+                elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+                if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
                     proceed = False
                     break
         
@@ -982,21 +1283,9 @@ def ME_ABM(restart, initq, initp, amu_mat, U, com_ang, AN_mat):
                     ppred[j] = compute_ABM_predictor(timestep, p[j], force[1,j,-2], force[1,j,-3], force[1,j,-4], force[1,j,-5])
                 qC = qpred[nel:]
                 
-                # Update geo_gamess with qC
-                update_geo_gamess(atoms, AN_mat, qC)
-                
-                # Call GAMESS to compute E, dE/dR, and NAC
-                run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-                
-                # Read GAMESS out file
-                elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-                if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-                    proceed = False
-                    break
-                
-                # Read GAMESS dat file
-                flag_orb = read_gms_dat(input_name)
-                if flag_orb == 1:
+                # Call GAMESS (or the model Hamiltonian) to compute E, dE/dR, and NAC
+                elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+                if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
                     proceed = False
                     break
                 
@@ -1010,21 +1299,9 @@ def ME_ABM(restart, initq, initp, amu_mat, U, com_ang, AN_mat):
                     pcorr[j] = compute_ABM_corrector(timestep, p[j], force[1,j,-1], force[1,j,-2], force[1,j,-3], force[1,j,-4])
                 qC, pC = qcorr[nel:], pcorr[nel:]
                 
-                # Update geo_gamess with qC
-                update_geo_gamess(atoms, AN_mat, qC)
-                
-                # Call GAMESS to compute E, dE/dR, and NAC
-                run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-                
-                # Read GAMESS out file
-                elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-                if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-                    proceed = False
-                    break
-                
-                # Read GAMESS dat file
-                flag_orb = read_gms_dat(input_name)
-                if flag_orb == 1:
+                # Call GAMESS (or the model Hamiltonian) to compute E, dE/dR, and NAC
+                elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+                if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
                     proceed = False
                     break
                 
@@ -1118,6 +1395,8 @@ def ME_ABM(restart, initq, initp, amu_mat, U, com_ang, AN_mat):
                 gg.write('{:>16.10f} \n'.format(X[-1]))
                 gg.write('\n')
         
+    if get_qc_cache() is not None:
+        get_qc_cache().print_summary()
     return(np.array(X), coord, flag_energy, flag_grad, flag_nac, flag_orb, initial_time)
 
 
@@ -1154,12 +1433,8 @@ def integrate(F, xvar, yvar, xStop, tol, input_name, atoms, amu_mat, qC):
 #      update_geo_gamess(atoms, amu_mat, qC)
       with open(os.path.join(__location__, 'progress.out'), 'a') as aa:
          aa.write('CAS calculation at the beginning of midpoint routine (t=%.4f)\n' %(x+h))
-      run_gms_cas(input_name, opt, atoms, amu_mat, qC)
-      elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-      if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-         proceed = False
-      flag_orb = read_gms_dat(input_name)
-      if flag_orb == 1:
+      elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, amu_mat, qC, update_geo=False)
+      if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
          proceed = False
 
       if proceed:
@@ -1183,12 +1458,8 @@ def integrate(F, xvar, yvar, xStop, tol, input_name, atoms, amu_mat, qC):
                # ES calculation at yn
                qC = y2[nel:ndof]
 #               update_geo_gamess(atoms, amu_mat, qC)
-               run_gms_cas(input_name, opt, atoms, amu_mat, qC)
-               elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-               if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-                  proceed = False
-               flag_orb = read_gms_dat(input_name)
-               if flag_orb == 1:
+               elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, amu_mat, qC, update_geo=False)
+               if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
                   proceed = False
                if proceed:
                   # Get derivatives at yn
@@ -1295,16 +1566,9 @@ def BulStoer(initq, initp, xStop, H, tol, restart, amu_mat, U, com_ang, AN_mat):
       # Write initial nuclear geometry in the output file
       record_nuc_geo(restart, x, atoms, qC, com_ang)
 
-      # Update geo_gamess with qC
-      update_geo_gamess(atoms, AN_mat, qC)
-  
-      # Call GAMESS to compute E, dE/dR, and NAC
-      run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-      elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-      if any([el == 1  for el in flag_grad]) or flag_nac == 1:
-         proceed = False
-      flag_orb = read_gms_dat(input_name)
-      if flag_orb == 1:
+      # Call GAMESS (or the model Hamiltonian) to compute E, dE/dR, and NAC
+      elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+      if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
          proceed = False
 
       if not proceed:
@@ -1375,13 +1639,8 @@ def BulStoer(initq, initp, xStop, H, tol, restart, amu_mat, U, com_ang, AN_mat):
             f.write('\n')
             f.write('Midpoint+Richardson step has been accepted.\n')
          qC = y[nel:ndof]
-         update_geo_gamess(atoms, AN_mat, qC)
-         run_gms_cas(input_name, opt, atoms, AN_mat, qC)
-         elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-         if any([el == 1 for el in flag_grad]) or flag_nac == 1:
-            proceed = False
-         flag_orb = read_gms_dat(input_name)
-         if flag_orb == 1:
+         elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_or_model(input_name, opt, atoms, AN_mat, qC)
+         if any([el == 1 for el in flag_grad]) or flag_nac == 1 or flag_orb == 1:
             proceed = False
 
          if proceed:
@@ -1445,6 +1704,8 @@ def BulStoer(initq, initp, xStop, H, tol, restart, amu_mat, U, com_ang, AN_mat):
        gg.write('{:>16.10f} \n'.format(x))
        gg.write('\n')
 
+   if get_qc_cache() is not None:
+      get_qc_cache().print_summary()
    return(np.array(X), coord, initial_time)
 
 
@@ -1454,51 +1715,36 @@ Function to take one integration step by 4th-order Runge-Kutta
 def integrate_rk4(elecE, grad, nac, xvar, yvar, xStop, amu_mat):
    au_mas = np.diag(amu_mat) * amu2au
    h  = xStop - xvar
-   y0 = yvar.copy()
-   y1 = np.zeros(2*ndof)
-   y2 = np.zeros(2*ndof)
-   y3 = np.zeros(2*ndof)
 
    ### 4th-order Runge-Kutta routine ###
-   # Get derivatives (k1) at y0
-   k1 = get_derivatives(au_mas, y0[:ndof], y0[ndof:], nac, grad, elecE)
-   k1 = k1.flatten()
-   for i in range(2*ndof):
-        y1[i] = y0[i] + 0.5*h*k1[i]
-
-   # Get derivatives (k2) at y1
-   k2 = get_derivatives(au_mas, y1[:ndof], y1[ndof:], nac, grad, elecE)
-   k2 = k2.flatten()
-   # Take an intermediate step to y2
-   for i in range(2*ndof):
-        y2[i] = y0[i] + 0.5*h*k2[i] # position
-
-   # Get derivatives (k3) at y2
-   k3 = get_derivatives(au_mas, y2[:ndof], y2[ndof:], nac, grad, elecE)
-   k3 = k3.flatten()
-   # Take an intermediate step to y3
-   for i in range(2*ndof):
-        y3[i] = y0[i] + h*k3[i] # position
-
-   # Get derivatives (k4) at y3
-   k4 = get_derivatives(au_mas, y3[:ndof], y3[ndof:], nac, grad, elecE)
-   k4 = k4.flatten()
+   def get_deriv(y0, der):
+      get_derivatives(au_mas, y0[:ndof], y0[ndof:], nac, grad, elecE, out=der.reshape(2, ndof))
 
    # Compute the coordinates at t=x+H
-   result = np.zeros(2*ndof)
-   for i in range(2*ndof):
-      result[i] = y0[i] + h*(k1[i] + 2*k2[i] + 2*k3[i] + k4[i])/6.0
+   result = ExplicitRK('rk4', 2*ndof).step(get_deriv, yvar, h)
 
    return(result)
 
 def scipy_rk4(elecE, grad, nac, yvar, dt, au_mas):
+    der = np.empty((2, ndof))
     def get_deriv(t, y0):
-        der = get_derivatives(au_mas, y0[:ndof], y0[ndof:], nac, grad, elecE)
-        der = der.flatten()
-        return(der)
+        get_derivatives(au_mas, y0[:ndof], y0[ndof:], nac, grad, elecE, out=der)
+        return(der.flatten())
     result = it.solve_ivp(get_deriv, (0,dt), yvar, method='RK45', max_step=dt, t_eval=[dt], rtol=1e-10, atol=1e-10)
     return(result.y.flatten())
 
+def get_mts_deriv(au_mas, es0, es1, s0=0.0, ds=1.0):
+    '''
+        Step functions (see `get_frozen_step`) of the sub-steps of a multiple
+        time step: the electronic structure (elecE, grad, nac) at the fraction
+        s of the step is the linear interpolation (or extrapolation) between
+        es0 at 0 and es1 at 1, evaluated at s0 + ds*s
+    '''
+    def f_at(s):
+        x = s0 + ds*s
+        return get_frozen_step(au_mas, *[(1.0 - x)*a + x*b for a, b in zip(es0, es1)])
+    return f_at
+
 '''
 Main driver of RK4 and electronic structure 
 '''
@@ -1516,6 +1762,15 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
     input_name   = 'cas'
     au_mas = np.diag(amu_mat) * amu2au # masses of atoms in atomic unit (vector)
 
+    # One-step integrator for the frozen electronic structure equations of motion
+    rk_integrator = get_integrator(rk_method, 2*ndof, rk_tol)
+    # Electronic sub-steps with the QC results interpolated in time, see `mts_substeps`
+    mts = None
+    if mts_substeps > 1:
+        mts = MultipleTimeStep(rk_integrator, mts_substeps)
+    stepper = rk_integrator if mts is None else mts
+    es_prev, H_prev = None, H
+
     # Format descriptor depending on the number of electronic states
     total_format = '{:>12.4f}{:>12.5f}' # "time" "total"
     for i in range(nel):
@@ -1556,22 +1811,21 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
             update_geo_gamess(atoms, AN_mat, qC)
         
             # Call GAMESS to compute E, dE/dR, and NAC
-            run_gms_cas(input_name, opt, atoms, AN_mat, qC, sub_script)
-            elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-            if any([el == 1  for el in flag_grad]) or flag_nac == 1:
+            elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_cached(input_name, opt, atoms, AN_mat, qC, sub_script)
+            if any([el == 1 for el in flag_grad]) or flag_nac == 1:
                 proceed = False
-            flag_orb = read_gms_dat(input_name)
             if flag_orb == 1:
                 proceed = False
             if not proceed:
                 sys.exit("Electronic structure calculation failed at initial time. Exitting.")
+        elif QC_RUNNER == 'model':
+            elecE, grad, nac, trans_dips, qc_timings = run_model(qC)
         else:
-            tc_runner = TCRunner(tcr_host, tcr_port, atoms, tcr_job_options, server_roots=tcr_server_root, run_options=tcr_state_options, tc_spec_job_opts=tcr_spec_job_opts, tc_initial_job_options=tcr_initial_frame_opts, start_new=False)
-            job_results, qc_timings = tc_runner.run_TC_new_geom(qC/ang2bohr)
+            tc_runner = TCRunner(tcr_host, tcr_port, atoms, tcr_job_options, server_roots=tcr_server_root, run_options=tcr_state_options, tc_spec_job_opts=tcr_spec_job_opts, tc_initial_job_options=tcr_initial_frame_opts, start_new=False, use_pool=tcr_use_pool, use_async=tcr_async, hedge_quantile=tcr_hedge_quantile, output_capture=get_tc_output_capture(), janitor=get_tc_janitor(), server_farm=get_tc_server_farm())
+            elecE, grad, nac, trans_dips, job_results, qc_timings = run_TC_cached(tc_runner, qC)
             # import pickle
             # pickle.dump([job_results, qc_timings], open('_tmp.pkl', 'wb'))
             # job_results, qc_timings = pickle.load( open('_tmp.pkl', 'rb'))
-            elecE, grad, nac, trans_dips = format_output_LSCIVR(job_results)
 
 
         # Total initial energy at t=0
@@ -1624,21 +1878,20 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
 
         if QC_RUNNER == 'gamess':
             # Call GAMESS to compute E, dE/dR, and NAC
-            run_gms_cas(input_name, opt, atoms, AN_mat, qC, sub_script)
-            elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
-            if any([el == 1  for el in flag_grad]) or flag_nac == 1:
+            elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_cached(input_name, opt, atoms, AN_mat, qC, sub_script)
+            if any([el == 1 for el in flag_grad]) or flag_nac == 1:
                 proceed = False
-            flag_orb = read_gms_dat(input_name)
             if flag_orb == 1:
                 proceed = False
             if not proceed:
                 sys.exit("Electronic structure calculation failed at initial time. Exitting.")
+        elif QC_RUNNER == 'model':
+            elecE, grad, nac, trans_dips, qc_timings = run_model(qC)
         else:
-            tc_runner = TCRunner(tcr_host, tcr_port, atoms, tcr_job_options, server_roots=tcr_server_root, run_options=tcr_state_options, tc_spec_job_opts=tcr_spec_job_opts, tc_initial_job_options=tcr_initial_frame_opts)
-            job_results, qc_timings = tc_runner.run_TC_new_geom(qC/ang2bohr)
+            tc_runner = TCRunner(tcr_host, tcr_port, atoms, tcr_job_options, server_roots=tcr_server_root, run_options=tcr_state_options, tc_spec_job_opts=tcr_spec_job_opts, tc_initial_job_options=tcr_initial_frame_opts, use_pool=tcr_use_pool, use_async=tcr_async, hedge_quantile=tcr_hedge_quantile, output_capture=get_tc_output_capture(), janitor=get_tc_janitor(), server_farm=get_tc_server_farm())
+            elecE, grad, nac, trans_dips, job_results, qc_timings = run_TC_cached(tc_runner, qC)
             # import json
             # json.dump(tc_runner.cleanup_multiple_jobs(job_results), open('tmp.json', 'w'), indent=4)
-            elecE, grad, nac, trans_dips  = format_output_LSCIVR(job_results)
         
         # If nac_hist and tdm_hist array does not exist yet, create it as zeros array
         if nac_hist.size == 0:
@@ -1655,9 +1908,26 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
         
         nac, nac_hist, tdm_hist = correct_nac_sign(nac,nac_hist,trans_dips,tdm_hist)
 
+    #   skip NACs of well separated states, from the second step on
+    nac_pruner = None
+    if QC_RUNNER == 'terachem' and tcr_nac_prune_gap is not None:
+        from nac_pruning import NACPruner
+        nac_pruner = NACPruner(nel, tcr_nac_prune_gap, tcr_nac_prune_norm, tcr_nac_prune_max_skip)
+        nac_pruner.update(elecE, nac, trans_dips, nac_hist, tdm_hist)
+        qc_timings.update(nac_pruner.get_stats())
+
+    #   interpolation of the QC results between the stored geometries
+    pes_interp = get_pes_interpolator()
+    if pes_interp is not None:
+        pes_interp.add(qC, elecE, grad, nac, trans_dips)
+        qc_timings.update(pes_interp.get_stats())
+
     # pops = compute_CF_single(q[0:nel], p[0:nel])
     logger.atoms = atoms
     qc_timings['Wall_Time'] = 0.0
+    qc_timings.update(stepper.get_step_stats())
+    if get_qc_cache() is not None:
+        qc_timings.update(get_qc_cache().get_stats())
     logger.write(t, init_energy, elecE,  grad, nac, qc_timings, elec_p=p[0:nel], elec_q=q[0:nel], nuc_p=p[nel:], jobs_data=job_results)
 
     opt['guess'] = 'moread'
@@ -1682,8 +1952,15 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
             with open(os.path.join(__location__, 'progress.out'), 'a') as f:
                 f.write('\n')
                 f.write('Starting 4th-order Runge-Kutta routine.\n')
-            #y  = integrate_rk4(elecE,grad,nac,t,y,t+H,amu_mat) 
-            y  = scipy_rk4(elecE,grad,nac,y,H,au_mas)
+            if mts is None:
+                y  = rk_integrator.step(get_frozen_step(au_mas, elecE, grad, nac), y, H)
+            else:
+                #   predictor: QC results extrapolated from the last two steps (frozen on the first step)
+                y_start, es_start = y, (elecE, grad, nac)
+                if es_prev is None:
+                    y = mts.step(get_mts_deriv(au_mas, es_start, es_start), y, H)
+                else:
+                    y = mts.step(get_mts_deriv(au_mas, es_prev, es_start, 1.0, H/H_prev), y, H)
             t += H
             X.append(t)
             Y.append(y)
@@ -1697,20 +1974,49 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
 
             qC = y[nel:ndof]
 
-            if QC_RUNNER == 'gamess':
+            interpolated = None if pes_interp is None else pes_interp.query(qC)
+            if interpolated is not None:
+                elecE, grad, nac, trans_dips = interpolated
+                job_results = None
+                #   keep the same timing columns as a computed frame
+                qc_timings = {k: 0.0 for k in qc_timings}
+            elif QC_RUNNER == 'gamess':
                 update_geo_gamess(atoms, AN_mat, qC)
-                run_gms_cas(input_name, opt, atoms, AN_mat, qC, sub_script)
-                elecE, grad, nac, flag_grad, flag_nac = read_gms_out(input_name)
+                elecE, grad, nac, flag_grad, flag_nac, flag_orb = run_gms_cached(input_name, opt, atoms, AN_mat, qC, sub_script)
                 if any([el == 1 for el in flag_grad]) or flag_nac == 1:
                     proceed = False
-                flag_orb = read_gms_dat(input_name)
                 if flag_orb == 1:
                     proceed = False
+            elif QC_RUNNER == 'model':
+                elecE, grad, nac, trans_dips, qc_timings = run_model(qC)
+            elif nac_pruner is not None:
+                skip = nac_pruner.select()
+                tc_states = sorted(tcr_state_options['grads'])
+                nac_pruner.set_time_saved(tc_runner.set_skipped_nacs([(tc_states[i], tc_states[j]) for i, j in skip]))
+                if len(skip):
+                    print("Skipping NACs of well separated states: ", ", ".join([f'{i}-{j}' for i, j in skip]))
+                elecE, grad, nac, trans_dips, job_results, qc_timings = run_TC_cached(tc_runner, qC, allow_missing=len(skip) > 0)
+                #   pairs of the frame with a transition dipole (None on a cache hit)
+                has_tdm = job_results.has_trans_dip if job_results is not None else None
+                nac, trans_dips = nac_pruner.update(elecE, nac, trans_dips, nac_hist, tdm_hist, has_tdm)
+                qc_timings.update(nac_pruner.get_stats())
             else:
-                job_results, qc_timings = tc_runner.run_TC_new_geom(qC/ang2bohr)
-                elecE, grad, nac, trans_dips  = format_output_LSCIVR(job_results)
+                elecE, grad, nac, trans_dips, job_results, qc_timings = run_TC_cached(tc_runner, qC)
             #correct nac sign
             nac, nac_hist, tdm_hist = correct_nac_sign(nac,nac_hist,trans_dips,tdm_hist)
+            if pes_interp is not None:
+                if interpolated is None and proceed:
+                    pes_interp.add(qC, elecE, grad, nac, trans_dips)
+                qc_timings.update(pes_interp.get_stats())
+            if mts is not None and proceed:
+                #   corrector: QC results interpolated between the start and the predicted end of the step.
+                #   QC ran at the predicted geometry, so the nuclear positions are kept there and only the
+                #   momenta and the electronic variables are corrected
+                y_pred = y
+                y = mts.step(get_mts_deriv(au_mas, es_start, (elecE, grad, nac)), y_start, H)
+                y[nel:ndof] = y_pred[nel:ndof]
+                es_prev, H_prev = es_start, H
+                Y[-1] = y
 
         if proceed:
             # Compute energy
@@ -1739,6 +2045,9 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
             # pops = compute_CF_single(y[0:nel], y[ndof:ndof+nel])
             end_time = time.time()
             qc_timings['Wall_Time'] = end_time - start_time
+            qc_timings.update(stepper.get_step_stats())
+            if get_qc_cache() is not None:
+                qc_timings.update(get_qc_cache().get_stats())
             logger.write(t, total_E=new_energy, elec_E=elecE,  grads=grad, NACs=nac, timings=qc_timings, elec_q=y[0:nel], elec_p=y[ndof:ndof+nel], nuc_p=y[-natom*3:], jobs_data=job_results)
             write_restart('restart.json', [Y[-1][:ndof], Y[-1][ndof:]], nac_hist, tdm_hist, new_energy, t, nel, 'rk4')
 
@@ -1746,6 +2055,16 @@ def rk4(initq, initp, tStop, H, restart, amu_mat, U, com_ang, AN_mat):
                 with open(os.path.join(__location__, 'progress.out'), 'a') as f:
                     f.write('Propagated to the final time step.\n')
 
+    rk_integrator.print_summary()
+    if QC_RUNNER == 'terachem':
+        tc_runner.print_pool_stats()
+    if nac_pruner is not None:
+        nac_pruner.print_summary()
+    if pes_interp is not None:
+        pes_interp.print_summary()
+    if get_qc_cache() is not None:
+        get_qc_cache().print_summary()
+
     coord = np.zeros((2,ndof,len(Y)))
     for i in range(len(Y)):
         coord[0,:,i] = Y[i][:ndof]
@@ -1814,14 +2133,13 @@ trajectory propagation.
 X = time array
 Y = coordinate array
 '''
-def compute_CF(X, Y):
+def compute_CF(X, Y, corr_file='corr.out'):
    ### Compute the estimator of electronic state population ###
    pop = np.zeros((nel, len(X)))
    total_format = '{:>12.4f}'
    for i in range(nel+1):
        total_format += '{:>16.10f}'
    total_format += '\n'
-   corr_file = 'corr.out'
 
    with open(os.path.join(__location__, corr_file), 'a') as f:
        for t in range(len(X)):
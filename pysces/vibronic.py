@@ -0,0 +1,169 @@
+"""
+Linear (LVC) and quadratic (QVC) vibronic coupling models fitted to QC data
+around the reference geometry, for QC_RUNNER = 'model'.
+
+The diabatic states are taken equal to the adiabatic states at the
+reference geometry. One QC calculation there gives the LVC model: the
+vertical energies, the intrastate couplings kappa from the gradients and
+the interstate couplings lambda from the NACs times the energy gaps. With
+`--order 2`, the adiabatic gradients at +/- `--step` (dimensionless normal
+coordinate) along the selected modes give the adiabatic Hessians by central
+differences. The quadratic couplings gamma are what remains of them after the
+frequencies and the second-order contribution of lambda are removed. The
+displaced points also give the fitting error of the model energies
+(`--validate` computes them for an LVC fit as well).
+
+All QC calculations go through the runner of the simulation settings
+(QC_RUNNER 'gamess' or 'terachem') as one batch. The model is written as an
+.npz file for the `model_file` option.
+
+    pysces lvc -o lvc_model.npz
+    pysces lvc -o qvc_model.npz --order 2 --step 0.5
+    pysces lvc -o lvc_model.npz --validate --modes 0 3 7
+"""
+import sys
+import argparse
+import numpy as np
+from model_hamiltonians import LVCModel, ModelRunner
+
+
+def fit_lvc(frq, modes_cart, elecE, grad, nac):
+    '''
+        LVC parameters from the QC results at the reference geometry
+
+        Parameters
+        ----------
+        frq: (n_modes,) frequencies in a.u.
+        modes_cart: (n_modes, nnuc) Cartesian displacement dx/dQ of every mode
+        elecE, grad, nac: energies (n,), gradients (n, nnuc) and NACs
+            (n, n, nnuc) at the reference geometry
+
+        Returns
+        -------
+        energies (n,), kappa (n, n_modes), lam (n, n, n_modes) in hartree
+    '''
+    n = len(elecE)
+    sqrt_frq = np.sqrt(np.abs(frq))
+    kappa = (grad @ modes_cart.T)/sqrt_frq
+    #   <i|d/dq j> (E_j - E_i) is the diabatic coupling gradient at the reference
+    lam = (nac @ modes_cart.T)/sqrt_frq*(elecE[None, :] - elecE[:, None])[..., None]
+    lam = 0.5*(lam + lam.transpose(1, 0, 2))
+    lam[np.arange(n), np.arange(n)] = 0.0
+    return np.array(elecE), kappa, lam
+
+
+def fit_gamma(frq, energies, lam, modes, step, grad_plus, grad_minus, min_gap=1.0e-4):
+    '''
+        Quadratic intrastate couplings from the adiabatic gradients displaced
+        along `modes`
+
+        Parameters
+        ----------
+        frq, energies, lam: frequencies and LVC parameters from `fit_lvc`
+        modes: indices of the displaced modes
+        step: displacement in dimensionless normal coordinates
+        grad_plus, grad_minus: (len(modes), n, n_modes) gradients with respect
+            to the dimensionless coordinates at +step and -step
+        min_gap: state pairs closer than this (hartree) do not enter the
+            second-order correction
+
+        Returns
+        -------
+        gamma: (n, n_modes, n_modes), zero for pairs of modes that were not displaced
+    '''
+    n, m = len(energies), len(frq)
+    #   second-order contribution of the interstate couplings to the adiabatic Hessians
+    gap = energies[:, None] - energies[None, :]
+    inv_gap = np.where(np.abs(gap) > min_gap, 1.0/np.where(gap == 0, 1.0, gap), 0.0)
+    correction = 2.0*np.einsum('ij,ijk,ijl->ikl', inv_gap, lam, lam)
+    correction[:, np.arange(m), np.arange(m)] += np.sign(frq)*np.abs(frq)
+
+    gamma = np.zeros((n, m, m))
+    known = np.zeros((m, m), dtype=bool)
+    for a, k in enumerate(modes):
+        gamma[:, :, k] = (grad_plus[a] - grad_minus[a])/(2.0*step) - correction[:, :, k]
+        known[:, k] = True
+    #   symmetrize, mirroring columns whose transposed partner was not displaced
+    both = known & known.T
+    gamma_T = gamma.transpose(0, 2, 1)
+    return np.where(both, 0.5*(gamma + gamma_T), np.where(known, gamma, gamma_T))
+
+
+def fit_errors(runner: ModelRunner, points, elecE):
+    '''
+        RMS and maximum deviation (hartree) of the model energies from the
+        QC energies at `points`, for every state
+    '''
+    model_E = runner.compute(points)[0]
+    dev = np.abs(model_E - elecE)
+    return np.sqrt(np.mean(dev**2, axis=0)), np.max(dev, axis=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pysces lvc', description='Fit a vibronic coupling model to QC data with the settings in the current directory')
+    parser.add_argument('-o', '--output', default='lvc_model.npz', help='model file')
+    parser.add_argument('--order', type=int, choices=[1, 2], default=1, help='1 = LVC (one QC calculation), 2 = QVC')
+    parser.add_argument('--step', type=float, default=0.5, help='displacement in dimensionless normal coordinates')
+    parser.add_argument('--modes', type=int, nargs='+', default=None, help='vibrational modes (0-based) displaced for the QVC fit and validation (default: all)')
+    parser.add_argument('--validate', action='store_true', help='compute the displaced points for an LVC fit to report its errors')
+    args = parser.parse_args(argv)
+
+    #   the molecule and the QC runner come from the simulation settings
+    import input_simulation as opts
+    from input_gamess import nacme_option as opt
+    from subroutines import get_geo_hess, get_normal_geo, get_atom_label, amu2au
+    from ensemble import GamessBatchRunner, TCBatchRunner
+
+    amu_mat, xyz_ang, frq, redmas, L, U, com_ang, AN_mat = get_geo_hess()
+    frq, modes = frq[6:], U[6:]
+    sqrt_mas = np.sqrt(np.diag(amu_mat)*amu2au)
+    Q0 = get_normal_geo(U, xyz_ang, amu_mat)
+    modes_cart = modes/sqrt_mas
+    x0 = Q0 @ modes_cart
+
+    sel = list(range(len(frq))) if args.modes is None else args.modes
+    displaced = args.order == 2 or args.validate
+    points = [x0]
+    if displaced:
+        for k in sel:
+            dx = args.step/np.sqrt(np.abs(frq[k]))*modes_cart[k]
+            points += [x0 + dx, x0 - dx]
+    points = np.array(points)
+
+    atoms = get_atom_label()
+    if opts.QC_RUNNER == 'gamess':
+        qc = GamessBatchRunner(len(points), atoms, AN_mat, root='lvc_fit')
+    elif opts.QC_RUNNER == 'terachem':
+        qc = TCBatchRunner(atoms)
+    else:
+        sys.exit(f'A vibronic coupling model is fitted to "gamess" or "terachem" results, not "{opts.QC_RUNNER}"')
+    print(f'Running {len(points)} QC calculation(s) with {opts.QC_RUNNER}')
+    opt['guess'] = ''
+    elecE, grad, nac, trans_dips, failed, jobs_data, timings = qc.compute(points, np.arange(len(points)))
+    qc.print_summary()
+    if np.any(failed):
+        sys.exit(f'QC calculation(s) {list(np.flatnonzero(failed))} failed')
+
+    energies, kappa, lam = fit_lvc(frq, modes_cart, elecE[0], grad[0], nac[0])
+    lvc = LVCModel(frq, energies, kappa, lam)
+    model = lvc
+    if args.order == 2:
+        grad_q = (grad[1:] @ modes_cart.T)/np.sqrt(np.abs(frq))
+        gamma = fit_gamma(frq, energies, lam, sel, args.step, grad_q[0::2], grad_q[1::2])
+        model = LVCModel(frq, energies, kappa, lam, gamma)
+
+    dipoles = None if trans_dips is None else trans_dips[0]
+    model.save(args.output, dipoles, order=args.order, step=args.step, runner=opts.QC_RUNNER)
+    print(f'{"LVC" if args.order == 1 else "QVC"} model of {len(energies)} states in {len(frq)} modes written to {args.output}')
+
+    if displaced:
+        print(f'Energy errors at the {len(points) - 1} displaced geometries (hartree)')
+        print(f"{'state':>6s} {'model':>6s} {'RMS':>10s} {'max':>10s}")
+        for name, m in [('LVC', lvc), ('QVC', model)][0:args.order]:
+            rms, max_dev = fit_errors(ModelRunner(m, modes, sqrt_mas**2, Q0), points[1:], elecE[1:])
+            for i in range(len(energies)):
+                print(f'{i:6d} {name:>6s} {rms[i]:10.2e} {max_dev[i]:10.2e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+The PySCES modules read the simulation settings (`input_simulation`) once,
+when they are first imported, from `input_simulation_local.py` in the
+current directory. The tests therefore run in a scratch directory that
+holds the ethylene molecule of examples/gamess_ethylene and settings for
+the model-Hamiltonian QC runner, so that no QC program is needed.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE_DIR = os.path.join(ROOT, 'examples', 'gamess_ethylene')
+sys.path.insert(0, os.path.join(ROOT, 'pysces'))
+
+
+def lvc_params(seed=3, gap=0.02):
+    '''
+        Three states with vertical gaps `gap` and 0.75*`gap` (hartree) in the
+        12 ethylene modes, all modes coupled (as in benchmarks/mts_accuracy.py)
+    '''
+    rng = np.random.default_rng(seed)
+    lam = 0.003*np.abs(rng.normal(size=(3, 3, 12)))*(1 - np.eye(3))[..., None]
+    return {
+        'energies': [0.0, gap, 1.75*gap],
+        'kappa': (0.004*rng.normal(size=(3, 12))).tolist(),
+        'lam': (0.5*(lam + lam.transpose(1, 0, 2))).tolist(),
+    }
+
+
+SETTINGS = {
+    'nel': 3, 'natom': 6,
+    'QC_RUNNER': 'model', 'mol_input_format': 'gamess',
+    'model_type': 'lvc', 'model_params': lvc_params(),
+    'integrator': 'RK4', 'tmax_rk4': 20.0, 'Hrk4': 1.0, 'rk_method': 'rk4',
+    'input_seed': 1,
+}
+
+
+def pytest_sessionstart(session):
+    '''
+        Scratch directory with the settings, before the test modules import PySCES
+    '''
+    work_dir = tempfile.mkdtemp(prefix='pysces_tests_')
+    for name in ['geo_gamess', 'hess_gamess', 'mass_gamess']:
+        shutil.copy(os.path.join(EXAMPLE_DIR, name), work_dir)
+    with open(os.path.join(work_dir, 'input_simulation_local.py'), 'w') as file:
+        for key, value in SETTINGS.items():
+            file.write(f'{key} = {value!r}\n')
+    os.chdir(work_dir)
+
+
+@pytest.fixture(scope='session')
+def initial_condition():
+    '''
+        One sampled initial condition of the ethylene model, and the
+        normal mode data `rk4` needs
+    '''
+    import subroutines as S
+    amu_mat, xyz_ang, frq, redmas, L, U, com_ang, AN_mat = S.get_geo_hess()
+    coord = S.sample_initial_conditions(S.get_normal_geo(U, xyz_ang, amu_mat), frq, [0], 1)[0]
+    return coord, (amu_mat, U, com_ang, AN_mat)
+
+
+@pytest.fixture
+def run_rk4(initial_condition, monkeypatch):
+    '''
+        run_rk4(H, tmax, rk_method='rk4', mts_substeps=1) propagates the
+        initial condition with `rk4` and the model runner
+
+        Returns
+        -------
+        times, (2, ndof, n_times) array of phase space variables
+    '''
+    import subroutines as S
+    coord, (amu_mat, U, com_ang, AN_mat) = initial_condition
+    def run(H, tmax, rk_method='rk4', mts_substeps=1):
+        monkeypatch.setattr(S, 'rk_method', rk_method)
+        monkeypatch.setattr(S, 'mts_substeps', mts_substeps)
+        times, coords, _ = S.rk4(coord[0], coord[1], tmax, H, 0, amu_mat, U, com_ang, AN_mat)
+        return np.array(times), coords
+    return run
@@ -0,0 +1,105 @@
+"""
+Streaming ensemble statistics against direct numpy averages
+"""
+import numpy as np
+from aggregate import CorrelationAggregator, ReplicateAggregator
+
+DT = 0.5
+
+
+def trajectories(n_traj, n_times, n_states, seed=0):
+    rng = np.random.default_rng(seed)
+    times = DT*np.arange(n_times)
+    return times, rng.normal(size=(n_traj, n_times, n_states))
+
+
+def with_total(pops):
+    return np.concatenate((np.sum(pops, axis=-1, keepdims=True), pops), axis=-1)
+
+
+def write_corr(file_loc, times, pops):
+    with open(file_loc, 'w') as file:
+        file.write('time total ' + ' '.join([f'S{i}' for i in range(pops.shape[1])]) + '\n')
+        for t, p in zip(times, pops):
+            file.write(' '.join([f'{x:.17e}' for x in [t, np.sum(p), *p]]) + '\n')
+
+
+def test_welford_matches_numpy(tmp_path):
+    times, pops = trajectories(20, 15, 3)
+    agg = CorrelationAggregator(str(tmp_path/'pops.npy'), dt=DT, n_bins=4)
+    for traj in pops:
+        agg.add(times, traj)
+    t, mean, std_err, counts = agg.query()
+
+    ref = with_total(pops)
+    np.testing.assert_allclose(t, times)
+    np.testing.assert_array_equal(counts, 20)
+    np.testing.assert_allclose(mean, np.mean(ref, axis=0), atol=1e-13)
+    np.testing.assert_allclose(std_err, np.std(ref, axis=0, ddof=1)/np.sqrt(20), atol=1e-13)
+
+
+def test_resume_from_memmap_and_offsets(tmp_path):
+    times, pops = trajectories(3, 12, 2, seed=1)
+    files = []
+    for k, traj in enumerate(pops):
+        files.append(str(tmp_path/f'corr_{k}.txt'))
+        write_corr(files[-1], times, traj)
+
+    #   the first trajectory is still running: its last line is incomplete
+    full = open(files[0]).read()
+    lines = full.splitlines(keepends=True)
+    cut = len(''.join(lines[:8])) + 5
+    with open(files[0], 'w') as file:
+        file.write(full[:cut])
+
+    agg = CorrelationAggregator(str(tmp_path/'pops.npy'))
+    assert agg.ingest(files) == 7 + 2*12
+    del agg
+
+    with open(files[0], 'w') as file:
+        file.write(full)
+    agg = CorrelationAggregator(str(tmp_path/'pops.npy'))
+    assert agg.dt == DT
+    assert agg.ingest(files) == 12 - 7
+    #   nothing is ingested twice
+    assert agg.ingest(files) == 0
+
+    t, mean, std_err, counts = agg.query()
+    ref = with_total(pops)
+    np.testing.assert_array_equal(counts, 3)
+    np.testing.assert_allclose(mean, np.mean(ref, axis=0), atol=1e-12)
+    np.testing.assert_allclose(std_err, np.std(ref, axis=0, ddof=1)/np.sqrt(3), atol=1e-12)
+
+
+def test_replicates_merge(tmp_path):
+    n_traj, size = 12, 4
+    times, pops = trajectories(n_traj, 10, 2, seed=2)
+    agg = ReplicateAggregator(str(tmp_path/'pops.npy'), size, dt=DT)
+    for k, traj in enumerate(pops):
+        agg.add(k, times, traj)
+    agg.flush()
+
+    rep_means = np.mean(with_total(pops).reshape(n_traj//size, size, len(times), -1), axis=1)
+    t, mean, std_err, counts = agg.query()
+    np.testing.assert_allclose(t, times)
+    np.testing.assert_array_equal(counts, n_traj)
+    np.testing.assert_allclose(mean, np.mean(rep_means, axis=0), atol=1e-13)
+    np.testing.assert_allclose(std_err, np.std(rep_means, axis=0, ddof=1)/np.sqrt(n_traj//size), atol=1e-13)
+
+    #   reopened from the replicate files
+    merged = ReplicateAggregator(str(tmp_path/'pops.npy'), size, dt=DT).query()
+    np.testing.assert_allclose(merged[1], mean)
+    np.testing.assert_allclose(merged[2], std_err)
+
+
+def test_replicate_index_beyond_four_digits(tmp_path):
+    times, pops = trajectories(2, 5, 2, seed=3)
+    agg = ReplicateAggregator(str(tmp_path/'pops.npy'), 1, dt=DT)
+    agg.add(12345, times, pops[0])
+    agg.add(7, times, pops[1])
+    agg.flush()
+    assert (tmp_path/'pops_rep12345.npy').exists()
+
+    reopened = ReplicateAggregator(str(tmp_path/'pops.npy'), 1, dt=DT)
+    assert sorted(reopened._replicates) == [7, 12345]
+    np.testing.assert_allclose(reopened.query()[1], np.mean(with_total(pops), axis=0), atol=1e-13)
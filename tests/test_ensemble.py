@@ -0,0 +1,74 @@
+"""
+Initial conditions and QC failures of the lockstep ensemble
+"""
+import numpy as np
+import pytest
+import subroutines as S
+import ensemble as E
+from sampling import write_bank
+
+
+@pytest.fixture(scope='module')
+def normal_modes():
+    amu_mat, xyz_ang, frq, redmas, L, U, com_ang, AN_mat = S.get_geo_hess()
+    return S.get_normal_geo(U, xyz_ang, amu_mat), frq
+
+
+def test_sample_ensemble_uses_input_seed(normal_modes):
+    normal_geo, frq = normal_modes
+    q, p = E.sample_ensemble(4, normal_geo, frq)
+    coords = S.sample_initial_conditions(normal_geo, frq, np.arange(4), 1)
+    np.testing.assert_array_equal(q, coords[:, 0])
+    np.testing.assert_array_equal(p, coords[:, 1])
+
+
+def test_sample_ensemble_checks_bank(normal_modes, tmp_path, monkeypatch):
+    normal_geo, frq = normal_modes
+    coords = S.sample_initial_conditions(normal_geo, frq, np.arange(4), 5)
+    bank_loc = str(tmp_path/'bank.npz')
+    monkeypatch.setattr(S, 'init_cond_bank', bank_loc)
+    monkeypatch.setattr(E, 'init_cond_bank', bank_loc)
+
+    write_bank(bank_loc, coords, np.arange(4), 5, S.sampling, S.nel, S.init_state, S.temp)
+    q, p = E.sample_ensemble(4, normal_geo, frq)
+    np.testing.assert_array_equal(q, coords[:, 0])
+
+    write_bank(bank_loc, coords, np.arange(4), 5, S.sampling, S.nel + 1, S.init_state, S.temp)
+    with pytest.raises(ValueError):
+        E.sample_ensemble(4, normal_geo, frq)
+
+
+class StubTCRunner():
+    '''
+        `run_TC_batch` with one good frame, one failed frame and one frame
+        without its NAC jobs
+    '''
+    def __init__(self, frames):
+        self._frames = frames
+
+    def run_TC_batch(self, geoms, traj_ids):
+        return [self._frames[k] for k in traj_ids]
+
+
+def tc_frame(pairs):
+    from qcRunners.TCResults import TCFrameResult
+    atoms = ['H']*S.natom
+    frame = TCFrameResult(list(range(S.nel)), S.natom)
+    for s in range(S.nel):
+        frame.add_job({'run': 'gradient', 'cistarget': s, 'atoms': atoms, 'energy': [0.1*i for i in range(S.nel)],
+                       'gradient': np.full((S.natom, 3), 0.01*s)})
+    for i, j in pairs:
+        frame.add_job({'run': 'coupling', 'nacstate1': i, 'nacstate2': j, 'atoms': atoms, 'nacme': np.ones((S.natom, 3))})
+    return frame, {'gradient_0': 1.0}
+
+
+def test_tc_batch_failures_are_per_trajectory():
+    all_pairs = [(i, j) for i in range(S.nel) for j in range(i + 1, S.nel)]
+    frames = [tc_frame(all_pairs), (None, {}), tc_frame(all_pairs[:1])]
+    qc = E.TCBatchRunner.__new__(E.TCBatchRunner)
+    qc._runner = StubTCRunner(frames)
+
+    elecE, grad, nac, trans_dips, failed, jobs_data, timings = qc.compute(np.zeros((3, S.nnuc)), [0, 1, 2])
+    np.testing.assert_array_equal(failed, [False, True, True])
+    np.testing.assert_allclose(elecE[0], [0.1*i for i in range(S.nel)])
+    assert len(jobs_data) == len(timings) == 3
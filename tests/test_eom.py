@@ -0,0 +1,106 @@
+"""
+The vectorized equations of motion against the original per-pair loops
+"""
+import tracemalloc
+import numpy as np
+import pytest
+import subroutines as S
+
+nel, nnuc, ndof = S.nel, S.nnuc, S.ndof
+
+
+def loop_derivatives(au_mas, q, p, nac, grad, elecE):
+    der = np.zeros((2, ndof))
+    for i in range(nel):
+        xdpm, pdpm, sum_DE = 0, 0, 0
+        for j in range(nel):
+            if j != i:
+                xdpm += q[j] * np.matmul(nac[j, i, :], p[nel:]/au_mas)
+                pdpm += p[j] * np.matmul(nac[j, i, :], p[nel:]/au_mas)
+                sum_DE += elecE[i] - elecE[j]
+        der[0, i] = (1.0/nel) * p[i] * sum_DE + xdpm
+        der[1, i] = -(1.0/nel) * q[i] * sum_DE + pdpm
+    for n in range(nnuc):
+        der[0, nel+n] = p[nel+n]/au_mas[n]
+        sum_dEdR, p2x2_DdEdR, ppxx_DEnac = 0, 0, 0
+        for i in range(nel):
+            sum_dEdR += grad[i, n]
+            for j in range(i + 1, nel):
+                p2x2_DdEdR += (p[i]**2 - p[j]**2 + q[i]**2 - q[j]**2) * (grad[i, n] - grad[j, n])
+                ppxx_DEnac += (p[i]*p[j] + q[i]*q[j]) * (elecE[j] - elecE[i]) * nac[i, j, n]
+        der[1, nel+n] = -(1.0/nel) * sum_dEdR - (0.5/nel) * p2x2_DdEdR - ppxx_DEnac
+    return der
+
+
+def loop_energy(au_mas, q, p, elecE):
+    p2m_sum = sum(p[nel+n]**2/au_mas[n] for n in range(nnuc))
+    p2x2_DE = 0
+    for i in range(nel):
+        for j in range(i + 1, nel):
+            p2x2_DE += (p[i]**2 - p[j]**2 + q[i]**2 - q[j]**2) * (elecE[i] - elecE[j])
+    return 0.5*p2m_sum + (1.0/nel)*sum(elecE) + (0.5/nel)*p2x2_DE
+
+
+def random_inputs(rng, batch=()):
+    au_mas = rng.uniform(2000.0, 30000.0, nnuc)
+    q = rng.normal(size=batch + (ndof,))
+    p = rng.normal(size=batch + (ndof,))
+    #   NACs are not assumed antisymmetric or with a zero diagonal
+    nac = rng.normal(size=batch + (nel, nel, nnuc))
+    grad = rng.normal(size=batch + (nel, nnuc))
+    elecE = rng.normal(size=batch + (nel,))
+    return au_mas, q, p, nac, grad, elecE
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_derivatives_match_loops(seed):
+    au_mas, q, p, nac, grad, elecE = random_inputs(np.random.default_rng(seed))
+    np.testing.assert_allclose(S.get_derivatives(au_mas, q, p, nac, grad, elecE),
+                               loop_derivatives(au_mas, q, p, nac, grad, elecE), rtol=1e-12, atol=1e-14)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_energy_matches_loops(seed):
+    au_mas, q, p, nac, grad, elecE = random_inputs(np.random.default_rng(seed))
+    assert S.get_energy(au_mas, q, p, elecE) == pytest.approx(loop_energy(au_mas, q, p, elecE), rel=1e-12)
+
+
+@pytest.mark.parametrize('batch', [(4,), (2, 3)])
+def test_batched_matches_loops(batch):
+    au_mas, q, p, nac, grad, elecE = random_inputs(np.random.default_rng(7), batch)
+    der = S.get_derivatives(au_mas, q, p, nac, grad, elecE)
+    energy = S.get_energy(au_mas, q, p, elecE)
+    assert der.shape == batch + (2, ndof)
+    assert energy.shape == batch
+    for k in np.ndindex(*batch):
+        np.testing.assert_allclose(der[k], loop_derivatives(au_mas, q[k], p[k], nac[k], grad[k], elecE[k]), rtol=1e-12, atol=1e-14)
+        assert energy[k] == pytest.approx(loop_energy(au_mas, q[k], p[k], elecE[k]), rel=1e-12)
+
+
+def test_writes_into_out():
+    au_mas, q, p, nac, grad, elecE = random_inputs(np.random.default_rng(3))
+    out = np.full((2, ndof), np.nan)
+    assert S.get_derivatives(au_mas, q, p, nac, grad, elecE, out=out) is out
+    np.testing.assert_allclose(out, loop_derivatives(au_mas, q, p, nac, grad, elecE), rtol=1e-12, atol=1e-14)
+
+    #   a strided view, as used by the Runge-Kutta stage buffers
+    stages = np.zeros((3, 2*ndof))
+    S.get_derivatives(au_mas, q, p, nac, grad, elecE, out=stages[1].reshape(2, ndof))
+    np.testing.assert_allclose(stages[1].reshape(2, ndof), out)
+    assert not np.any(stages[0]) and not np.any(stages[2])
+
+
+def test_no_allocation_per_call():
+    M = 256
+    au_mas, q, p, nac, grad, elecE = random_inputs(np.random.default_rng(4), (M,))
+    out = np.empty((M, 2, ndof))
+    S.get_derivatives(au_mas, q, p, nac, grad, elecE, out=out)
+    tracemalloc.start()
+    try:
+        for _ in range(10):
+            S.get_derivatives(au_mas, q, p, nac, grad, elecE, out=out)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    #   only numpy's fixed bookkeeping: less than one (M, nel, nel) temporary
+    assert peak < M*nel*nel*8
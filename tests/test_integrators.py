@@ -0,0 +1,126 @@
+"""
+Butcher tableaus and one-step integrators on problems with known solutions
+"""
+import numpy as np
+import pytest
+from integrators import TABLEAUS, ButcherTableau, ExplicitRK, ScipyRK45, SplitStep, MultipleTimeStep, get_integrator
+
+#   damped oscillator y' = A y, solved exactly by its eigen-decomposition
+A = np.array([[0.0, 1.0], [-1.0, -0.1]])
+Y0 = np.array([1.0, 0.0])
+
+
+def exact(t):
+    w, v = np.linalg.eig(A)
+    return np.real(v @ (np.exp(w*t) * np.linalg.solve(v, Y0)))
+
+
+def f(y, out):
+    np.matmul(A, y, out=out)
+
+
+def integrate(integrator, h, t_end=2.0):
+    y = Y0.copy()
+    for _ in range(int(round(t_end/h))):
+        integrator.step(f, y, h, out=y)
+    return y
+
+
+@pytest.mark.parametrize('name', TABLEAUS)
+def test_tableau_consistency(name):
+    tab = TABLEAUS[name]
+    assert np.allclose(np.tril(tab.a, -1), tab.a)
+    np.testing.assert_allclose(tab.a.sum(axis=1), tab.c, atol=1e-14)
+    assert tab.b.sum() == pytest.approx(1.0)
+    #   order conditions up to third order
+    assert tab.b @ tab.c == pytest.approx(1/2)
+    if tab.order >= 3:
+        assert tab.b @ tab.c**2 == pytest.approx(1/3)
+        assert tab.b @ tab.a @ tab.c == pytest.approx(1/6)
+    if tab.order >= 4:
+        assert tab.b @ tab.c**3 == pytest.approx(1/4)
+        assert tab.b @ (tab.c * (tab.a @ tab.c)) == pytest.approx(1/8)
+        assert tab.b @ tab.a @ tab.c**2 == pytest.approx(1/12)
+        assert tab.b @ tab.a @ tab.a @ tab.c == pytest.approx(1/24)
+    if tab.embedded:
+        assert tab.e.sum() == pytest.approx(0.0, abs=1e-14)
+
+
+@pytest.mark.parametrize('name', TABLEAUS)
+def test_convergence_order(name):
+    order = TABLEAUS[name].order
+    errors = [np.max(np.abs(integrate(ExplicitRK(name, 2), h) - exact(2.0))) for h in [0.1, 0.05]]
+    assert np.log2(errors[0]/errors[1]) == pytest.approx(order, abs=0.3)
+
+
+@pytest.mark.parametrize('name', ['bs32', 'dopri5'])
+def test_embedded_error_and_tolerance(name):
+    rk = ExplicitRK(name, 2)
+    y = rk.step(f, Y0, 0.2)
+    assert 0.0 < rk.last_error < 1e-2
+    assert 'RK_Error' in rk.get_step_stats()
+
+    #   a tight tolerance splits the step, and the result gets closer to the exact one
+    tight = ExplicitRK(name, 2, tol=1e-3*rk.last_error)
+    y_tight = tight.step(f, Y0, 0.2)
+    assert tight.last_substeps > 1
+    assert tight.last_error <= 1e-3*rk.last_error
+    assert np.max(np.abs(y_tight - exact(0.2))) < np.max(np.abs(y - exact(0.2)))
+
+
+def test_rk4_stats_and_errors():
+    rk = get_integrator('RK4', 2)
+    assert isinstance(rk, ExplicitRK) and rk.tableau is TABLEAUS['rk4']
+    integrate(rk, 0.5)
+    assert rk.n_steps == 4 and rk.n_evals == 16 and rk.last_evals == 4
+    assert 'RK_Error' not in rk.get_step_stats()
+
+    with pytest.raises(ValueError):
+        ExplicitRK('rk5', 2)
+    with pytest.raises(ValueError):
+        ExplicitRK('rk4', 2, tol=1e-6)
+
+
+def test_user_tableau():
+    euler = ButcherTableau('euler', a=[[0.0]], b=[1.0], c=[0.0], order=1)
+    y = ExplicitRK(euler, 2).step(f, Y0, 0.1)
+    np.testing.assert_allclose(y, Y0 + 0.1*A @ Y0)
+
+
+def test_scipy_rk45_matches_dopri5():
+    scipy_rk = get_integrator('scipy', 2)
+    assert isinstance(scipy_rk, ScipyRK45)
+    y = integrate(scipy_rk, 0.5)
+    np.testing.assert_allclose(y, exact(2.0), atol=1e-8)
+    np.testing.assert_allclose(y, integrate(ExplicitRK('dopri5', 2, tol=1e-12), 0.5), atol=1e-8)
+
+
+def test_split_step():
+    def exact_step(y, h, out):
+        out[:] = exact(h) if np.array_equal(y, Y0) else np.nan
+        return 3
+
+    split = get_integrator('split', 2)
+    assert isinstance(split, SplitStep)
+    np.testing.assert_allclose(split.step(exact_step, Y0, 0.3), exact(0.3))
+    assert split.get_step_stats()['RK_Evals'] == 3
+
+
+def test_multiple_time_step_resolves_changing_derivative():
+    '''
+        y' = g(t) with g changing within the step: the sub-steps see it at
+        their midpoints
+    '''
+    def f_at(s):
+        def f(y, out):
+            out[:] = s
+        return f
+
+    mts = MultipleTimeStep(ExplicitRK('rk4', 1), 4)
+    y = mts.step(f_at, np.zeros(1), 2.0)
+    #   integral of g(t) = t/2 over [0, 2], exact for the midpoint sub-steps
+    assert y[0] == pytest.approx(1.0)
+    mts.step(f_at, y, 2.0, out=y)
+    stats = mts.get_step_stats()
+    assert stats['RK_Evals'] == 2*4*4
+    assert mts.get_step_stats()['RK_Evals'] == 0
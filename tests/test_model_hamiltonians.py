@@ -0,0 +1,143 @@
+"""
+Analytic model Hamiltonians: derivatives against finite differences and the
+adiabatic quantities returned by `ModelRunner`
+"""
+import numpy as np
+import pytest
+import subroutines as S
+from model_hamiltonians import LVCModel, TullyModel, ModelRunner, build_model, load_model
+
+N_MODES, NNUC = 4, 6
+FRQ = np.array([0.004, 0.007, 0.011, 0.016])
+
+
+def random_lvc(seed=0, quadratic=False):
+    rng = np.random.default_rng(seed)
+    gamma = 1e-4*rng.normal(size=(3, N_MODES, N_MODES)) if quadratic else None
+    return LVCModel(FRQ, [0.0, 0.03, 0.05], 0.003*rng.normal(size=(3, N_MODES)),
+                    0.002*rng.normal(size=(3, 3, N_MODES)), gamma)
+
+
+def random_runner(model, seed=1):
+    rng = np.random.default_rng(seed)
+    #   orthonormal mass-weighted modes as rows
+    modes = np.linalg.qr(rng.normal(size=(NNUC, NNUC)))[0][:model.n_modes]
+    au_mas = rng.uniform(2000.0, 30000.0, NNUC)
+    return ModelRunner(model, modes, au_mas, rng.normal(size=model.n_modes))
+
+
+MODELS = {
+    'lvc': lambda: random_lvc(),
+    'qvc': lambda: random_lvc(quadratic=True),
+    'spin_boson': lambda: build_model('spin_boson', FRQ, epsilon=0.002, delta=0.004, xi=0.3),
+    'tully1': lambda: build_model('tully1', FRQ, x0=0.3),
+    'tully2': lambda: build_model('tully2', FRQ, x0=-0.2),
+    'tully3': lambda: build_model('tully3', FRQ, x0=0.4),
+}
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_diabatic_derivatives(name):
+    model = MODELS[name]()
+    dQ = np.random.default_rng(2).normal(size=model.n_modes)*10.0
+    W, dW = model.diabatic(dQ)
+    np.testing.assert_allclose(W, W.T)
+    h = 1e-4
+    for k in range(model.n_modes):
+        step = np.eye(model.n_modes)[k]*h
+        fd = (model.diabatic(dQ + step)[0] - model.diabatic(dQ - step)[0])/(2*h)
+        np.testing.assert_allclose(dW[..., k], fd, atol=1e-9)
+
+
+def runner_states(runner, qCart):
+    '''
+        Adiabatic states with the phase convention of `ModelRunner.compute`
+    '''
+    dQ = (qCart*runner.sqrt_mas) @ runner.modes.T - runner.Q0
+    U = np.linalg.eigh(runner.model.diabatic(dQ)[0])[1]
+    big = np.argmax(np.abs(U), axis=0)
+    return U*np.sign(U[big, np.arange(len(U))])
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_adiabatic_gradients_and_nacs(name):
+    runner = random_runner(MODELS[name]())
+    qCart = np.random.default_rng(3).normal(size=NNUC)*0.05
+    elecE, grad, nac, trans_dips = runner.compute(qCart)
+    U = runner_states(runner, qCart)
+
+    h = 1e-5
+    for x in range(NNUC):
+        step = np.eye(NNUC)[x]*h
+        E_p, E_m = runner.compute(qCart + step)[0], runner.compute(qCart - step)[0]
+        np.testing.assert_allclose(grad[:, x], (E_p - E_m)/(2*h), rtol=1e-5, atol=1e-10)
+        #   nac[i, j] = <i|d/dR j>
+        dU = (runner_states(runner, qCart + step) - runner_states(runner, qCart - step))/(2*h)
+        fd = U.T @ dU
+        np.fill_diagonal(fd, 0.0)
+        np.testing.assert_allclose(nac[..., x], fd, rtol=1e-4, atol=1e-8)
+    np.testing.assert_allclose(nac, -nac.transpose(1, 0, 2), atol=1e-14)
+    np.testing.assert_allclose(trans_dips, trans_dips.transpose(1, 0, 2))
+
+
+def test_batched_matches_single():
+    runner = random_runner(random_lvc(quadratic=True))
+    qCart = np.random.default_rng(4).normal(size=(2, 3, NNUC))*0.05
+    batch = runner.compute(qCart)
+    assert runner.n_calls == 6
+    for k in np.ndindex(2, 3):
+        for a, b in zip(batch, runner.compute(qCart[k])):
+            np.testing.assert_allclose(a[k], b, atol=1e-15)
+
+
+def test_reference_geometry():
+    '''
+        At the reference geometry the adiabatic states are the diabatic ones
+    '''
+    model = random_lvc()
+    runner = random_runner(model)
+    qCart = (runner.Q0 @ runner.modes)/runner.sqrt_mas
+    elecE, grad, nac, trans_dips = runner.compute(qCart)
+    np.testing.assert_allclose(elecE, [0.0, 0.03, 0.05], atol=1e-15)
+    #   default dipoles: 1 a.u. along z between every pair of states
+    np.testing.assert_allclose(trans_dips[..., 2], 1.0 - np.eye(3), atol=1e-14)
+    np.testing.assert_allclose(grad, (model.kappa*np.sqrt(FRQ)) @ runner.modes*runner.sqrt_mas, atol=1e-14)
+
+
+def test_tully1_asymptotes():
+    model = TullyModel('tully1', FRQ, mode=0, mass=2000.0)
+    x = np.array([-20.0, 20.0])
+    dQ = np.zeros((2, N_MODES))
+    dQ[:, 0] = x*np.sqrt(2000.0)
+    W = model.diabatic(dQ)[0]
+    np.testing.assert_allclose(W[:, 0, 0], [-0.01, 0.01], atol=1e-12)
+    np.testing.assert_allclose(W[:, 0, 1], 0.0, atol=1e-12)
+
+
+def test_build_and_load(tmp_path):
+    with pytest.raises(ValueError):
+        build_model('morse', FRQ)
+    with pytest.raises(ValueError):
+        TullyModel('tully4', FRQ)
+    with pytest.raises(ValueError):
+        ModelRunner(random_lvc(), np.eye(NNUC)[:3], np.ones(NNUC), np.zeros(3))
+
+    model = random_lvc(quadratic=True)
+    dipoles = np.random.default_rng(5).normal(size=(3, 3, 3))
+    model.save(str(tmp_path/'qvc.npz'), dipoles, order=2)
+    loaded, loaded_dipoles = load_model(str(tmp_path/'qvc.npz'))
+    dQ = np.random.default_rng(6).normal(size=N_MODES)
+    np.testing.assert_allclose(loaded.diabatic(dQ)[0], model.diabatic(dQ)[0])
+    np.testing.assert_allclose(loaded_dipoles, dipoles)
+
+
+def test_run_model_settings():
+    '''
+        The runner of QC_RUNNER = 'model' in the ethylene normal modes
+    '''
+    runner = S.get_model_runner()
+    elecE, grad, nac, trans_dips, timings = S.run_model(runner.Q0 @ runner.modes/runner.sqrt_mas)
+    assert elecE.shape == (S.nel,) and grad.shape == (S.nel, S.nnuc) and nac.shape == (S.nel, S.nel, S.nnuc)
+    #   the modes of the Hessian file are orthonormal to its printed precision
+    np.testing.assert_allclose(elecE, S.model_params['energies'], atol=1e-5)
+    assert list(timings) == ['model']
@@ -0,0 +1,63 @@
+"""
+Electronic sub-steps with the QC results interpolated in time (`mts_substeps`)
+"""
+import numpy as np
+import pytest
+import subroutines as S
+
+nel, nnuc, ndof = S.nel, S.nnuc, S.ndof
+
+
+def random_es(rng):
+    return rng.normal(size=nel), rng.normal(size=(nel, nnuc)), rng.normal(size=(nel, nel, nnuc))
+
+
+def derivative(f, y):
+    der = np.empty(2*ndof)
+    f(y, der)
+    return der
+
+
+@pytest.mark.parametrize('s0, ds, s', [(0.0, 1.0, 0.25), (0.0, 1.0, 1.0), (1.0, 0.5, 0.5)])
+def test_interpolated_derivative(s0, ds, s):
+    rng = np.random.default_rng(0)
+    au_mas = rng.uniform(2000.0, 30000.0, nnuc)
+    es0, es1 = random_es(rng), random_es(rng)
+    y = rng.normal(size=2*ndof)
+
+    #   the sub-step at s sees the electronic structure at x = s0 + ds*s, extrapolated beyond 1
+    x = s0 + ds*s
+    es = [(1 - x)*a + x*b for a, b in zip(es0, es1)]
+    expected = S.get_derivatives(au_mas, y[:ndof], y[ndof:], es[2], es[1], es[0]).ravel()
+    np.testing.assert_allclose(derivative(S.get_mts_deriv(au_mas, es0, es1, s0, ds)(s), y), expected, rtol=1e-12)
+
+
+def test_frozen_sub_steps_match_plain_step():
+    rng = np.random.default_rng(1)
+    au_mas = rng.uniform(2000.0, 30000.0, nnuc)
+    es = random_es(rng)
+    y = rng.normal(size=2*ndof)
+    f_at = S.get_mts_deriv(au_mas, es, es)
+    for s in [0.0, 0.3, 1.0]:
+        np.testing.assert_allclose(derivative(f_at(s), y), derivative(S.get_frozen_step(au_mas, *es), y), rtol=1e-13, atol=1e-15)
+
+
+def max_error(result, ref):
+    times, coords = result
+    idx = np.searchsorted(ref[0], times - 1e-8)
+    np.testing.assert_allclose(ref[0][idx], times)
+    return np.max(np.abs(coords - ref[1][..., idx]))
+
+
+def test_sub_steps_remove_frozen_error(run_rk4):
+    '''
+        With frozen QC results the error is first order in the step; the
+        interpolated sub-steps make it second order and much smaller
+    '''
+    ref = run_rk4(0.25, 20.0, mts_substeps=4)
+    frozen = [max_error(run_rk4(H, 20.0), ref) for H in [4.0, 2.0]]
+    mts = [max_error(run_rk4(H, 20.0, mts_substeps=8), ref) for H in [4.0, 2.0]]
+
+    assert frozen[0]/frozen[1] == pytest.approx(2.0, rel=0.25)
+    assert mts[0]/mts[1] > 3.0
+    assert mts[0] < 0.05*frozen[0]
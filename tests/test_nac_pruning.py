@@ -0,0 +1,127 @@
+"""
+TeraChem frame results: ownership of their arrays and transition dipoles
+of frames with pruned NAC pairs
+"""
+import numpy as np
+import pytest
+from qcRunners.TCResults import TCFrameResult, _pair_index
+from nac_pruning import NACPruner
+import subroutines as S
+
+N_ATOMS = 2
+STATES = [0, 1, 2]
+
+
+def tdm_value(i, j):
+    return np.array([i + 1.0, j + 1.0, 0.5])
+
+
+def frame_jobs(pairs):
+    '''
+        Gradient jobs of all states and coupling jobs of `pairs`, each with
+        the CIS transition dipoles of all state pairs
+    '''
+    n = len(STATES)
+    tdms = [None]*(n*(n - 1)//2)
+    for i in range(n):
+        for j in range(i + 1, n):
+            tdms[_pair_index(i, j, n)] = tdm_value(i, j)
+    atoms = ['H']*N_ATOMS
+    jobs = [{'run': 'gradient', 'cistarget': s, 'atoms': atoms, 'energy': [0.0, 0.1, 0.2],
+             'gradient': np.full((N_ATOMS, 3), 0.01*s)} for s in STATES]
+    for i, j in pairs:
+        jobs.append({'run': 'coupling', 'nacstate1': i, 'nacstate2': j, 'atoms': atoms,
+                     'nacme': np.full((N_ATOMS, 3), 0.1*(i + j)), 'cis_transition_dipoles': tdms})
+    return jobs
+
+
+def test_complete_frame_has_trans_dips():
+    frame = TCFrameResult.from_jobs(frame_jobs([(0, 1), (0, 2), (1, 2)]))
+    _, _, _, trans_dips = frame.lsc_ivr()
+    assert trans_dips is not None
+    np.testing.assert_allclose(trans_dips[0, 2], tdm_value(0, 2))
+    np.testing.assert_allclose(trans_dips[2, 0], tdm_value(0, 2))
+
+
+def test_pruned_frame_keeps_partial_trans_dips():
+    frame = TCFrameResult.from_jobs(frame_jobs([(0, 1), (1, 2)]))
+    with pytest.raises(RuntimeError):
+        frame.lsc_ivr()
+    _, _, nac, trans_dips = frame.lsc_ivr(allow_missing=True)
+    assert trans_dips is not None
+    assert not frame.has_trans_dip[0, 2] and frame.has_trans_dip[1, 2]
+    np.testing.assert_allclose(trans_dips[1, 2], tdm_value(1, 2))
+    assert not np.any(nac[0, 2])
+
+
+def history(n_states, n_nuc, tdm_last, tdm_prev):
+    nac_hist = np.zeros((n_states, n_states, n_nuc, 2))
+    tdm_hist = np.stack([tdm_prev, tdm_last], axis=-1)
+    return nac_hist, tdm_hist
+
+
+def test_pruner_fills_only_skipped_trans_dips():
+    n = len(STATES)
+    frame = TCFrameResult.from_jobs(frame_jobs([(0, 1), (1, 2)]))
+    elecE, _, nac, trans_dips = frame.lsc_ivr(allow_missing=True)
+    nac_hist, tdm_hist = history(n, 3*N_ATOMS, np.full((n, n, 3), 2.0), np.full((n, n, 3), 1.0))
+
+    pruner = NACPruner(n, gap_threshold=0.01)
+    pruner._skip = [(0, 2)]
+    nac, trans_dips = pruner.update(elecE, nac, trans_dips, nac_hist, tdm_hist, frame.has_trans_dip)
+    #   the skipped pair is extrapolated, the computed ones are kept
+    np.testing.assert_allclose(trans_dips[0, 2], 3.0)
+    np.testing.assert_allclose(trans_dips[2, 0], 3.0)
+    np.testing.assert_allclose(trans_dips[0, 1], tdm_value(0, 1))
+    np.testing.assert_allclose(trans_dips[1, 2], tdm_value(1, 2))
+
+
+def test_pruner_drops_incomplete_trans_dips():
+    n = len(STATES)
+    frame = TCFrameResult.from_jobs(frame_jobs([(0, 1), (1, 2)]))
+    elecE, _, nac, trans_dips = frame.lsc_ivr(allow_missing=True)
+    nac_hist, tdm_hist = history(n, 3*N_ATOMS, np.zeros((n, n, 3)), np.zeros((n, n, 3)))
+
+    #   (0, 2) is missing but was not skipped by the policy
+    pruner = NACPruner(n, gap_threshold=0.01)
+    _, trans_dips = pruner.update(elecE, nac, trans_dips, nac_hist, tdm_hist, frame.has_trans_dip)
+    assert trans_dips is None
+
+
+def test_unknown_time_saved(capsys):
+    n = len(STATES)
+    frame = TCFrameResult.from_jobs(frame_jobs([(0, 1), (0, 2), (1, 2)]))
+    nac_hist, tdm_hist = history(n, 3*N_ATOMS, np.zeros((n, n, 3)), np.zeros((n, n, 3)))
+    pruner = NACPruner(n, gap_threshold=0.01)
+    for time_saved in [1.5, None]:
+        pruner._skip = [(0, 2)]
+        pruner.set_time_saved(time_saved)
+        elecE, _, nac, trans_dips = frame.lsc_ivr()
+        pruner.update(elecE, nac, trans_dips, nac_hist, tdm_hist)
+    assert np.isnan(pruner.get_stats()['NAC_Time_Saved'])
+    assert pruner.time_saved == 1.5 and pruner.n_time_unknown == 1
+    pruner.print_summary()
+    assert 'unknown in 1 frames' in capsys.readouterr().out
+
+
+class StubTCRunner():
+    def __init__(self, frame):
+        self.frame = frame
+
+    def run_TC_new_geom(self, geom):
+        return self.frame, {'gradient_0': 1.0}
+
+
+def test_run_TC_cached_returns_copies(monkeypatch):
+    monkeypatch.setattr(S, '_qc_cache', None)
+    frame = TCFrameResult.from_jobs(frame_jobs([(0, 1), (0, 2), (1, 2)]))
+    nacs, trans_dips = frame.nacs.copy(), frame.trans_dips.copy()
+
+    elecE, grad, nac, tdm, job_results, _ = S.run_TC_cached(StubTCRunner(frame), np.zeros(3*N_ATOMS))
+    assert job_results is frame
+    nac *= -1.0
+    tdm *= -1.0
+    grad[:] = 0.0
+    np.testing.assert_array_equal(frame.nacs, nacs)
+    np.testing.assert_array_equal(frame.trans_dips, trans_dips)
+    assert np.any(frame.grads)
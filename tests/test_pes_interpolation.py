@@ -0,0 +1,125 @@
+"""
+Trust-radius interpolation of QC results, with the model runner as the QC code
+"""
+import numpy as np
+import pytest
+import subroutines as S
+from pes_interpolation import PESInterpolator
+
+
+@pytest.fixture(scope='module')
+def model():
+    runner = S.get_model_runner()
+    x0 = runner.Q0 @ runner.modes/runner.sqrt_mas
+    return runner, x0
+
+
+def fill(interp, runner, points):
+    for x in points:
+        interp.add(x, *runner.compute(x))
+
+
+def cloud(x0, n, size, seed=0):
+    return x0 + size*np.random.default_rng(seed).normal(size=(n, len(x0)))
+
+
+def cosine(a, b):
+    '''
+        Cosine between the vectors of every off-diagonal state pair
+    '''
+    off = ~np.eye(len(a), dtype=bool)
+    return np.sum(a*b, axis=-1)[off]/(np.linalg.norm(a, axis=-1)*np.linalg.norm(b, axis=-1))[off]
+
+
+def test_exact_at_points_and_conservative(model):
+    runner, x0 = model
+    interp = PESInterpolator(radius=0.1)
+    fill(interp, runner, cloud(x0, 6, 0.01))
+
+    stored = interp._geoms[2]
+    values, error = interp.interpolate(stored)
+    assert error == 0.0
+    np.testing.assert_allclose(values[0], runner.compute(stored)[0])
+
+    #   the gradients are the derivatives of the interpolated energies
+    x = x0 + 0.005*np.random.default_rng(1).normal(size=len(x0))
+    (elecE, grad, nac, trans_dips), error = interp.interpolate(x)
+    h = 1e-6
+    for n in range(0, len(x0), 5):
+        step = np.eye(len(x0))[n]*h
+        fd = (interp.interpolate(x + step)[0][0] - interp.interpolate(x - step)[0][0])/(2*h)
+        np.testing.assert_allclose(grad[:, n], fd, rtol=1e-5, atol=1e-9)
+
+
+def test_accuracy_and_error_estimate(model):
+    runner, x0 = model
+    interp = PESInterpolator(radius=0.1)
+    fill(interp, runner, cloud(x0, 10, 0.01))
+    x = x0 + 0.005*np.random.default_rng(2).normal(size=len(x0))
+    (elecE, grad, nac, trans_dips), error = interp.interpolate(x)
+    exact = runner.compute(x)
+    true_error = np.max(np.abs(elecE - exact[0]))
+    assert 0.0 < error < 1e-3
+    assert true_error < 10*error
+    assert np.all(cosine(nac, exact[2]) > 0.95)
+
+
+def test_nac_signs_are_aligned(model):
+    runner, x0 = model
+    interp = PESInterpolator(radius=0.1)
+    points = cloud(x0, 4, 0.01, seed=3)
+    for k, x in enumerate(points):
+        elecE, grad, nac, trans_dips = runner.compute(x)
+        if k % 2:
+            #   a different phase of state 1
+            nac[1, :], nac[:, 1] = -nac[1, :], -nac[:, 1]
+            trans_dips[1, :], trans_dips[:, 1] = -trans_dips[1, :], -trans_dips[:, 1]
+        interp.add(x, elecE, grad, nac, trans_dips)
+    #   all points have comparable weights
+    x = np.mean(points, axis=0)
+    (_, _, nac, trans_dips), _ = interp.interpolate(x)
+    exact = runner.compute(x)
+    #   the phases are those of the nearest point; without the alignment the average would cancel
+    assert np.all(np.abs(cosine(nac, exact[2])) > 0.95)
+    assert np.all(np.abs(cosine(trans_dips, exact[3])) > 0.95)
+    np.testing.assert_allclose(np.linalg.norm(nac, axis=-1), np.linalg.norm(exact[2], axis=-1), rtol=0.05)
+
+
+def test_query_policy(model):
+    runner, x0 = model
+    interp = PESInterpolator(radius=0.1, tol=1.0, max_skip=2, min_points=3)
+    assert interp.query(x0) is None
+    fill(interp, runner, cloud(x0, 2, 0.01))
+    #   too few points in range
+    assert interp.query(x0 + 0.001) is None
+    interp.add(x0 + 0.001, *runner.compute(x0 + 0.001))
+    assert interp.query(x0 + 0.2) is None
+    interp.add(x0 + 0.2, *runner.compute(x0 + 0.2))
+
+    #   at most max_skip interpolated steps in a row
+    assert interp.query(x0 + 0.002) is not None
+    assert interp.query(x0 + 0.003) is not None
+    assert interp.query(x0 + 0.004) is None
+    interp.add(x0 + 0.004, *runner.compute(x0 + 0.004))
+    assert interp.get_stats()['PESQC_Error'] > 0.0
+    assert interp.query(x0 + 0.005) is not None
+    stats = interp.get_stats()
+    assert stats['PES_Interp'] == 1 and stats['PES_Saved'] == 3 and stats['PES_Points'] == 5
+
+    #   estimated error above tol
+    strict = PESInterpolator(radius=0.1, tol=1e-12)
+    fill(strict, runner, cloud(x0, 2, 0.01))
+    assert strict.query(x0 + 0.001) is None
+    assert strict.get_stats()['PES_Error'] > 1e-12
+
+
+def test_shared_file(model, tmp_path):
+    runner, x0 = model
+    file_loc = str(tmp_path/'pes.pkl')
+    first, second = PESInterpolator(file_loc=file_loc), PESInterpolator(file_loc=file_loc)
+    fill(first, runner, cloud(x0, 3, 0.01))
+    second.query(x0)
+    assert len(second) == 3
+    fill(second, runner, [x0])
+    assert len(PESInterpolator(file_loc=file_loc)) == 4
+    np.testing.assert_allclose(PESInterpolator(file_loc=file_loc).interpolate(x0)[0][0], runner.compute(x0)[0])
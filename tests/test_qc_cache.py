@@ -0,0 +1,101 @@
+"""
+Geometry-keyed QC result cache
+"""
+import os
+import numpy as np
+from qc_cache import QCResultCache
+
+
+def results(rng):
+    return {'elecE': rng.normal(size=3), 'grad': rng.normal(size=(3, 18)), 'nac': rng.normal(size=(3, 3, 18)),
+            'trans_dips': None, 'times': ['gradient_0', 'nac_0_1']}
+
+
+def test_no_aliasing_with_callers():
+    rng = np.random.default_rng(0)
+    cache = QCResultCache(None)
+    geom, values = rng.normal(size=18), results(rng)
+    expected = {k: np.copy(v) for k, v in values.items() if isinstance(v, np.ndarray)}
+    cache.put(geom, {}, values)
+
+    #   the caller flips NAC signs in place after storing ...
+    values['nac'] *= -1.0
+    hit = cache.get(geom, {})
+    np.testing.assert_array_equal(hit['nac'], expected['nac'])
+    #   ... and after a hit
+    hit['nac'] *= -1.0
+    hit['times'].append('extra')
+    again = cache.get(geom, {})
+    np.testing.assert_array_equal(again['nac'], expected['nac'])
+    assert again['times'] == ['gradient_0', 'nac_0_1']
+    assert again['nac'] is not hit['nac']
+
+
+def test_key_tolerance_and_options():
+    rng = np.random.default_rng(1)
+    cache = QCResultCache(None, tol=1e-6)
+    geom = rng.normal(size=18)
+    cache.put(geom, {'method': 'hf'}, results(rng))
+    assert cache.get(geom + 1e-9, {'method': 'hf'}) is not None
+    assert cache.get(geom + 1e-3, {'method': 'hf'}) is None
+    assert cache.get(geom, {'method': 'pbe0'}) is None
+    assert cache.get_stats() == {'QC_Cache_Hits': 1, 'QC_Cache_Misses': 2}
+
+
+def test_store_reload_and_eviction(tmp_path):
+    rng = np.random.default_rng(2)
+    file_loc = str(tmp_path/'cache.pkl')
+    cache = QCResultCache(file_loc, max_entries=3)
+    geoms = [rng.normal(size=18) for _ in range(8)]
+    stored = []
+    for geom in geoms:
+        stored.append(results(rng))
+        cache.put(geom, {}, stored[-1])
+    assert cache.get(geoms[0], {}) is None
+
+    reloaded = QCResultCache(file_loc, max_entries=3)
+    for geom, values in zip(geoms[-3:], stored[-3:]):
+        np.testing.assert_array_equal(reloaded.get(geom, {})['grad'], values['grad'])
+    assert reloaded.get(geoms[-4], {}) is None
+
+
+def test_gamess_hit_skips_dat(monkeypatch):
+    import subroutines as S
+    rng = np.random.default_rng(3)
+    values = results(rng)
+    calls = {'gms': 0, 'dat': 0}
+
+    def run_gms_cas(*args):
+        calls['gms'] += 1
+
+    def read_gms_dat(input_name):
+        calls['dat'] += 1
+        return 0
+
+    monkeypatch.setattr(S, '_qc_cache', QCResultCache(None))
+    monkeypatch.setattr(S, 'run_gms_cas', run_gms_cas)
+    monkeypatch.setattr(S, 'read_gms_out', lambda input_name: (values['elecE'], values['grad'], values['nac'], np.zeros(3), 0))
+    monkeypatch.setattr(S, 'read_gms_dat', read_gms_dat)
+
+    geom = rng.normal(size=18)
+    expected = np.copy(values['nac'])
+    first = S.run_gms_cached('cas', {}, None, None, geom)
+    first[2][0, 1] *= -1.0
+    second = S.run_gms_cached('cas', {}, None, None, geom)
+    assert calls == {'gms': 1, 'dat': 1}
+    assert second[5] == 0
+    np.testing.assert_array_equal(second[2], expected)
+
+
+def test_file_is_resolved_with_the_input(tmp_path, monkeypatch):
+    '''
+        The cache is opened lazily, e.g. in a trajectory directory of a
+        lockstep ensemble; its file stays where the input was read
+    '''
+    import subroutines as S
+    assert os.path.isabs(S.qc_cache_file) and os.path.basename(S.qc_cache_file) == 'qc_cache.pkl'
+    monkeypatch.setattr(S, 'qc_cache', True)
+    monkeypatch.setattr(S, '_qc_cache', None)
+    os.makedirs(tmp_path/'traj_0000')
+    monkeypatch.chdir(tmp_path/'traj_0000')
+    assert S.get_qc_cache().file_loc == S.qc_cache_file
@@ -0,0 +1,126 @@
+"""
+Batched initial-condition sampling, randomized quasi-Monte Carlo and
+initial-condition banks
+"""
+import numpy as np
+import pytest
+from sampling import wigner_radius, electronic_radii, trajectory_rng, qmc_uniforms, rqmc_estimate, sample_batch, write_bank, InitialConditionBank
+
+N_STATES = 3
+QN0 = np.array([0.0, 0.5, -1.0])
+#   six zero modes, then the normal mode frequencies (a.u.)
+FRQ = np.concatenate((np.zeros(6), [0.005, 0.01, 0.02]))
+BETA = 1.0/(300*3.166811563e-6)
+
+
+def sample(indices, method='wigner', seed=7, **kwargs):
+    return sample_batch(indices, QN0, FRQ, N_STATES, 2, BETA, method, 0.0, seed, **kwargs)
+
+
+def test_independent_of_batch():
+    coords = sample(10)
+    assert coords.shape == (10, 2, N_STATES + len(QN0))
+    np.testing.assert_array_equal(sample([3, 7]), coords[[3, 7]])
+    np.testing.assert_array_equal(sample(np.arange(5, 10)), coords[5:])
+    assert not np.array_equal(sample(10, seed=8), coords)
+
+
+def test_trajectory_rng_matches_spawn():
+    children = np.random.SeedSequence(11).spawn(4)
+    for k in range(4):
+        assert trajectory_rng(11, k).random() == np.random.default_rng(children[k]).random()
+
+
+@pytest.mark.parametrize('method', ['wigner', 'sc', 'spin'])
+def test_electronic_radii(method):
+    coords = sample(50, method)
+    radii = np.hypot(coords[:, 0, :N_STATES], coords[:, 1, :N_STATES])
+    r_occ, r_other = electronic_radii(method, N_STATES)
+    np.testing.assert_allclose(radii[:, 1], r_occ)
+    np.testing.assert_allclose(radii[:, [0, 2]], r_other)
+
+
+def test_wigner_radius():
+    r2 = wigner_radius(N_STATES)**2
+    assert 2**(N_STATES + 1)*(r2 - 0.5)*np.exp(-(r2 + 0.5*(N_STATES - 1))) == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        electronic_radii('ehrenfest', N_STATES)
+
+
+def test_nuclear_distribution():
+    coords = sample(20000)
+    w = FRQ[6:]
+    coth = 1.0/np.tanh(BETA*w/2)
+    q, p = coords[:, 0, N_STATES:], coords[:, 1, N_STATES:]
+    np.testing.assert_allclose(np.mean(q, axis=0), QN0, atol=4*np.sqrt(coth/(2*w)/len(q)).max())
+    np.testing.assert_allclose(np.var(q, axis=0), coth/(2*w), rtol=0.05)
+    np.testing.assert_allclose(np.var(p, axis=0), w*coth/2, rtol=0.05)
+
+
+def test_bank_round_trip(tmp_path):
+    indices = np.arange(100, 110)
+    coords = sample(indices)
+    bank_loc = str(tmp_path/'bank.npz')
+    write_bank(bank_loc, coords, indices, 7, 'wigner', N_STATES, 2, 300.0)
+
+    bank = InitialConditionBank(bank_loc)
+    assert len(bank) == 10 and 105 in bank and 3 not in bank
+    assert (bank.seed, bank.method, bank.n_states, bank.qmc) == (7, 'wigner', N_STATES, '')
+    np.testing.assert_array_equal(bank[105], coords[5])
+    with pytest.raises(IndexError):
+        bank[3]
+
+
+@pytest.mark.parametrize('qmc', ['sobol', 'halton'])
+def test_qmc_independent_of_batch(qmc):
+    u = qmc_uniforms(np.arange(64), 5, 3, qmc, replicate_size=16)
+    assert u.shape == (64, 5) and np.all((u >= 0) & (u < 1))
+    np.testing.assert_array_equal(qmc_uniforms([40, 5, 17], 5, 3, qmc, replicate_size=16), u[[40, 5, 17]])
+    #   replicates are scrambled independently
+    assert not np.allclose(np.sort(u[:16], axis=0), np.sort(u[16:32], axis=0))
+
+    coords = sample(64, qmc=qmc, replicate_size=16)
+    np.testing.assert_array_equal(sample(np.arange(20, 40), qmc=qmc, replicate_size=16), coords[20:40])
+    with pytest.raises(ValueError):
+        qmc_uniforms(np.arange(4), 2, 3, 'lattice')
+
+
+def test_sobol_replicate_is_balanced():
+    #   each coordinate of a full Sobol replicate has one point in each of its 2^m strata
+    u = qmc_uniforms(np.arange(32, 64), 4, 5, 'sobol', replicate_size=32)
+    for d in range(4):
+        np.testing.assert_array_equal(np.sort(np.floor(32*u[:, d])), np.arange(32))
+
+
+def test_rqmc_estimate():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(24, 2))
+    mean, std_err, n_rep = rqmc_estimate(values, np.arange(24), 8)
+    rep_means = values.reshape(3, 8, 2).mean(axis=1)
+    assert n_rep == 3
+    np.testing.assert_allclose(mean, rep_means.mean(axis=0))
+    np.testing.assert_allclose(std_err, rep_means.std(axis=0, ddof=1)/np.sqrt(3))
+    assert np.all(rqmc_estimate(values[:8], np.arange(8), 8)[1] == 0)
+
+
+def test_rqmc_beats_monte_carlo():
+    '''
+        Mean of a smooth function of the sampled coordinates: the RQMC
+        estimate is within its error bar, which is much smaller than the
+        Monte Carlo one
+    '''
+    from scipy.special import j0
+    n, size = 1024, 128
+    def observable(coords):
+        return np.cos(coords[:, 0, :N_STATES]).sum(axis=1) + np.sum(coords[:, 0, N_STATES:]**2, axis=1)
+
+    #   <cos(r cos(2 pi theta))> = J0(r), <q^2> = q0^2 + sigma_q^2
+    r_occ, r_other = electronic_radii('wigner', N_STATES)
+    w = FRQ[6:]
+    exact = j0(r_occ) + 2*j0(r_other) + np.sum(QN0**2 + 1.0/np.tanh(BETA*w/2)/(2*w))
+
+    mean, std_err, n_rep = rqmc_estimate(observable(sample(n, qmc='sobol', replicate_size=size)), np.arange(n), size)
+    mc_err = np.std(observable(sample(n)), ddof=1)/np.sqrt(n)
+    assert n_rep == n//size
+    assert std_err < 0.5*mc_err
+    assert abs(mean - exact) < 4*std_err
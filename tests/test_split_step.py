@@ -0,0 +1,118 @@
+"""
+Splitting integrator with exact electronic propagation (rk_method = 'split')
+"""
+import numpy as np
+import pytest
+import subroutines as S
+from integrators import ExplicitRK
+
+nel, nnuc, ndof = S.nel, S.nnuc, S.ndof
+
+
+def frozen_es(rng, coupled=True):
+    '''
+        Energies with large gaps, gradients and antisymmetric NACs
+    '''
+    elecE = np.array([0.0, 0.3, 0.7])[:nel] + 0.01*rng.normal(size=nel)
+    grad = 1e-3*rng.normal(size=(nel, nnuc))
+    nac = 0.5*rng.normal(size=(nel, nel, nnuc)) if coupled else np.zeros((nel, nel, nnuc))
+    nac = 0.5*(nac - nac.transpose(1, 0, 2))
+    return elecE, grad, nac
+
+
+def initial_state(rng):
+    y = np.zeros(2*ndof)
+    y[:nel], y[ndof:ndof+nel] = rng.normal(size=nel), rng.normal(size=nel)
+    y[nel:ndof] = rng.normal(size=nnuc)
+    y[ndof+nel:] = 20.0*rng.normal(size=nnuc)
+    return y
+
+
+def split_step(au_mas, es, y, h):
+    out = np.empty_like(y)
+    S.get_split_step(au_mas, *es)(y, h, out)
+    return out
+
+
+def rk4_reference(au_mas, es, y, h, n=1000):
+    rk = ExplicitRK('rk4', 2*ndof)
+    def get_deriv(y0, der):
+        S.get_derivatives(au_mas, y0[:ndof], y0[ndof:], es[2], es[1], es[0], out=der.reshape(2, ndof))
+    y = y.copy()
+    for _ in range(n):
+        rk.step(get_deriv, y, h/n, out=y)
+    return y
+
+
+@pytest.fixture
+def system():
+    rng = np.random.default_rng(0)
+    return rng.uniform(2000.0, 30000.0, nnuc), rng
+
+
+def test_uncoupled_step_is_exact(system):
+    '''
+        Without NACs the mapping variables rotate with the energies relative
+        to their mean, exactly for any step
+    '''
+    au_mas, rng = system
+    es = frozen_es(rng, coupled=False)
+    y = initial_state(rng)
+    h = 50.0
+    out = split_step(au_mas, es, y, h)
+    c = (y[:nel] + 1j*y[ndof:ndof+nel])*np.exp(-1j*(es[0] - np.mean(es[0]))*h)
+    np.testing.assert_allclose(out[:nel] + 1j*out[ndof:ndof+nel], c, atol=1e-12)
+    np.testing.assert_allclose(out, rk4_reference(au_mas, es, y, h), atol=1e-9)
+
+
+def test_second_order_against_rk4(system):
+    '''
+        The local error of the second-order splitting is third order in the step
+    '''
+    au_mas, rng = system
+    es = frozen_es(rng)
+    y = initial_state(rng)
+    #   the electronic phases turn by more than a radian within a step
+    assert (es[0][-1] - es[0][0])*2.0 > 1.0
+    errors = [np.max(np.abs(split_step(au_mas, es, y, h) - rk4_reference(au_mas, es, y, h))) for h in [2.0, 1.0]]
+    assert np.log2(errors[0]/errors[1]) == pytest.approx(3.0, abs=0.3)
+    assert errors[1] < 1e-3
+
+
+def test_norm_is_conserved(system):
+    au_mas, rng = system
+    es = frozen_es(rng)
+    y = initial_state(rng)
+    out = split_step(au_mas, es, y, 10.0)
+    assert np.sum(out[:nel]**2 + out[ndof:ndof+nel]**2) == pytest.approx(np.sum(y[:nel]**2 + y[ndof:ndof+nel]**2), rel=1e-13)
+
+
+def test_batched_matches_single(system):
+    au_mas, rng = system
+    batch = [frozen_es(rng) for _ in range(4)]
+    ys = np.array([initial_state(rng) for _ in range(4)])
+    es = [np.array(x) for x in zip(*batch)]
+    out = np.empty_like(ys)
+    n_evals = S.get_split_step(au_mas, *es)(ys, 3.0, out)
+    assert n_evals == 2
+    for k in range(4):
+        np.testing.assert_allclose(out[k], split_step(au_mas, batch[k], ys[k], 3.0), rtol=1e-12, atol=1e-14)
+
+
+def test_in_place(system):
+    au_mas, rng = system
+    es = frozen_es(rng)
+    y = initial_state(rng)
+    expected = split_step(au_mas, es, y, 3.0)
+    S.get_split_step(au_mas, *es)(y, 3.0, y)
+    np.testing.assert_allclose(y, expected, rtol=1e-14)
+
+
+def test_split_propagation(run_rk4):
+    '''
+        Trajectory of `rk4` with rk_method = 'split' against small RK4 steps
+    '''
+    ref = run_rk4(0.25, 20.0, mts_substeps=4)
+    times, coords = run_rk4(2.0, 20.0, rk_method='split', mts_substeps=4)
+    idx = np.searchsorted(ref[0], times - 1e-8)
+    assert np.max(np.abs(coords - ref[1][..., idx])) < 1e-3
@@ -0,0 +1,117 @@
+"""
+Adaptive completion polling of the asynchronous TeraChem clients, against
+in-process mock TCPB servers
+"""
+import time
+import asyncio
+import numpy as np
+import pytest
+from tcpb.exceptions import ServerError
+from qcRunners import TeraChem
+from qcRunners.TeraChem import TCRunner
+from qcRunners.TCAsync import AdaptiveBackoff, JobTimeHistory, AsyncTCLoop
+from qcRunners.TCServerFarm import find_free_ports
+from qcRunners.TCMockServer import MockTCServer, MockTCModel, ANG2BOHR
+
+#   water, angstrom
+ATOMS = ['O', 'H', 'H']
+GEOM = np.array([[0.0, 0.0, 0.1173], [0.0, 0.7572, -0.4692], [0.0, -0.7572, -0.4692]])
+TC_OPTIONS = {'method': 'hf', 'basis': 'sto-3g', 'charge': 0, 'spinmult': 1, 'closed_shell': True, 'restricted': True}
+JOB_OPTS = {'atoms': ATOMS, **TC_OPTIONS}
+LATENCY = {'energy': [0.2, 0.0], 'gradient': [0.2, 0.0], 'coupling': [0.2, 0.0]}
+
+
+@pytest.fixture
+def servers(tmp_path):
+    '''
+        Starts one mock server per configuration and returns their ports
+    '''
+    started = []
+    def start(*configs):
+        ports = find_free_ports(len(configs))
+        for port, config in zip(ports, configs):
+            started.append(MockTCServer(port, config={'latency': LATENCY, **config}, root=str(tmp_path)).start())
+        return ports
+    yield start
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def tc_loop():
+    tc_loop = AsyncTCLoop()
+    yield tc_loop
+    tc_loop.shutdown()
+
+
+def test_backoff_without_history():
+    backoff = AdaptiveBackoff(None, min_interval=0.01, max_interval=0.05, growth=2.0)
+    intervals = [backoff.next_interval(0.0) for _ in range(5)]
+    assert intervals == pytest.approx([0.01, 0.02, 0.04, 0.05, 0.05])
+
+
+def test_backoff_waits_for_expected_time():
+    backoff = AdaptiveBackoff(2.0, min_interval=0.01, max_interval=0.5, growth=2.0, lead=0.8)
+    #   no checks until shortly before the job is expected to finish
+    assert backoff.next_interval(0.1) == pytest.approx(1.5)
+    #   then at most a tenth of the expected time apart
+    assert [backoff.next_interval(1.6) for _ in range(6)] == pytest.approx([0.01, 0.02, 0.04, 0.08, 0.16, 0.2])
+
+    #   submitted late: checks start right away
+    backoff = AdaptiveBackoff(2.0, min_interval=0.01, lead=0.8)
+    assert backoff.next_interval(1.7) == pytest.approx(0.01)
+
+
+def test_job_time_history():
+    history = JobTimeHistory(n_keep=3)
+    assert history.expected('gradient_0') is None
+    for run_time in [10.0, 1.0, 2.0, 3.0]:
+        history.add('gradient_0', run_time)
+    #   median of the last `n_keep` run times
+    assert history.expected('gradient_0') == 2.0
+    assert history.expected('gradient_1') is None
+
+
+def test_jobs_of_both_servers_run_together(servers, tc_loop):
+    ports = servers({}, {})
+    clients = [tc_loop.get_client('127.0.0.1', port) for port in ports]
+    assert tc_loop.get_client('127.0.0.1', ports[0]) is clients[0]
+    async def run_both(name):
+        jobs = [tc_loop.compute_job(client, name, 'gradient', GEOM, 'angstrom', **JOB_OPTS) for client in clients]
+        return await asyncio.gather(*jobs)
+
+    start = time.time()
+    first = tc_loop.run(run_both('gradient_0'))
+    assert time.time() - start < 0.35
+    energies, grads, _, _ = MockTCModel().evaluate(GEOM.ravel()*ANG2BOHR)
+    for results, stats in first:
+        assert results['energy'] == pytest.approx(energies[0], abs=1e-12)
+        np.testing.assert_allclose(np.ravel(results['gradient']), grads[0], atol=1e-12)
+        assert stats['n_polls'] > 1
+    assert tc_loop.history.expected('gradient_0') == pytest.approx(0.2, abs=0.05)
+
+    #   with a known run time the jobs are polled only around their expected end
+    second = tc_loop.run(run_both('gradient_0'))
+    assert all(late['n_polls'] < early['n_polls'] for (_, late), (_, early) in zip(second, first))
+    assert tc_loop.job_stats['gradient_0']['n_jobs'] == 4
+
+
+def test_server_error_reaches_the_caller(servers, tmp_path, monkeypatch):
+    '''
+        A job that fails on every try raises the server error to the caller
+        of the runner instead of exiting
+    '''
+    sleep = asyncio.sleep
+    async def no_wait(delay):
+        await sleep(min(delay, 0.01))
+    monkeypatch.setattr(TeraChem.asyncio, 'sleep', no_wait)
+
+    ports = servers({'error_prob': 1.0})
+    runner = TCRunner(['127.0.0.1'], ports, ATOMS, {**TC_OPTIONS, 'cis': 'yes', 'cisnumstates': 2}, tc_spec_job_opts={},
+                      tc_initial_job_options={'n_frames': 0}, server_roots=str(tmp_path), run_options={'max_state': 1, 'nacs': 'all'},
+                      max_wait=5, use_async=True)
+    try:
+        with pytest.raises(ServerError):
+            runner.run_TC_new_geom(GEOM)
+    finally:
+        runner._async.shutdown()
@@ -0,0 +1,101 @@
+"""
+Background removal of the directories of old TeraChem jobs
+"""
+import os
+import numpy as np
+import pytest
+from qcRunners.TeraChem import TCRunner
+from qcRunners.TCJanitor import TCJanitor
+from qcRunners.TCServerFarm import find_free_ports
+from qcRunners.TCMockServer import MockTCServer
+
+#   water, angstrom
+ATOMS = ['O', 'H', 'H']
+GEOM = np.array([[0.0, 0.0, 0.1173], [0.0, 0.7572, -0.4692], [0.0, -0.7572, -0.4692]])
+TC_OPTIONS = {'method': 'hf', 'basis': 'sto-3g', 'charge': 0, 'spinmult': 1, 'closed_shell': True, 'restricted': True,
+              'cis': 'yes', 'cisnumstates': 2}
+LATENCY = {'energy': [0.01, 0.0], 'gradient': [0.01, 0.0], 'coupling': [0.01, 0.0]}
+
+
+def make_job(root, job_id, scr_dir=None):
+    '''
+        Job and scratch directories as a TeraChem job leaves them, and the
+        job's results
+    '''
+    job_dir = f'job_{job_id}'
+    scr_dir = scr_dir or f'scr_{job_id}'
+    os.makedirs(os.path.join(root, job_dir))
+    os.makedirs(os.path.join(root, scr_dir), exist_ok=True)
+    for path in [f'{job_dir}/tc.out', f'{scr_dir}/c0', f'{scr_dir}/grad_{job_id}.xyz']:
+        open(os.path.join(root, path), 'w').close()
+    return {'server_root': root, 'job_dir': job_dir, 'job_scr_dir': scr_dir, 'orbfile': f'{scr_dir}/c0'}
+
+
+def existing(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, files in os.walk(root) for f in files)
+
+
+def test_keeps_the_last_frames(tmp_path):
+    root = str(tmp_path)
+    open(os.path.join(root, 'input.xyz'), 'w').close()
+    janitor = TCJanitor(retention=2)
+    frames = [[make_job(root, 2*i), make_job(root, 2*i + 1)] for i in range(3)]
+    for frame in frames:
+        janitor.add_frame('traj_0', frame)
+    janitor.flush()
+    #   the first frame is removed, the last two and other files are kept
+    assert existing(root) == sorted(['input.xyz'] + [f'{d}_{i}/{f}' for i in range(2, 6) for d, f in [('job', 'tc.out'), ('scr', 'c0'), ('scr', f'grad_{i}.xyz')]])
+    assert janitor.n_dirs_removed == 4
+
+    #   trajectories are tracked separately
+    janitor.add_frame('traj_1', [make_job(root, 6)])
+    janitor.flush()
+    assert os.path.isdir(os.path.join(root, 'job_6'))
+
+
+def test_shared_scratch_is_kept(tmp_path):
+    root = str(tmp_path)
+    janitor = TCJanitor(retention=1)
+    janitor.add_frame('traj_0', [make_job(root, 0, 'scr')])
+    janitor.add_frame('traj_0', [make_job(root, 1, 'scr')])
+    janitor.flush()
+    #   the scratch directory is also used by the kept frame
+    assert existing(root) == ['job_1/tc.out', 'scr/c0', 'scr/grad_0.xyz', 'scr/grad_1.xyz']
+
+    #   or by the kept frame of another trajectory
+    janitor.add_frame('traj_1', [make_job(root, 2, 'scr_b')])
+    janitor.add_frame('traj_0', [make_job(root, 3, 'scr_b')])
+    janitor.flush()
+    assert not os.path.isdir(os.path.join(root, 'job_1')) and os.path.isfile(os.path.join(root, 'scr_b', 'c0'))
+
+
+def test_keeps_only_the_guesses(tmp_path):
+    root = str(tmp_path)
+    janitor = TCJanitor(retention='guess')
+    janitor.add_frame('traj_0', [make_job(root, 0), make_job(root, 1)])
+    janitor.add_frame('traj_0', [make_job(root, 2), make_job(root, 3)])
+    janitor.flush()
+    #   the orbitals the next frame starts from, and the last job directory
+    assert existing(root) == ['job_3/tc.out', 'scr_3/c0']
+    assert janitor.n_dirs_removed == 6 and janitor.n_files_removed == 2
+
+    with pytest.raises(ValueError):
+        TCJanitor(retention=0)
+
+
+def test_runner_removes_old_frames(tmp_path):
+    root = str(tmp_path)
+    port, = find_free_ports(1)
+    server = MockTCServer(port, config={'latency': LATENCY}, root=root).start()
+    janitor = TCJanitor(retention=1)
+    runner = TCRunner(['127.0.0.1'], [port], ATOMS, TC_OPTIONS, tc_spec_job_opts={}, tc_initial_job_options={'n_frames': 0},
+                      server_roots=[root], run_options={'max_state': 1, 'nacs': 'all'}, max_wait=5, janitor=janitor)
+    try:
+        for i in range(3):
+            runner.run_TC_new_geom(GEOM + 0.01*i)
+        janitor.flush()
+        last = set(res['job_dir'] for res in runner._prev_results)
+        job_dirs = set(f'mock_{port}/{d}' for d in os.listdir(os.path.join(root, f'mock_{port}')) if d.startswith('job_'))
+        assert job_dirs == last
+    finally:
+        server.stop()
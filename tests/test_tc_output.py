@@ -0,0 +1,85 @@
+"""
+Background capture of the tc.out files of TeraChem jobs, and their logging
+"""
+import os
+import gzip
+import numpy as np
+import pytest
+import yaml
+from fileIO import TCJobsLogger, LoggerData
+from qcRunners.TCOutput import TCOutputCapture, CapturedOutput
+
+TC_OUT = [
+    'TeraChem v1.9',
+    'WARNING: mock basis set',
+    'FINAL ENERGY: -76.0107465155 a.u.',
+    'Total processing time: 1.25 sec',
+    'Job finished',
+]
+
+
+@pytest.fixture
+def job(tmp_path):
+    '''
+        Results of a finished job, relative to the server root `tmp_path`
+    '''
+    os.makedirs(tmp_path/'scr'/'job_1')
+    (tmp_path/'scr'/'job_1'/'tc.out').write_text('\n'.join(TC_OUT) + '\n')
+    return {'job_dir': 'scr/job_1', 'energy': np.float64(-76.01), 'gradient': np.zeros((3, 3))}
+
+
+def test_capture_modes(job, tmp_path):
+    expected = {
+        'full': TC_OUT,
+        'tail': TC_OUT[-2:],
+        'summary': {'final_energy': -76.0107465155, 'processing_time': 1.25, 'finished': True,
+                    'n_warnings': 1, 'warnings': ['WARNING: mock basis set']},
+    }
+    for mode, output in expected.items():
+        results = TCOutputCapture(mode, n_tail=2).capture(dict(job), str(tmp_path))
+        assert isinstance(results['tc.out'], CapturedOutput)
+        assert results['tc.out'].result() == output
+
+    results = TCOutputCapture('path').capture(dict(job), str(tmp_path))
+    assert results['tc.out'] == str(tmp_path/'scr'/'job_1'/'tc.out')
+    assert 'tc.out' not in TCOutputCapture('none').capture(dict(job), str(tmp_path))
+
+    with pytest.raises(ValueError):
+        TCOutputCapture('lines')
+
+
+def test_missing_output(job, tmp_path):
+    results = TCOutputCapture('full').capture({'job_dir': 'scr/job_2'}, str(tmp_path))
+    assert results['tc.out'].result() is None
+
+
+def test_archive(job, tmp_path):
+    capture = TCOutputCapture('path', archive_dir=str(tmp_path/'archive'))
+    results = capture.capture(dict(job), str(tmp_path))
+    capture.flush()
+    assert results['tc.out'] == str(tmp_path/'archive'/'scr_job_1.tc.out.gz')
+    with gzip.open(results['tc.out'], 'rt') as file:
+        assert file.read().splitlines() == TC_OUT
+
+
+def test_captured_output_is_logged(job, tmp_path):
+    '''
+        The jobs logger writes the captured lines, also once the job
+        directory is gone
+    '''
+    capture = TCOutputCapture('full')
+    results = capture.capture(dict(job), str(tmp_path))
+    capture.flush()
+    os.remove(tmp_path/'scr'/'job_1'/'tc.out')
+
+    logger = TCJobsLogger(str(tmp_path/'jobs_data.yaml'))
+    logger.write(LoggerData(0.5, jobs_data=[results]))
+    logger.write(LoggerData(1.0, jobs_data=[results]))
+    logger._file.close()
+    with open(tmp_path/'jobs_data.yaml') as file:
+        frames = list(yaml.safe_load_all(file))
+    assert [frame['time'] for frame in frames] == [0.5, 1.0]
+    for frame in frames:
+        logged, = frame['jobs_data']
+        assert logged['tc.out'] == TC_OUT
+        assert logged['energy'] == -76.01 and logged['gradient'] == [[0.0]*3]*3
@@ -0,0 +1,170 @@
+"""
+Failover of the TeraChem server pool, against in-process mock TCPB servers
+"""
+import time
+import numpy as np
+import pytest
+from qcRunners import TeraChem
+from qcRunners.TeraChem import TCRunner, format_output_LSCIVR
+from qcRunners.TCServerFarm import find_free_ports
+from qcRunners.TCMockServer import MockTCServer, MockTCModel, ANG2BOHR
+
+#   water, angstrom
+ATOMS = ['O', 'H', 'H']
+GEOM = np.array([[0.0, 0.0, 0.1173], [0.0, 0.7572, -0.4692], [0.0, -0.7572, -0.4692]])
+TC_OPTIONS = {'method': 'hf', 'basis': 'sto-3g', 'charge': 0, 'spinmult': 1, 'closed_shell': True, 'restricted': True,
+              'cis': 'yes', 'cisnumstates': 2}
+LATENCY = {'energy': [0.01, 0.0], 'gradient': [0.01, 0.0], 'coupling': [0.01, 0.0]}
+N_JOBS = 3
+
+
+@pytest.fixture
+def mock_servers():
+    '''
+        Mock servers started by `pool`, in the order of the pool's servers
+    '''
+    servers = []
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def pool(tmp_path, mock_servers):
+    '''
+        Starts one mock server per configuration and returns a `TCRunner`
+        that shares them as a pool
+    '''
+    runners = []
+    def start(*configs, **options):
+        ports = find_free_ports(len(configs))
+        for port, config in zip(ports, configs):
+            mock_servers.append(MockTCServer(port, config={'latency': LATENCY, **config}, root=str(tmp_path)).start())
+        runner = TCRunner(['127.0.0.1']*len(ports), ports, ATOMS, TC_OPTIONS, tc_spec_job_opts={}, tc_initial_job_options={'n_frames': 0},
+                          server_roots=str(tmp_path), run_options={'max_state': 1, 'nacs': 'all'}, max_wait=5, use_pool=True, **options)
+        runners.append(runner)
+        return runner
+    yield start
+    for runner in runners:
+        runner._pool.shutdown()
+
+
+def assert_mock_results(job_results):
+    #   the mock model is centred on the first geometry a server evaluates
+    energies, grads, nacs, _ = MockTCModel().evaluate(GEOM.ravel()*ANG2BOHR)
+    elecE, grad, nac, trans_dips = format_output_LSCIVR(job_results)
+    np.testing.assert_allclose(elecE, energies[:2], atol=1e-12)
+    np.testing.assert_allclose(grad, grads[:2], atol=1e-12)
+
+
+def test_failing_server_is_quarantined(pool):
+    '''
+        The jobs of a server that answers with errors are re-run on the
+        healthy one, and the failing server takes no further jobs
+    '''
+    runner = pool({'error_prob': 1.0}, {})
+    job_results, times = runner.run_TC_new_geom(GEOM)
+    assert_mock_results(job_results)
+    runner.run_TC_new_geom(GEOM + 0.01)
+
+    failing, healthy = runner._pool.get_stats()
+    assert not failing['healthy'] and failing['failures'] == 1 and failing['jobs'] == 0
+    assert healthy['healthy'] and healthy['jobs'] == 2*N_JOBS
+
+
+def test_stalled_server_is_quarantined(pool):
+    runner = pool({'stall_prob': 1.0, 'stall_time': 10.0}, {})
+    runner._pool.max_job_time = 0.5
+    job_results, times = runner.run_TC_new_geom(GEOM)
+    assert_mock_results(job_results)
+    stalled, healthy = runner._pool.get_stats()
+    assert not stalled['healthy'] and stalled['failures'] == 1
+    assert healthy['jobs'] == N_JOBS
+
+
+def test_failed_frame_in_batch(pool):
+    '''
+        A job that fails `max_attempts` times fails its frame, which
+        `run_TC_batch` returns as (None, {}) without touching the
+        trajectory's state
+    '''
+    runner = pool({'error_prob': 1.0})
+    runner._pool.max_attempts = 1
+    assert runner.run_TC_batch([GEOM], traj_ids=[7]) == [(None, {})]
+    assert 7 not in runner._batch_states
+    assert not runner._pool.get_stats()[0]['healthy']
+
+
+def test_skipped_nac_time_is_measured(pool):
+    '''
+        The time saved by skipping a NAC job is its measured run time,
+        also when the frames run on a pool; unknown before it has run
+    '''
+    runner = pool({})
+    assert runner.set_skipped_nacs([(0, 1)]) is None
+    runner.set_skipped_nacs([])
+    _, times = runner.run_TC_new_geom(GEOM)
+    assert runner.set_skipped_nacs([(1, 0)]) == pytest.approx(times['nac_0_1'])
+
+
+def test_next_frame_returns_to_last_server(pool, monkeypatch):
+    '''
+        The jobs of a frame are queued on the server that finished the
+        trajectory's previous frame, idle servers steal from the back of
+        that queue, and the next frame is guessed from the job that
+        finished last
+    '''
+    guesses = []
+    set_guess = TeraChem._set_guess
+    def record_guess(job_opts, *args):
+        set_guess(job_opts, *args)
+        guesses.append(job_opts.get('guess'))
+    monkeypatch.setattr(TeraChem, '_set_guess', record_guess)
+
+    runner = pool({'latency': {key: [0.3, 0.0] for key in LATENCY}}, {})
+    job_results, _ = runner.run_TC_new_geom(GEOM)
+    #   the fast server steals the last two jobs, so the first one finishes last
+    assert runner._pool._affinity[runner._restart_tag] == 0
+    assert runner._pool._finish_order[runner._restart_tag][-1] == 0
+    slow, fast = runner._pool.get_stats()
+    assert (slow['local'], slow['stolen'], fast['local'], fast['stolen']) == (1, 0, 0, N_JOBS - 1)
+
+    runner.run_TC_new_geom(GEOM + 0.01)
+    slow, fast = runner._pool.get_stats()
+    assert (slow['local'], slow['stolen'], fast['local'], fast['stolen']) == (2, 0, 0, 2*N_JOBS - 2)
+    #   every job of the second frame starts from the orbitals of the slow server
+    assert guesses[N_JOBS:] != [] and all(guess is not None for guess in guesses[N_JOBS:])
+    assert all(f'mock_{slow["server"].split(":")[1]}/' in guess for guess in guesses[N_JOBS:])
+
+
+def test_hedged_copy_wins(pool, mock_servers):
+    '''
+        A straggler is re-run on an idle server; the first copy to finish
+        is used, and the cancelled copy does not replace its result
+    '''
+    runner = pool({}, {}, hedge_quantile=0.5)
+    broker = runner._pool
+    broker.max_job_time = 10.0
+    for i in range(broker.hedge_min_samples):
+        _, times = runner.run_TC_new_geom(GEOM + 0.01*i)
+        assert times['Hedged'] == 0
+
+    #   the server that takes the next frame stalls on every job
+    slow = broker._affinity[runner._restart_tag]
+    fast = 1 - slow
+    mock_servers[slow].config.update({'stall_prob': 1.0, 'stall_time': 1.0})
+    n_slow_jobs = broker.get_stats()[slow]['jobs']
+    _, times = runner.run_TC_new_geom(GEOM)
+    assert times['Hedged'] == 1
+    assert broker.n_hedged == 1 and broker.n_hedge_wins == 1
+    winner = runner._prev_results
+    fast_dir = f'mock_{mock_servers[fast].port}/'
+    assert all(res['job_dir'].startswith(fast_dir) for res in winner)
+
+    #   the stalled copy is abandoned, and its server drained; the runner
+    #   holds the frame's own result list, so a late copy would show here
+    time.sleep(1.2)
+    assert runner._prev_results is winner and all(res['job_dir'].startswith(fast_dir) for res in winner)
+    stats = broker.get_stats()
+    assert stats[slow]['jobs'] == n_slow_jobs and stats[slow]['draining']
+    assert len(broker._censored) == 1
@@ -0,0 +1,94 @@
+"""
+Longest-predicted-first scheduling of the jobs of a TeraChem frame
+"""
+import time
+import threading
+import numpy as np
+import pytest
+from qcRunners.TCScheduler import JobCostModel, TCJobScheduler
+
+
+def frame_jobs(n_states=3):
+    jobs = {f'gradient_{i}': {'opts': {}, 'type': 'gradient', 'state': i} for i in range(n_states)}
+    for i in range(n_states):
+        for j in range(i + 1, n_states):
+            jobs[f'nac_{i}_{j}'] = {'opts': {}, 'type': 'coupling', 'state': j}
+    return jobs
+
+
+def test_fallback_then_history_mean():
+    model = JobCostModel(n_keep=2)
+    assert model.measured('nac_0_1') is None
+    assert model.predict('nac_0_1', {'type': 'coupling', 'state': 1}) == 3.0
+    assert model.predict('gradient_2', {'type': 'gradient', 'state': 2}) == 3.0
+    for run_time in [1.0, 2.0, 4.0]:
+        model.update({'nac_0_1': run_time})
+    #   mean of the last n_keep run times
+    assert model.measured('nac_0_1') == 3.0
+    assert model.predict('nac_0_1', {'type': 'coupling', 'state': 1}) == 3.0
+    assert model.measured('gradient_0') is None
+
+
+def test_lpt_order():
+    model = JobCostModel()
+    jobs = frame_jobs()
+    #   no history: 2 + state seconds for couplings, 1 + state for gradients
+    assert model.lpt_order(jobs) == ['nac_0_2', 'nac_1_2', 'gradient_2', 'nac_0_1', 'gradient_1', 'gradient_0']
+    model.update({'gradient_0': 10.0, 'nac_1_2': 0.1})
+    assert model.lpt_order(jobs)[0] == 'gradient_0' and model.lpt_order(jobs)[-1] == 'nac_1_2'
+
+
+def test_workers_run_every_job():
+    scheduler = TCJobScheduler(3)
+    jobs = frame_jobs(4)
+    seen = []
+    lock = threading.Lock()
+    def run_job(client_ID, name, props, frame_results):
+        time.sleep(0.01)
+        with lock:
+            seen.append((client_ID, name, len(frame_results)))
+        return {'name': name, 'client': client_ID}
+    try:
+        results, times = scheduler.run_frame(jobs, run_job)
+        #   results in the order of the jobs, whichever client ran them
+        assert [r['name'] for r in results] == list(jobs)
+        assert sorted(times) == sorted(jobs) and len(seen) == len(jobs)
+        assert len(set(client for client, _, _ in seen)) > 1
+        #   every client sees the results it produced earlier in the frame
+        for client in range(3):
+            counts = [n for c, _, n in seen if c == client]
+            assert counts == list(range(len(counts)))
+    finally:
+        scheduler.shutdown()
+
+
+def test_failed_job_does_not_stall_the_frame():
+    scheduler = TCJobScheduler(2)
+    jobs = frame_jobs()
+    done = []
+    def run_job(client_ID, name, props, frame_results):
+        if name == 'nac_0_2':
+            raise RuntimeError('job failed')
+        time.sleep(0.01)
+        done.append(name)
+        return name
+    try:
+        with pytest.raises(RuntimeError, match='job failed'):
+            scheduler.run_frame(jobs, run_job)
+        #   the other jobs ran, and the workers keep serving later frames
+        assert sorted(done) == sorted(name for name in jobs if name != 'nac_0_2')
+        results, _ = scheduler.run_frame(frame_jobs(2), lambda c, name, p, r: name)
+        assert results == list(frame_jobs(2))
+    finally:
+        scheduler.shutdown()
+
+
+def test_makespan_and_ideal():
+    scheduler = TCJobScheduler(2)
+    scheduler.record({'a': 3.0, 'b': 1.0, 'c': 1.0}, makespan=3.5)
+    #   longest job above the even split
+    assert scheduler.ideal == 3.0 and scheduler.makespan == 3.5
+    scheduler.record({'a': 2.0, 'b': 2.0, 'c': 2.0}, makespan=4.0)
+    assert scheduler.n_frames == 2
+    assert scheduler.ideal == pytest.approx(6.0) and scheduler.makespan == pytest.approx(7.5)
+    assert scheduler.cost_model.measured('a') == 2.5
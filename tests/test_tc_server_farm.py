@@ -0,0 +1,81 @@
+"""
+Startup and teardown of the local TeraChem server farm, with a stub
+`terachem` on PATH that runs the mock TCPB server
+"""
+import os
+import sys
+import json
+import time
+import psutil
+import pytest
+from qcRunners.TCServerFarm import TCServerFarm, port_in_use
+
+PYSCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pysces')
+
+STUB = f'''#!{sys.executable}
+import os, sys, json, time, subprocess
+sys.path.insert(0, {PYSCES!r})
+if os.environ.get('STUB_EXIT'):
+    sys.exit(3)
+child = subprocess.Popen(['sleep', '600'])
+info = {{'pid': os.getpid(), 'child': child.pid, 'argv': sys.argv[1:], 'device': os.environ.get('CUDA_VISIBLE_DEVICES')}}
+time.sleep(float(os.environ.get('STUB_DELAY', '0')))
+from qcRunners.TCMockServer import main
+info['listening'] = time.time()
+with open('stub.json', 'w') as file:
+    json.dump(info, file)
+main(sys.argv[1:] + ['--host', '127.0.0.1'])
+'''
+
+
+@pytest.fixture
+def stub_terachem(tmp_path, monkeypatch):
+    bin_dir = tmp_path/'bin'
+    bin_dir.mkdir()
+    exe = bin_dir/'terachem'
+    exe.write_text(STUB)
+    exe.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    return tmp_path
+
+
+def is_gone(pid):
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+
+def test_start_and_stop(stub_terachem):
+    roots = [str(stub_terachem/f'server_{i}') for i in range(3)]
+    farm = TCServerFarm(3, devices=['0', '1,2'], server_roots=roots, host='127.0.0.1',
+                        probe_interval=0.05, env={'STUB_DELAY': '0.5'})
+    start = time.time()
+    farm.start()
+    ready = time.time()
+    try:
+        assert len(set(farm.ports)) == 3 and all(port_in_use('127.0.0.1', port) for port in farm.ports)
+        info = [json.load(open(os.path.join(root, 'stub.json'))) for root in roots]
+        assert [i['argv'] for i in info] == [['-s', str(port)] for port in farm.ports]
+        #   round-robin device pinning
+        assert [i['device'] for i in info] == ['0', '1,2', '0']
+        #   start returns once the last server listens, not after a fixed time
+        last = max(i['listening'] for i in info)
+        assert start + 0.5 < last < ready < last + 1.0
+    finally:
+        farm.stop()
+
+    pids = [i['pid'] for i in info] + [i['child'] for i in info]
+    assert all(is_gone(pid) for pid in pids)
+    assert not any(port_in_use('127.0.0.1', port) for port in farm.ports)
+
+
+def test_failed_startup_stops_all_servers(stub_terachem):
+    farm = TCServerFarm(2, server_roots=str(stub_terachem/'servers'), host='127.0.0.1', probe_interval=0.05,
+                        env={'STUB_EXIT': '1'})
+    with pytest.raises(RuntimeError, match='exited with code 3'):
+        farm.start()
+    assert farm._processes == [None, None]
+
+    with pytest.raises(ValueError):
+        TCServerFarm(2, ports=[1234])
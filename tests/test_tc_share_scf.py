@@ -0,0 +1,55 @@
+"""
+Jobs of a TeraChem frame that start from one converged reference job,
+against in-process mock TCPB servers
+"""
+import numpy as np
+import pytest
+from qcRunners.TeraChem import TCRunner
+from qcRunners.TCServerFarm import find_free_ports
+from qcRunners.TCMockServer import MockTCServer
+
+#   water, angstrom
+ATOMS = ['O', 'H', 'H']
+GEOM = np.array([[0.0, 0.0, 0.1173], [0.0, 0.7572, -0.4692], [0.0, -0.7572, -0.4692]])
+TC_OPTIONS = {'method': 'hf', 'basis': 'sto-3g', 'charge': 0, 'spinmult': 1, 'closed_shell': True, 'restricted': True,
+              'cis': 'yes', 'cisnumstates': 2}
+LATENCY = {'energy': [0.01, 0.0], 'gradient': [0.01, 0.0], 'coupling': [0.01, 0.0]}
+N_JOBS = 3
+
+
+@pytest.fixture(params=[False, True], ids=['threads', 'async'])
+def runner(request, tmp_path):
+    '''
+        `TCRunner` with SCF sharing on two mock servers, with the blocking
+        or the asynchronous clients
+    '''
+    ports = find_free_ports(2)
+    servers = [MockTCServer(port, config={'latency': LATENCY}, root=str(tmp_path)).start() for port in ports]
+    runner = TCRunner(['127.0.0.1']*2, ports, ATOMS, TC_OPTIONS, tc_spec_job_opts={}, tc_initial_job_options={'n_frames': 0},
+                      server_roots=[str(tmp_path)]*2, run_options={'max_state': 1, 'nacs': 'all', 'share_scf': True}, max_wait=5,
+                      use_async=request.param)
+    yield runner
+    if runner._async is not None:
+        runner._async.shutdown()
+    runner._scheduler.shutdown()
+    for server in servers:
+        server.stop()
+
+
+def test_jobs_start_from_the_reference(runner):
+    _, times = runner.run_TC_new_geom(GEOM)
+    reference, *others = runner._prev_results
+    #   the reference job runs first and has no guess in the first frame
+    assert reference['run'] == 'gradient' and 'guess' not in reference
+    assert len(others) == N_JOBS - 1
+    assert all(res['guess'].endswith(reference['orbfile']) for res in others)
+    assert times['Saved_SCF'] == N_JOBS - 1
+
+    #   later references start from the previous frame, the other jobs
+    #   again from the reference of their own frame
+    newest = runner._prev_results[-1]['orbfile']
+    _, times = runner.run_TC_new_geom(GEOM + 0.01)
+    reference, *others = runner._prev_results
+    assert reference['guess'].endswith(newest)
+    assert all(res['guess'].endswith(reference['orbfile']) for res in others)
+    assert times['Saved_SCF'] == N_JOBS - 1
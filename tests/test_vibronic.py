@@ -0,0 +1,99 @@
+"""
+Vibronic coupling fits to QC data generated by known LVC/QVC models
+"""
+import numpy as np
+from model_hamiltonians import LVCModel, ModelRunner
+from vibronic import fit_lvc, fit_gamma, fit_errors
+
+N_MODES, NNUC = 4, 6
+FRQ = np.array([0.004, 0.007, 0.011, 0.016])
+ENERGIES = np.array([0.0, 0.03, 0.05])
+
+
+def true_model(quadratic=False, seed=0):
+    rng = np.random.default_rng(seed)
+    lam = 0.002*rng.normal(size=(3, 3, N_MODES))
+    lam = 0.5*(lam + lam.transpose(1, 0, 2))
+    lam[np.arange(3), np.arange(3)] = 0.0
+    gamma = None
+    if quadratic:
+        gamma = 5e-4*rng.normal(size=(3, N_MODES, N_MODES))
+        gamma = 0.5*(gamma + gamma.transpose(0, 2, 1))
+    return LVCModel(FRQ, ENERGIES, 0.003*rng.normal(size=(3, N_MODES)), lam, gamma)
+
+
+def molecule(model, seed=1):
+    rng = np.random.default_rng(seed)
+    modes = np.linalg.qr(rng.normal(size=(NNUC, NNUC)))[0][:N_MODES]
+    au_mas = rng.uniform(2000.0, 30000.0, NNUC)
+    runner = ModelRunner(model, modes, au_mas, rng.normal(size=N_MODES))
+    modes_cart = modes/runner.sqrt_mas
+    x0 = runner.Q0 @ modes_cart
+    return runner, modes_cart, x0
+
+
+def test_fit_lvc_recovers_parameters():
+    model = true_model()
+    runner, modes_cart, x0 = molecule(model)
+    elecE, grad, nac, _ = runner.compute(x0)
+
+    energies, kappa, lam = fit_lvc(FRQ, modes_cart, elecE, grad, nac)
+    np.testing.assert_allclose(energies, ENERGIES, atol=1e-14)
+    np.testing.assert_allclose(kappa, model.kappa, atol=1e-13)
+    np.testing.assert_allclose(lam, model.lam, atol=1e-13)
+
+    #   the fitted model reproduces the energies away from the reference
+    fitted = ModelRunner(LVCModel(FRQ, energies, kappa, lam), runner.modes, runner.sqrt_mas**2, runner.Q0)
+    points = x0 + np.random.default_rng(2).normal(size=(5, NNUC))*0.02
+    rms, max_dev = fit_errors(fitted, points, runner.compute(points)[0])
+    assert np.all(max_dev < 1e-12) and np.all(rms <= max_dev)
+
+
+def displaced_gradients(runner, modes_cart, x0, sel, step):
+    '''
+        Gradients with respect to the dimensionless coordinates at +/- step
+        along the modes `sel`, as computed by `pysces lvc --order 2`
+    '''
+    points = []
+    for k in sel:
+        dx = step/np.sqrt(FRQ[k])*modes_cart[k]
+        points += [x0 + dx, x0 - dx]
+    elecE, grad, nac, _ = runner.compute(np.array(points))
+    grad_q = (grad @ modes_cart.T)/np.sqrt(FRQ)
+    return grad_q[0::2], grad_q[1::2], np.array(points), elecE
+
+
+def test_fit_gamma_recovers_quadratic_couplings():
+    model = true_model(quadratic=True)
+    runner, modes_cart, x0 = molecule(model)
+    energies, kappa, lam = fit_lvc(FRQ, modes_cart, *runner.compute(x0)[:3])
+
+    sel = list(range(N_MODES))
+    grad_plus, grad_minus, points, elecE = displaced_gradients(runner, modes_cart, x0, sel, 0.01)
+    gamma = fit_gamma(FRQ, energies, lam, sel, 0.01, grad_plus, grad_minus)
+    np.testing.assert_allclose(gamma, gamma.transpose(0, 2, 1))
+    np.testing.assert_allclose(gamma, model.gamma, atol=1e-6)
+
+    #   the QVC fit is much better than the LVC fit at the displaced points
+    _, _, points, elecE = displaced_gradients(runner, modes_cart, x0, sel, 1.0)
+    lvc = ModelRunner(LVCModel(FRQ, energies, kappa, lam), runner.modes, runner.sqrt_mas**2, runner.Q0)
+    qvc = ModelRunner(LVCModel(FRQ, energies, kappa, lam, gamma), runner.modes, runner.sqrt_mas**2, runner.Q0)
+    assert np.all(fit_errors(qvc, points, elecE)[1] < 0.01*fit_errors(lvc, points, elecE)[1])
+
+
+def test_fit_gamma_partial_modes():
+    '''
+        Columns of modes that were not displaced are mirrored from the
+        displaced ones, the rest stays zero
+    '''
+    model = true_model(quadratic=True)
+    runner, modes_cart, x0 = molecule(model)
+    energies, kappa, lam = fit_lvc(FRQ, modes_cart, *runner.compute(x0)[:3])
+
+    sel = [0, 2]
+    grad_plus, grad_minus, _, _ = displaced_gradients(runner, modes_cart, x0, sel, 0.01)
+    gamma = fit_gamma(FRQ, energies, lam, sel, 0.01, grad_plus, grad_minus)
+    known = np.zeros((N_MODES, N_MODES), dtype=bool)
+    known[:, sel] = known[sel, :] = True
+    np.testing.assert_allclose(gamma[:, known], model.gamma[:, known], atol=1e-6)
+    assert not np.any(gamma[:, ~known])